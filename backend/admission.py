@@ -0,0 +1,136 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+# Off unless asked for: the default limits are a starting point, to be set
+# from a tenant's measured load before requests are shed on them.
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "0") == "1"
+# "class=rate/burst/concurrency": token-bucket refill per second, bucket
+# size, and requests in flight, each per tenant.
+ADMISSION_LIMITS = os.environ.get("ADMISSION_LIMITS", "heavy=2/6/2,write=20/40/10,read=50/100/20")
+ADMISSION_HEAVY_ROUTES = tuple(
+    prefix.strip().lstrip("/")
+    for prefix in os.environ.get(
+        "ADMISSION_HEAVY_ROUTES",
+        "reports/,master-admin/dashboard,master-admin/analytics/,stats/statisticsGraph,salary/generate/,salary/payroll,exports/",
+    ).split(",")
+    if prefix.strip()
+)
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_IDLE_SECONDS = 600
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+def parse_limits(spec: str):
+    limits = {}
+    for item in spec.split(","):
+        name, _, values = item.strip().partition("=")
+        rate, burst, concurrency = values.split("/")
+        limits[name] = {"rate": float(rate), "burst": float(burst), "concurrency": int(concurrency)}
+    return limits
+
+class_limits = parse_limits(ADMISSION_LIMITS)
+tenant_states = {}
+admission_counters = {"admitted": 0, "queued": 0, "shed_rate": 0, "shed_concurrency": 0}
+last_prune = time.monotonic()
+
+def admission_enabled():
+    return ADMISSION_ENABLED
+
+def route_class(method: str, path: str):
+    if path.startswith(ADMISSION_HEAVY_ROUTES):
+        return "heavy"
+    return "write" if method in MUTATING_METHODS else "read"
+
+def tenant_state(tenant: str, klass: str):
+    key = (tenant, klass)
+    state = tenant_states.get(key)
+    if state is None:
+        limits = class_limits[klass]
+        state = {
+            "tokens": limits["burst"],
+            "updated": time.monotonic(),
+            "slots": asyncio.Semaphore(limits["concurrency"]),
+            "in_flight": 0,
+        }
+        tenant_states[key] = state
+    return state
+
+def take_token(state, limits, now):
+    # Returns how long the caller would have to wait for a token.
+    state["tokens"] = min(limits["burst"], state["tokens"] + (now - state["updated"]) * limits["rate"])
+    state["updated"] = now
+    if state["tokens"] >= 1:
+        state["tokens"] -= 1
+        return 0.0
+    return (1 - state["tokens"]) / limits["rate"]
+
+def prune_idle_tenants(now):
+    global last_prune
+    if now - last_prune < 60:
+        return
+    last_prune = now
+    for key in [k for k, s in tenant_states.items() if not s["in_flight"] and now - s["updated"] > ADMISSION_IDLE_SECONDS]:
+        tenant_states.pop(key, None)
+
+@asynccontextmanager
+async def admission_slot(tenant: str, klass: str):
+    if not ADMISSION_ENABLED:
+        yield
+        return
+    now = time.monotonic()
+    prune_idle_tenants(now)
+    limits = class_limits[klass]
+    state = tenant_state(tenant, klass)
+    deadline = now + ADMISSION_QUEUE_TIMEOUT
+    wait = take_token(state, limits, now)
+    if wait > ADMISSION_QUEUE_TIMEOUT:
+        admission_counters["shed_rate"] += 1
+        raise AdmissionRejected("rate", wait)
+    if wait > 0:
+        # The token is reserved up front: the bucket goes negative and
+        # later callers see the debt in their own wait time.
+        state["tokens"] -= 1
+        admission_counters["queued"] += 1
+        await asyncio.sleep(wait)
+    slots = state["slots"]
+    if slots.locked():
+        try:
+            await asyncio.wait_for(slots.acquire(), deadline - time.monotonic())
+        except asyncio.TimeoutError:
+            admission_counters["shed_concurrency"] += 1
+            raise AdmissionRejected("concurrency", 1)
+    else:
+        await slots.acquire()
+    state["in_flight"] += 1
+    admission_counters["admitted"] += 1
+    try:
+        yield
+    finally:
+        state["in_flight"] -= 1
+        state["slots"].release()
+
+def admission_stats():
+    return {
+        **admission_counters,
+        "enabled": ADMISSION_ENABLED,
+        "limits": class_limits,
+        "tracked": len(tenant_states),
+        "busy": sum(1 for s in tenant_states.values() if s["in_flight"]),
+    }
+
+def busiest_tenants(limit=10):
+    # Names tenants and companies, so only for the admin-only status route.
+    busiest = sorted(tenant_states.items(), key=lambda item: item[1]["in_flight"], reverse=True)[:limit]
+    return [
+        {"tenant": tenant, "class": klass, "in_flight": s["in_flight"], "tokens": round(s["tokens"], 2)}
+        for (tenant, klass), s in busiest
+        if s["in_flight"]
+    ]
@@ -0,0 +1,143 @@
+import asyncio
+import base64
+import json
+import os
+from urllib.parse import urlencode
+
+from request_errors import RequestError
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "20"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "6"))
+BATCH_DEFAULT_DEADLINE = float(os.environ.get("BATCH_DEFAULT_DEADLINE", "10"))
+BATCH_MAX_DEADLINE = float(os.environ.get("BATCH_MAX_DEADLINE", "30"))
+BATCH_MAX_BODY_BYTES = int(os.environ.get("BATCH_MAX_BODY_BYTES", str(1024 * 1024)))
+BATCH_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+# Long-polls, nested batches, endless or file-sized streams and proxy admin
+# routes make no sense inside a batch and would only pin its concurrency
+# slots.
+BATCH_BLOCKED_PREFIXES = ("batch", "socket.io", "_proxy/", "notifications/stream", "exports/")
+BATCH_RESULT_HEADERS = ("content-type", "etag", "cache-control", "x-proxy-cache")
+
+def parse_item(index: int, raw):
+    if not isinstance(raw, dict) or not isinstance(raw.get("path"), str):
+        raise RequestError(400, f"Item {index} needs a path")
+    method = str(raw.get("method", "GET")).upper()
+    if method not in BATCH_METHODS:
+        raise RequestError(400, f"Item {index}: method {method} is not allowed in a batch")
+    path, _, query = raw["path"].lstrip("/").partition("?")
+    if path.startswith("api/"):
+        path = path[4:]
+    if not path or path.startswith(BATCH_BLOCKED_PREFIXES) or ".." in path.split("/"):
+        raise RequestError(400, f"Item {index}: path {raw['path']} cannot be batched")
+    if isinstance(raw.get("query"), dict):
+        extra = urlencode(raw["query"], doseq=True)
+        query = f"{query}&{extra}" if query else extra
+    depends_on = raw.get("depends_on", [])
+    if isinstance(depends_on, str):
+        depends_on = [depends_on]
+    return {
+        "id": str(raw.get("id", index)),
+        "method": method,
+        "path": path,
+        "query": query,
+        "body": raw.get("body"),
+        "depends_on": [str(dep) for dep in depends_on],
+    }
+
+def check_dependencies(items):
+    ids = [item["id"] for item in items]
+    if len(set(ids)) != len(ids):
+        raise RequestError(400, "Item ids must be unique")
+    by_id = {item["id"]: item for item in items}
+    for item in items:
+        for dep in item["depends_on"]:
+            if dep not in by_id or dep == item["id"]:
+                raise RequestError(400, f"Item {item['id']} depends on unknown item {dep}")
+    # Kahn's algorithm; anything left unvisited is part of a cycle.
+    remaining = {item["id"]: len(item["depends_on"]) for item in items}
+    ready = [item_id for item_id, count in remaining.items() if count == 0]
+    visited = 0
+    while ready:
+        current = ready.pop()
+        visited += 1
+        for item in items:
+            if current in item["depends_on"]:
+                remaining[item["id"]] -= 1
+                if remaining[item["id"]] == 0:
+                    ready.append(item["id"])
+    if visited != len(items):
+        raise RequestError(400, "Batch dependencies contain a cycle")
+
+def parse_batch(payload):
+    if not isinstance(payload, dict) or not isinstance(payload.get("requests"), list) or not payload["requests"]:
+        raise RequestError(400, "Expected {\"requests\": [...]}")
+    if len(payload["requests"]) > BATCH_MAX_ITEMS:
+        raise RequestError(413, f"A batch may contain at most {BATCH_MAX_ITEMS} requests")
+    items = [parse_item(i, raw) for i, raw in enumerate(payload["requests"])]
+    check_dependencies(items)
+    try:
+        deadline = float(payload.get("deadline_ms", BATCH_DEFAULT_DEADLINE * 1000)) / 1000
+    except (TypeError, ValueError):
+        raise RequestError(400, "deadline_ms must be a number")
+    return items, min(max(deadline, 0.001), BATCH_MAX_DEADLINE)
+
+def encode_body(content_type: str, body: bytes):
+    if not body:
+        return None, None
+    if "json" in content_type:
+        try:
+            return json.loads(body), None
+        except ValueError:
+            pass
+    if content_type.startswith("text/") or "json" in content_type:
+        return body.decode("utf-8", "replace"), None
+    return base64.b64encode(body).decode(), "base64"
+
+def batch_result(item, status_code: int, headers, body: bytes):
+    content_type = headers.get("content-type", "")
+    decoded, encoding = encode_body(content_type, body)
+    result = {
+        "id": item["id"],
+        "status": status_code,
+        "headers": {name: headers[name] for name in BATCH_RESULT_HEADERS if name in headers},
+        "body": decoded,
+    }
+    if encoding:
+        result["body_encoding"] = encoding
+    return result
+
+def error_result(item, status_code: int, message: str):
+    return {"id": item["id"], "status": status_code, "headers": {}, "body": {"message": message}}
+
+async def run_batch(items, execute, deadline: float, max_concurrency=BATCH_MAX_CONCURRENCY):
+    """Run execute(item) for every item, at most max_concurrency at a time.
+
+    An item starts once everything it depends on has finished, and fails
+    with 424 if one of those did not succeed. Items still running or
+    waiting when the deadline passes are cancelled and reported as 504.
+    """
+    slots = asyncio.Semaphore(max_concurrency)
+    tasks = {}
+
+    async def run_item(item):
+        for dep in item["depends_on"]:
+            if not 200 <= (await tasks[dep])["status"] < 300:
+                return error_result(item, 424, f"Dependency {dep} did not succeed")
+        async with slots:
+            try:
+                return await execute(item)
+            except Exception:
+                return error_result(item, 502, "Sub-request failed")
+
+    for item in items:
+        tasks[item["id"]] = asyncio.ensure_future(run_item(item))
+    _, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return [
+        error_result(item, 504, "Batch deadline exceeded")
+        if tasks[item["id"]].cancelled()
+        else tasks[item["id"]].result()
+        for item in items
+    ]
@@ -0,0 +1,152 @@
+"""
+Row-throughput benchmark for the streaming exports in backend/exports.py.
+
+Feeds synthetic Mongo documents through the same row and CSV/XLSX
+encoding pipeline the /api/exports routes use, and reports rows per
+second, output size and the peak Python heap while encoding.
+
+Usage (from backend/):
+    python benchmarks/export_bench.py --rows 200000
+    python benchmarks/export_bench.py --dataset attendance --format xlsx --json results.json
+    python benchmarks/export_bench.py --baseline results.json   # exits 1 on regression
+
+Peak heap should stay flat as --rows grows; the database is not part of
+the measurement, so the numbers compare encoder builds, not Mongo.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exports
+
+DATASETS = tuple(exports.EXPORT_COLUMNS)
+FORMATS = tuple(exports.EXPORT_MEDIA_TYPES)
+STATUSES = ("present", "absent", "half-day", "on-leave")
+
+def synthetic_users(count: int):
+    return {ObjectId(): {"firstName": f"First{i}", "lastName": f"Last{i}"} for i in range(count)}
+
+async def synthetic_docs(dataset: str, rows: int, users):
+    ids = list(users)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(rows):
+        user = ids[i % len(ids)]
+        day = start + timedelta(days=i // len(ids))
+        if dataset == "tasks":
+            yield {
+                "_id": ObjectId(), "title": f"Visit site {i}, check \"meter\"", "status": "Pending", "priority": "Medium",
+                "taskType": "Single", "isSelfTask": False, "dueDateTime": day, "createdBy": user,
+                "assignees": ids[i % len(ids):i % len(ids) + 3], "observers": [], "createdAt": day, "updatedAt": day,
+            }
+        elif dataset == "attendance":
+            yield {
+                "_id": ObjectId(), "user": user, "date": day, "status": STATUSES[i % len(STATUSES)],
+                "checkIn": {"time": day + timedelta(hours=9), "isLate": i % 5 == 0, "lateByMinutes": i % 30,
+                            "location": {"type": "office", "officeName": "HQ"}},
+                "checkOut": {"time": day + timedelta(hours=18), "isEarlyLeave": False},
+                "workingHours": {"total": 480 + i % 60, "overtime": i % 60},
+            }
+        else:
+            yield {
+                "_id": ObjectId(), "user": user, "year": 2026, "month": i % 12,
+                "attendance": {"workingDays": 22, "presentDays": 20, "absentDays": 2},
+                "earnings": {"basicSalary": 30000, "overtimePay": 412.5}, "grossSalary": 45000,
+                "deductions": {"lossOfPay": 4090.909090909091, "totalDeductions": 8790.909090909091},
+                "netSalary": 36621.59090909091, "paymentStatus": "pending", "paymentDate": None,
+            }
+
+async def encode_case(dataset: str, fmt: str, rows: int, users):
+    size = 0
+    batches = exports.row_batches(dataset, synthetic_docs(dataset, rows, users), users)
+    async for chunk in exports.encode_stream(exports.encoder_for(dataset, fmt), batches):
+        size += len(chunk)
+    return size
+
+async def run_case(dataset: str, fmt: str, rows: int, users):
+    # Timed and heap-traced in separate passes: tracemalloc slows every
+    # allocation several times over.
+    started = time.perf_counter()
+    size = await encode_case(dataset, fmt, rows, users)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    await encode_case(dataset, fmt, rows, users)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "case": f"{dataset}.{fmt}",
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed) if elapsed else 0,
+        "mb_per_s": round(size / 2**20 / elapsed, 2) if elapsed else 0.0,
+        "output_mb": round(size / 2**20, 2),
+        "peak_heap_mb": round(peak / 2**20, 2),
+    }
+
+def print_result(result):
+    print(
+        f"{result['case']:<16} rows={result['rows']:<8} rows/s={result['rows_per_s']:<8} "
+        f"MB/s={result['mb_per_s']:<7} out={result['output_mb']}MB peak heap={result['peak_heap_mb']}MB"
+    )
+
+def find_regressions(results, baseline, tolerance: float):
+    previous = {r["case"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get(result["case"])
+        if not base:
+            continue
+        if result["rows_per_s"] < base["rows_per_s"] * (1 - tolerance):
+            regressions.append(f"{result['case']}: rows/s {base['rows_per_s']} -> {result['rows_per_s']}")
+        if result["peak_heap_mb"] > base["peak_heap_mb"] * (1 + tolerance) + 1:
+            regressions.append(f"{result['case']}: peak heap {base['peak_heap_mb']}MB -> {result['peak_heap_mb']}MB")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", action="append", choices=DATASETS, help="repeatable; defaults to all")
+    parser.add_argument("--format", action="append", choices=FORMATS, help="repeatable; defaults to all")
+    parser.add_argument("--rows", type=int, default=100000, help="rows per case")
+    parser.add_argument("--users", type=int, default=200, help="employees the rows are spread across")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed rows/s and heap drift against the baseline")
+    args = parser.parse_args(argv)
+    args.dataset = args.dataset or list(DATASETS)
+    args.format = args.format or list(FORMATS)
+    return args
+
+async def run_benchmark(args):
+    users = synthetic_users(args.users)
+    results = []
+    for dataset in args.dataset:
+        for fmt in args.format:
+            result = await run_case(dataset, fmt, args.rows, users)
+            results.append(result)
+            print_result(result)
+    return results
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run_benchmark(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Load benchmark for the FastAPI proxy in backend/server.py.
+
+Starts the proxy app against benchmarks/stub_node.py (one stub per Node
+worker port), drives it with an asyncio load generator and reports
+throughput, latency percentiles and memory per scenario.
+
+Usage (from backend/):
+    python benchmarks/proxy_bench.py --scenario tasks --concurrency 50 --duration 10
+    python benchmarks/proxy_bench.py --scenario mixed --rps 300 --json results.json
+    python benchmarks/proxy_bench.py --baseline results.json   # exits 1 on regression
+
+Everything shares one process and event loop, so the numbers are for
+comparing builds on the same machine, not for capacity planning.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stub_node
+
+SCENARIOS = ("tasks", "stats", "uploads", "polling", "mixed")
+MIXED_WEIGHTS = {"tasks": 6, "stats": 3, "uploads": 1}
+STUB_DEFAULTS = dict(stub_node.STUB_CONFIG)
+
+def percentile(sorted_values, pct: float):
+    # Nearest-rank; good enough at benchmark sample sizes.
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def bearer_for(user: int, tenants: int):
+    claims = {"id": f"{user:024x}", "role": "employee", "company": f"{user % tenants:024x}"}
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return {"Authorization": f"Bearer bench.{payload}.sig{user}"}
+
+async def run_load(send, concurrency: int, duration: float, rps=None):
+    """Call send(user) repeatedly and collect (latency, status) samples.
+
+    With rps unset each of `concurrency` users loops back to back (closed
+    loop). With rps set requests are started on a fixed schedule and timed
+    from when they were due, so a stalled proxy shows up in the
+    percentiles instead of silently lowering the offered load.
+    """
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    async def timed(user, due):
+        try:
+            status = await send(user)
+        except httpx.HTTPError:
+            status = 0
+        samples.append((time.perf_counter() - due, status))
+
+    if rps is None:
+        async def user_loop(user):
+            while time.perf_counter() < deadline:
+                await timed(user, time.perf_counter())
+
+        await asyncio.gather(*(user_loop(u) for u in range(concurrency)))
+    else:
+        slots = asyncio.Semaphore(concurrency)
+        pending = set()
+        users = itertools.cycle(range(concurrency))
+        interval = 1 / rps
+        due = time.perf_counter()
+        while due < deadline:
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+
+            async def scheduled(user=next(users), due=due):
+                async with slots:
+                    await timed(user, due)
+
+            task = asyncio.create_task(scheduled())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            due += interval
+        await asyncio.gather(*pending)
+    return samples
+
+def summarize(samples, elapsed: float):
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(1 for _, status in samples if status == 0 or status >= 500)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "statuses": statuses,
+        "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+def scenario_sender(name: str, client: httpx.AsyncClient, tenants: int, upload_name: str):
+    sids = {}
+
+    async def tasks(user):
+        resp = await client.get("/api/task/getTaskList", params={"isSelfTask": "false", "page": 0}, headers=bearer_for(user, tenants))
+        return resp.status_code
+
+    async def stats(user):
+        resp = await client.get("/api/stats/tasks-summary", headers=bearer_for(user, tenants))
+        return resp.status_code
+
+    async def uploads(user):
+        resp = await client.get(f"/api/uploads/{upload_name}")
+        return resp.status_code
+
+    async def polling(user):
+        params = {"EIO": "4", "transport": "polling"}
+        if user not in sids:
+            resp = await client.get("/api/socket.io/", params=params)
+            sids[user] = json.loads(resp.content[1:])["sid"]
+            return resp.status_code
+        resp = await client.get("/api/socket.io/", params={**params, "sid": sids[user]})
+        return resp.status_code
+
+    senders = {"tasks": tasks, "stats": stats, "uploads": uploads, "polling": polling}
+    if name != "mixed":
+        return senders[name]
+    weighted = [senders[n] for n, weight in MIXED_WEIGHTS.items() for _ in range(weight)]
+
+    async def mixed(user):
+        return await random.choice(weighted)(user)
+
+    return mixed
+
+async def run_benchmark(args):
+    # server.py reads its configuration at import time.
+    uploads_dir = tempfile.mkdtemp(prefix="proxy-bench-")
+    upload_name = "bench-1700000000000.pdf"
+    with open(os.path.join(uploads_dir, upload_name), "wb") as f:
+        f.write(stub_node.upload_body(stub_node.STUB_CONFIG["upload_kb"]))
+    os.environ["NODE_WORKERS"] = str(args.workers)
+    os.environ["UPLOADS_DIR"] = uploads_dir
+    os.environ["NODE_TRANSPORT"] = args.transport
+    os.environ["NODE_SOCKET_DIR"] = uploads_dir
+    import server
+
+    async def no_node():
+        pass
+
+    server.start_node_backend = no_node
+    server.stop_node_backend = no_node
+    stubs = [await stub_node.serve_stub(server.NODE_BACKEND_PORT + w["id"], w["socket"]) for w in server.node_workers]
+    proxy = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    proxy_task = asyncio.create_task(proxy.serve())
+    while not proxy.started:
+        if proxy_task.done():
+            await proxy_task
+        await asyncio.sleep(0.01)
+
+    results = []
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=30) as client:
+            for name in args.scenario:
+                send = scenario_sender(name, client, args.tenants, upload_name)
+                await run_load(send, min(args.concurrency, 10), 1.0)
+                rss_start = rss_mb()
+                upstream_start = stub_node.stub_stats["requests"]
+                started = time.perf_counter()
+                samples = await run_load(send, args.concurrency, args.duration, args.rps)
+                elapsed = time.perf_counter() - started
+                result = {
+                    "scenario": name,
+                    "mode": f"rps={args.rps}" if args.rps else "closed-loop",
+                    "concurrency": args.concurrency,
+                    "transport": args.transport,
+                    "duration_s": args.duration,
+                    **summarize(samples, elapsed),
+                    "upstream_requests": stub_node.stub_stats["requests"] - upstream_start,
+                    "rss_start_mb": round(rss_start, 1),
+                    "rss_end_mb": round(rss_mb(), 1),
+                    "rss_peak_mb": round(peak_rss_mb(), 1),
+                }
+                results.append(result)
+                print_result(result)
+    finally:
+        proxy.should_exit = True
+        await proxy_task
+        for stub, task in stubs:
+            stub.should_exit = True
+            await task
+    return results
+
+def print_result(result):
+    print(
+        f"{result['scenario']:<8} {result['mode']:<12} reqs={result['requests']:<7} "
+        f"rps={result['rps']:<8} p50={result['p50_ms']:<7} p95={result['p95_ms']:<7} "
+        f"p99={result['p99_ms']:<7} errors={result['errors']:<4} upstream={result['upstream_requests']:<7} "
+        f"rss={result['rss_start_mb']}->{result['rss_end_mb']}MB (peak {result['rss_peak_mb']}MB)"
+    )
+
+def find_regressions(results, baseline, tolerance: float):
+    previous = {r["scenario"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get(result["scenario"])
+        if not base:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: p95 {base['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: rps {base['rps']} -> {result['rps']}")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{result['scenario']}: errors {base['errors']} -> {result['errors']}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="repeatable; defaults to all")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rps", type=float, help="open-loop request rate; closed loop when unset")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="stub Node workers behind the proxy")
+    parser.add_argument("--transport", choices=("tcp", "uds"), default="tcp", help="proxy to stub transport (NODE_TRANSPORT)")
+    parser.add_argument("--tenants", type=int, default=20, help="companies the virtual users are spread across")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--task-latency-ms", type=float, default=STUB_DEFAULTS["task_latency_ms"])
+    parser.add_argument("--task-count", type=int, default=STUB_DEFAULTS["task_count"])
+    parser.add_argument("--stats-latency-ms", type=float, default=STUB_DEFAULTS["stats_latency_ms"])
+    parser.add_argument("--upload-kb", type=int, default=STUB_DEFAULTS["upload_kb"])
+    parser.add_argument("--poll-hold-ms", type=float, default=STUB_DEFAULTS["poll_hold_ms"])
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/rps drift against the baseline")
+    args = parser.parse_args(argv)
+    args.scenario = args.scenario or [s for s in SCENARIOS if s != "mixed"]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    for key in ("task_latency_ms", "task_count", "stats_latency_ms", "upload_kb", "poll_hold_ms"):
+        stub_node.STUB_CONFIG[key] = getattr(args, key)
+    results = asyncio.run(run_benchmark(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Replay traffic recorded by the proxy's capture (traffic_capture.py).
+
+Re-issues each captured request at its original offset, divided by
+--speed, against a target stack and reports latency and throughput
+overall and per route template.
+
+Usage (from backend/):
+    python benchmarks/replay.py capture.jsonl --target https://staging.example.com --tokens tokens.txt
+    python benchmarks/replay.py capture.jsonl* --speed 4 --json replay.json --baseline previous.json
+
+Captures are anonymized, so:
+- ids in paths and queries are replaced with --object-id;
+- pseudonymized query values ("~1a2b3c4d") are sent as they are;
+- each captured user is mapped onto one bearer token from --tokens.
+
+Writes are skipped unless --include-writes is given. Upload downloads
+are skipped unless --upload-file names a file that exists on the
+target.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from proxy_bench import find_regressions, percentile, summarize
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+def load_capture(paths, limit=None):
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["t"])
+    if limit:
+        records = records[:limit]
+    if records:
+        origin = records[0]["t"]
+        for record in records:
+            record["t"] -= origin
+    return records
+
+def replay_path(record, object_id: str, upload_file=None):
+    route = record["route"]
+    if route == "uploads/:file":
+        return f"/api/uploads/{upload_file}" if upload_file else None
+    if route == "socket.io":
+        return "/api/socket.io/"
+    return "/api/" + "/".join(object_id if part == ":id" else part for part in route.split("/"))
+
+def replay_query(record, object_id: str):
+    return [(key, object_id if value == ":id" else value) for key, value in record["query"]]
+
+def write_body(size: int):
+    # Same size as the original body; the content itself was never captured.
+    body = b'{"replay":""}'
+    if size <= len(body):
+        return body
+    return b'{"replay":"' + b"x" * (size - len(body)) + b'"}'
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, tokens, object_id: str, include_writes=False, upload_file=None):
+        self.client = client
+        self.tokens = tokens
+        self.object_id = object_id
+        self.include_writes = include_writes
+        self.upload_file = upload_file
+        self.user_tokens = {}
+        self.sessions = {}
+
+    def headers_for(self, record):
+        if not self.tokens:
+            return {}
+        token = self.user_tokens.setdefault(record["user"], self.tokens[len(self.user_tokens) % len(self.tokens)])
+        return {"Authorization": f"Bearer {token}"}
+
+    def should_replay(self, record):
+        if record["route"] == "socket.io":
+            return True
+        if record["method"] in WRITE_METHODS and not self.include_writes:
+            return False
+        return replay_path(record, self.object_id, self.upload_file) is not None
+
+    async def engine_io_sid(self, pseudonym: str, headers):
+        # Engine.IO sids are per-connection; each captured session gets a
+        # fresh one from the target on first use.
+        if pseudonym not in self.sessions:
+            resp = await self.client.get("/api/socket.io/", params={"EIO": "4", "transport": "polling"}, headers=headers)
+            self.sessions[pseudonym] = json.loads(resp.content[1:])["sid"]
+        return self.sessions[pseudonym]
+
+    async def send(self, record):
+        headers = self.headers_for(record)
+        query = replay_query(record, self.object_id)
+        content = None
+        if record["route"] == "socket.io":
+            query = [(k, v) for k, v in query if k != "t"]
+            sid = dict(query).get("sid")
+            if sid:
+                query = [(k, await self.engine_io_sid(sid, headers) if k == "sid" else v) for k, v in query]
+            if record["method"] == "POST":
+                content = b"3"
+        elif record["method"] in WRITE_METHODS:
+            content = write_body(record["req_bytes"])
+            headers["Content-Type"] = "application/json"
+        resp = await self.client.request(
+            record["method"], replay_path(record, self.object_id, self.upload_file),
+            params=query, headers=headers, content=content,
+        )
+        return resp.status_code
+
+async def replay(records, replayer: Replayer, speed: float, max_in_flight: int):
+    samples = {}
+    slots = asyncio.Semaphore(max_in_flight)
+    pending = set()
+    start = time.perf_counter()
+
+    async def timed(record, due):
+        async with slots:
+            try:
+                status = await replayer.send(record)
+            except (httpx.HTTPError, ValueError, KeyError):
+                status = 0
+        samples.setdefault(record["route"], []).append((time.perf_counter() - due, status))
+
+    for record in records:
+        if not replayer.should_replay(record):
+            continue
+        due = start + record["t"] / speed
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        task = asyncio.create_task(timed(record, due))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    await asyncio.gather(*pending)
+    return samples, time.perf_counter() - start
+
+def report(records, samples, elapsed: float, speed: float):
+    captured = {}
+    for record in records:
+        captured.setdefault(record["route"], []).append(record["ms"])
+    results = []
+    everything = [sample for route_samples in samples.values() for sample in route_samples]
+    for route, route_samples in [("all", everything)] + sorted(samples.items(), key=lambda item: -len(item[1])):
+        original = sorted(ms for r, values in captured.items() if route in ("all", r) for ms in values)
+        results.append({
+            "scenario": route,
+            "speed": speed,
+            **summarize(route_samples, elapsed),
+            "captured_p50_ms": round(percentile(original, 50), 2),
+            "captured_p95_ms": round(percentile(original, 95), 2),
+        })
+    span = records[-1]["t"] / speed if records else 0.0
+    print(f"replayed {len(everything)} of {len(records)} requests in {elapsed:.1f}s (capture span {span:.1f}s at x{speed})")
+    for result in results:
+        print(
+            f"{result['scenario'][:40]:<40} reqs={result['requests']:<7} rps={result['rps']:<8} "
+            f"p50={result['p50_ms']:<8} p95={result['p95_ms']:<8} p99={result['p99_ms']:<8} errors={result['errors']:<5} "
+            f"captured p50/p95={result['captured_p50_ms']}/{result['captured_p95_ms']}"
+        )
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", nargs="+", help="capture files, including rotated ones")
+    parser.add_argument("--target", default="http://127.0.0.1:8001")
+    parser.add_argument("--speed", type=float, default=1.0, help="2 replays twice as fast as captured")
+    parser.add_argument("--tokens", help="file with one bearer token per line")
+    parser.add_argument("--object-id", default="000000000000000000000000")
+    parser.add_argument("--upload-file", help="existing upload to fetch for uploads/:file records")
+    parser.add_argument("--include-writes", action="store_true")
+    parser.add_argument("--max-in-flight", type=int, default=500)
+    parser.add_argument("--limit", type=int, help="replay only the first N records")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+async def run_replay(args, records):
+    tokens = []
+    if args.tokens:
+        with open(args.tokens) as f:
+            tokens = [line.strip() for line in f if line.strip()]
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.target, limits=limits, timeout=60) as client:
+        replayer = Replayer(client, tokens, args.object_id, args.include_writes, args.upload_file)
+        return await replay(records, replayer, args.speed, args.max_in_flight)
+
+def main(argv=None):
+    args = parse_args(argv)
+    records = load_capture(args.capture, args.limit)
+    samples, elapsed = asyncio.run(run_replay(args, records))
+    results = report(records, samples, elapsed, args.speed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
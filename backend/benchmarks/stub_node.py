@@ -0,0 +1,101 @@
+"""
+Stand-in for the Node backend used by the proxy benchmarks.
+
+Serves the shapes of the hot endpoints (getTaskList, stats, uploads and
+socket.io polling) with configurable latency and payload sizes, so the
+proxy can be measured without Mongo or Node.
+"""
+import asyncio
+import json
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+STUB_CONFIG = {
+    "task_latency_ms": 20,
+    "task_count": 50,
+    "stats_latency_ms": 40,
+    "upload_latency_ms": 5,
+    "upload_kb": 256,
+    "poll_hold_ms": 500,
+}
+
+app = FastAPI()
+payloads = {}
+stub_stats = {"requests": 0}
+
+def task_list_body(count: int):
+    if ("tasks", count) not in payloads:
+        tasks = [
+            {
+                "_id": f"{i:024x}",
+                "title": f"Benchmark task {i}",
+                "description": "Follow up with the client and attach the signed quotation. " * 3,
+                "assignees": [{"_id": f"{i + 1:024x}", "firstName": "Asha", "lastName": "Patel"}],
+                "observers": [],
+                "priority": ("high", "medium", "low")[i % 3],
+                "dueDateTime": "2026-01-15T10:30:00.000Z",
+                "status": ("pending", "in-progress", "completed")[i % 3],
+                "createdAt": "2026-01-01T09:00:00.000Z",
+            }
+            for i in range(count)
+        ]
+        payloads["tasks", count] = json.dumps(
+            {"tasks": tasks, "totalTasks": count, "totalPages": 1, "currentPage": 0, "perPage": count}
+        ).encode()
+    return payloads["tasks", count]
+
+def upload_body(kb: int):
+    if ("upload", kb) not in payloads:
+        payloads["upload", kb] = bytes(range(256)) * (kb * 4)
+    return payloads["upload", kb]
+
+async def delay(ms: float):
+    if ms > 0:
+        await asyncio.sleep(ms / 1000)
+
+@app.get("/")
+async def root():
+    return Response(content=b'{"message":"Unauthorized"}', status_code=401, media_type="application/json")
+
+@app.get("/task/getTaskList")
+async def get_task_list():
+    stub_stats["requests"] += 1
+    await delay(STUB_CONFIG["task_latency_ms"])
+    return Response(content=task_list_body(STUB_CONFIG["task_count"]), media_type="application/json")
+
+@app.get("/stats/{name}")
+async def stats(name: str):
+    stub_stats["requests"] += 1
+    await delay(STUB_CONFIG["stats_latency_ms"])
+    body = {"totalTasks": 120, "completedTasks": 80, "overdueTasks": 7, "highPriority": 12, "mediumPriority": 30, "lowPriority": 78}
+    return Response(content=json.dumps(body).encode(), media_type="application/json")
+
+@app.get("/uploads/{name}")
+async def uploads(name: str):
+    stub_stats["requests"] += 1
+    await delay(STUB_CONFIG["upload_latency_ms"])
+    return Response(content=upload_body(STUB_CONFIG["upload_kb"]), media_type="application/pdf")
+
+@app.get("/socket.io/")
+async def engine_io_poll(request: Request):
+    stub_stats["requests"] += 1
+    if "sid" not in request.query_params:
+        handshake = {"sid": uuid.uuid4().hex[:20], "upgrades": ["websocket"], "pingInterval": 25000, "pingTimeout": 20000, "maxPayload": 1000000}
+        return Response(content=b"0" + json.dumps(handshake).encode(), media_type="text/plain; charset=UTF-8")
+    # A real poll is held until Node has something to send; the ping is the
+    # common case.
+    await delay(STUB_CONFIG["poll_hold_ms"])
+    return Response(content=b"2", media_type="text/plain; charset=UTF-8")
+
+async def serve_stub(port: int, uds=None):
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, uds=uds, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            await task
+        await asyncio.sleep(0.01)
+    return server, task
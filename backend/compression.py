@@ -0,0 +1,96 @@
+import asyncio
+import collections
+import gzip
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "1") == "1"
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_MAX_BYTES = int(os.environ.get("COMPRESSION_MAX_BYTES", str(8 * 1024 * 1024)))
+COMPRESSION_THREAD_BYTES = int(os.environ.get("COMPRESSION_THREAD_BYTES", str(256 * 1024)))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "application/xml", "image/svg+xml", "text/")
+# Attachments are images, PDFs and office files that are already compressed.
+SKIPPED_PREFIXES = ("uploads/",)
+
+compression_stats = collections.defaultdict(
+    lambda: {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0}
+)
+
+def is_compressible(path: str, headers):
+    if not COMPRESSION_ENABLED or path.startswith(SKIPPED_PREFIXES) or headers.get("content-encoding"):
+        return False
+    content_type = headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def compression_candidate(path: str, headers, size):
+    if size is None or not is_compressible(path, headers):
+        return False
+    return COMPRESSION_MIN_BYTES <= int(size) <= COMPRESSION_MAX_BYTES
+
+def choose_encoding(accept_encoding: str):
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    wildcard = accepted.get("*", 0.0)
+    # Highest q-value wins; br only breaks a tie, being the smaller of the two.
+    candidates = [("gzip", accepted.get("gzip", wildcard))]
+    if brotli is not None:
+        candidates.append(("br", accepted.get("br", wildcard)))
+    encoding, q = max(candidates, key=lambda c: (c[1], c[0] == "br"))
+    return encoding if q > 0 else None
+
+def compress_body(body: bytes, encoding: str):
+    started = time.thread_time()
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return compressed, time.thread_time() - started
+
+async def compress_for(route: str, path: str, accept_encoding: str, headers, body: bytes):
+    if len(body) < COMPRESSION_MIN_BYTES or len(body) > COMPRESSION_MAX_BYTES or not is_compressible(path, headers):
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    if len(body) >= COMPRESSION_THREAD_BYTES:
+        compressed, cpu_seconds = await asyncio.to_thread(compress_body, body, encoding)
+    else:
+        compressed, cpu_seconds = compress_body(body, encoding)
+    stats = compression_stats[route]
+    stats["cpu_seconds"] += cpu_seconds
+    if len(compressed) >= len(body):
+        return body, None
+    stats["responses"] += 1
+    stats["bytes_in"] += len(body)
+    stats["bytes_out"] += len(compressed)
+    return compressed, encoding
+
+def compression_summary():
+    return {
+        "enabled": COMPRESSION_ENABLED,
+        "brotli": brotli is not None,
+        "routes": {
+            route: {
+                **stats,
+                "cpu_seconds": round(stats["cpu_seconds"], 6),
+                "ratio": round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else None,
+            }
+            for route, stats in compression_stats.items()
+        },
+    }
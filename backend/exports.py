@@ -0,0 +1,337 @@
+import csv
+import io
+import math
+import os
+import re
+import time
+import zipfile
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from bson import ObjectId
+
+from mongo import database, jsonable
+from request_errors import RequestError
+
+EXPORTS_ENABLED = os.environ.get("EXPORTS_ENABLED", "1") == "1"
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000"))
+# Rows per chunk handed to the client; memory stays at one chunk however
+# long the export is.
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "500"))
+# A worksheet holds 1,048,576 rows, the header included.
+XLSX_MAX_ROWS = 1048575
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+export_stats = {"started": 0, "completed": 0, "failed": 0, "rows": 0, "bytes": 0}
+
+def user_name(users, user_id):
+    user = users.get(user_id)
+    return f"{user.get('firstName', '')} {user.get('lastName', '')}".strip() if user else ""
+
+def stamp(value):
+    return jsonable(value) if isinstance(value, datetime) else ""
+
+def nested(doc, *keys):
+    for key in keys:
+        doc = doc.get(key) if isinstance(doc, dict) else None
+    return doc
+
+def people(users, ids):
+    return "; ".join(user_name(users, i) or str(i) for i in ids or ())
+
+EXPORT_COLUMNS = {
+    "tasks": (
+        ("Task ID", lambda d, u: str(d["_id"])),
+        ("Title", lambda d, u: d.get("title")),
+        ("Status", lambda d, u: d.get("status")),
+        ("Priority", lambda d, u: d.get("priority")),
+        ("Type", lambda d, u: d.get("taskType")),
+        ("Self task", lambda d, u: bool(d.get("isSelfTask"))),
+        ("Due", lambda d, u: stamp(d.get("dueDateTime"))),
+        ("Created by", lambda d, u: people(u, [d["createdBy"]] if d.get("createdBy") else [])),
+        ("Assignees", lambda d, u: people(u, d.get("assignees"))),
+        ("Observers", lambda d, u: people(u, d.get("observers"))),
+        ("Created", lambda d, u: stamp(d.get("createdAt"))),
+        ("Updated", lambda d, u: stamp(d.get("updatedAt"))),
+    ),
+    "attendance": (
+        ("Date", lambda d, u: stamp(d.get("date"))),
+        ("User ID", lambda d, u: str(d.get("user", ""))),
+        ("Employee", lambda d, u: user_name(u, d.get("user"))),
+        ("Status", lambda d, u: d.get("status")),
+        ("Check-in", lambda d, u: stamp(nested(d, "checkIn", "time"))),
+        ("Check-in location", lambda d, u: nested(d, "checkIn", "location", "type")),
+        ("Office", lambda d, u: nested(d, "checkIn", "location", "officeName")),
+        ("Late", lambda d, u: bool(nested(d, "checkIn", "isLate"))),
+        ("Late by (min)", lambda d, u: nested(d, "checkIn", "lateByMinutes") or 0),
+        ("Check-out", lambda d, u: stamp(nested(d, "checkOut", "time"))),
+        ("Early leave", lambda d, u: bool(nested(d, "checkOut", "isEarlyLeave"))),
+        ("Worked (min)", lambda d, u: nested(d, "workingHours", "total") or 0),
+        ("Overtime (min)", lambda d, u: nested(d, "workingHours", "overtime") or 0),
+    ),
+    "payroll": (
+        ("Period", lambda d, u: f"{d.get('year')}-{d.get('month', 0) + 1:02d}"),
+        ("User ID", lambda d, u: str(d.get("user", ""))),
+        ("Employee", lambda d, u: user_name(u, d.get("user"))),
+        ("Working days", lambda d, u: nested(d, "attendance", "workingDays") or 0),
+        ("Present days", lambda d, u: nested(d, "attendance", "presentDays") or 0),
+        ("Absent days", lambda d, u: nested(d, "attendance", "absentDays") or 0),
+        ("Basic", lambda d, u: nested(d, "earnings", "basicSalary") or 0),
+        ("Overtime pay", lambda d, u: nested(d, "earnings", "overtimePay") or 0),
+        ("Gross", lambda d, u: d.get("grossSalary") or 0),
+        ("Loss of pay", lambda d, u: nested(d, "deductions", "lossOfPay") or 0),
+        ("Total deductions", lambda d, u: nested(d, "deductions", "totalDeductions") or 0),
+        ("Net", lambda d, u: d.get("netSalary") or 0),
+        ("Payment status", lambda d, u: d.get("paymentStatus")),
+        ("Paid on", lambda d, u: stamp(d.get("paymentDate"))),
+    ),
+}
+COLLECTIONS = {"tasks": "tasks", "attendance": "attendances", "payroll": "salaryrecords"}
+SORTS = {"tasks": [("_id", 1)], "attendance": [("date", 1), ("_id", 1)], "payroll": [("year", 1), ("month", 1), ("_id", 1)]}
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+def parse_date(value, name: str):
+    # new Date(value) as the report controllers take fromDate/toDate.
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise RequestError(400, f"Invalid {name}")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def export_query(dataset: str, claims, params):
+    """The Mongo filter for one export, scoped to the caller's company.
+
+    Admins export the whole company, optionally one user; everyone else
+    only their own rows, as the JSON endpoints allow.
+    """
+    company, me = ObjectId(claims["company"]), ObjectId(claims["id"])
+    admin = claims.get("role") == "admin"
+    user = params.get("userId")
+    if user is not None and not ObjectId.is_valid(user):
+        raise RequestError(400, "Invalid userId")
+    if user is not None and ObjectId(user) != me and not admin:
+        raise RequestError(403, "Access denied")
+    subject = ObjectId(user) if user else (None if admin else me)
+    query = {"company": company}
+    if dataset == "tasks":
+        if subject is not None:
+            query["$or"] = [{"assignees": subject}, {"createdBy": subject}, {"observers": subject}]
+        date_field = "dueDateTime"
+    else:
+        if subject is not None:
+            query["user"] = subject
+        date_field = "date"
+    if dataset == "payroll":
+        year = params.get("year")
+        if year is not None:
+            if not year.isdigit():
+                raise RequestError(400, "Invalid year")
+            query["year"] = int(year)
+        return query
+    bounds = {}
+    if params.get("fromDate"):
+        bounds["$gte"] = parse_date(params["fromDate"], "fromDate")
+    if params.get("toDate"):
+        bounds["$lte"] = parse_date(params["toDate"], "toDate")
+    if bounds:
+        query[date_field] = bounds
+    return query
+
+def csv_cell(value):
+    # Spreadsheet apps run cells that start like a formula; text from users
+    # (task titles, names) is quoted so it can't.
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return "" if value is None else value
+
+class CsvEncoder:
+    def __init__(self, header):
+        self.header = header
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def encode(self, rows):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.writer.writerows(rows)
+        return self.buffer.getvalue().encode()
+
+    def begin(self):
+        # The byte-order mark makes Excel read the file as UTF-8.
+        return "\ufeff".encode() + self.encode([self.header])
+
+    def rows(self, batch):
+        return self.encode([csv_cell(v) for v in row] for row in batch)
+
+    def end(self):
+        return b""
+
+def column_letter(index: int):
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def xlsx_cell(ref: str, value):
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return f'<c r="{ref}"><v>{value!r}</v></c>'
+    if value is None or value == "":
+        return ""
+    # Inline strings need no shared-strings table, which would have to hold
+    # every distinct string until the end.
+    text = escape(XML_ILLEGAL.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def xlsx_row(number: int, values, letters):
+    cells = "".join(xlsx_cell(f"{letter}{number}", value) for letter, value in zip(letters, values))
+    return f'<row r="{number}">{cells}</row>'
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+class ZipSink(io.RawIOBase):
+    # Write-only, unseekable target: zipfile then streams each member with
+    # a data descriptor, and whatever it has written is drained per chunk.
+    def __init__(self):
+        self.pending = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.pending.extend(data)
+        return len(data)
+
+    def drain(self):
+        data = bytes(self.pending)
+        self.pending.clear()
+        return data
+
+class XlsxEncoder:
+    def __init__(self, header, sheet: str):
+        self.header = header
+        self.sheet = sheet
+        self.letters = [column_letter(i) for i in range(len(header))]
+        self.sink = ZipSink()
+        self.archive = zipfile.ZipFile(self.sink, "w", compression=zipfile.ZIP_DEFLATED)
+        self.sheet_xml = None
+        self.written = 1
+
+    def begin(self):
+        for name, body in XLSX_PARTS.items():
+            self.archive.writestr(name, body.replace("{sheet}", self.sheet))
+        self.sheet_xml = self.archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self.sheet_xml.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'.encode()
+            + xlsx_row(1, self.header, self.letters).encode()
+        )
+        return self.sink.drain()
+
+    def rows(self, batch):
+        # Rows past the sheet's limit are dropped rather than making a file
+        # Excel refuses to open.
+        batch = batch[:max(0, XLSX_MAX_ROWS - self.written)]
+        self.sheet_xml.write("".join(xlsx_row(self.written + i + 1, row, self.letters) for i, row in enumerate(batch)).encode())
+        self.written += len(batch)
+        return self.sink.drain()
+
+    def end(self):
+        self.sheet_xml.write(b"</sheetData></worksheet>")
+        self.sheet_xml.close()
+        self.archive.close()
+        return self.sink.drain()
+
+def export_cursor(dataset: str, query):
+    return database()[COLLECTIONS[dataset]].find(query).sort(SORTS[dataset]).batch_size(EXPORT_BATCH_SIZE)
+
+async def row_batches(dataset: str, docs, users):
+    columns = EXPORT_COLUMNS[dataset]
+    batch = []
+    async for doc in docs:
+        batch.append([getter(doc, users) for _, getter in columns])
+        if len(batch) >= EXPORT_CHUNK_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def company_users(company: ObjectId):
+    # Names for the employee columns: one document per employee, however
+    # many rows the export has.
+    cursor = database()["users"].find({"company": company}, {"firstName": 1, "lastName": 1})
+    return {user["_id"]: user async for user in cursor}
+
+def encoder_for(dataset: str, fmt: str):
+    header = [name for name, _ in EXPORT_COLUMNS[dataset]]
+    return CsvEncoder(header) if fmt == "csv" else XlsxEncoder(header, dataset.capitalize())
+
+async def encode_stream(encoder, batches):
+    """Encoded chunks for row batches from an async source, one batch at a time."""
+    yield encoder.begin()
+    async for batch in batches:
+        export_stats["rows"] += len(batch)
+        chunk = encoder.rows(batch)
+        export_stats["bytes"] += len(chunk)
+        if chunk:
+            yield chunk
+    yield encoder.end()
+
+async def export_stream(dataset: str, fmt: str, query, company: ObjectId):
+    # The response has started by the time rows are read, so a failure is
+    # logged, counted and re-raised: the server then drops the connection
+    # instead of ending the chunked body, and the client sees a cut-off
+    # download rather than a short file that looks complete.
+    export_stats["started"] += 1
+    try:
+        users = await company_users(company)
+        async for chunk in encode_stream(encoder_for(dataset, fmt), row_batches(dataset, export_cursor(dataset, query), users)):
+            yield chunk
+    except Exception as exc:
+        export_stats["failed"] += 1
+        print(f"Export of {dataset} failed mid-stream: {exc!r}")
+        raise
+    export_stats["completed"] += 1
+
+def export_filename(dataset: str, fmt: str):
+    return f"{dataset}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}.{fmt}"
+
+def export_summary():
+    return dict(export_stats)
@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import math
+import os
+import time
+
+import numpy as np
+from bson import ObjectId
+
+from mongo import database, jsonable
+from request_errors import RequestError
+
+GEOFENCE_ENABLED = os.environ.get("GEOFENCE_ENABLED", "1") == "1"
+# Grid cells are this many meters of latitude on a side; a fence is filed
+# under every cell its radius reaches, so a point only meets the fences of
+# its own cell.
+GEOFENCE_CELL_METERS = float(os.environ.get("GEOFENCE_CELL_METERS", "1000"))
+GEOFENCE_OFFICE_RADIUS = float(os.environ.get("GEOFENCE_OFFICE_RADIUS", "300"))
+GEOFENCE_TASK_RADIUS = float(os.environ.get("GEOFENCE_TASK_RADIUS", "300"))
+GEOFENCE_MAX_AGE = float(os.environ.get("GEOFENCE_MAX_AGE", "300"))
+GEOFENCE_MAX_COMPANIES = int(os.environ.get("GEOFENCE_MAX_COMPANIES", "1000"))
+GEOFENCE_BATCH_LIMIT = int(os.environ.get("GEOFENCE_BATCH_LIMIT", "5000"))
+EARTH_RADIUS = 6371e3
+CELL_DEGREES = GEOFENCE_CELL_METERS / (EARTH_RADIUS * math.pi / 180)
+ACTIVE_LOCATION_STATUSES = ("Pending", "In Progress")
+# Writes that can add, move or retire a fence: office locations live in
+# the organization settings, task locations under their task.
+FENCE_WRITE_PREFIXES = {"offices": ("organization-settings",), "tasks": ("task/", "task-extended/")}
+
+fence_index = collections.OrderedDict()
+geofence_stats = {"checks": 0, "pings": 0, "candidates": 0, "matches": 0, "loads": 0}
+
+def haversine(lat1, lng1, lat2, lng2):
+    # OrganizationSettings.calculateDistance, element-wise, so points on a
+    # fence's edge land on the same side as in Node.
+    phi1 = lat1 * np.pi / 180
+    phi2 = lat2 * np.pi / 180
+    d_phi = (lat2 - lat1) * np.pi / 180
+    d_lambda = (lng2 - lng1) * np.pi / 180
+    a = np.sin(d_phi / 2) * np.sin(d_phi / 2) + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) * np.sin(d_lambda / 2)
+    return EARTH_RADIUS * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+def cell_of(lat, lng):
+    return int(math.floor(lat / CELL_DEGREES)), int(math.floor(lng / CELL_DEGREES))
+
+def fence_cells(lat: float, lng: float, radius: float):
+    lat_span = radius / (EARTH_RADIUS * math.pi / 180)
+    lng_span = lat_span / max(math.cos(math.radians(lat)), 0.01)
+    cells = []
+    # A fence reaching across the antimeridian is also filed on the far side.
+    for shift in (0, 360, -360):
+        if shift == 0 or abs(lng + shift) - lng_span <= 180:
+            (south, west), (north, east) = cell_of(lat - lat_span, lng + shift - lng_span), cell_of(lat + lat_span, lng + shift + lng_span)
+            cells += [(i, j) for i in range(south, north + 1) for j in range(west, east + 1)]
+    return cells
+
+def build_index(offices, tasks):
+    # Offices keep their order from the settings document: Node's check
+    # reports the first office in that order, not the nearest.
+    fences = [("office", o["_id"], o.get("name"), o["lat"], o["lng"], o["radius"], None) for o in offices]
+    fences += [("task", t["_id"], t.get("name"), t["lat"], t["lng"], GEOFENCE_TASK_RADIUS, t["task"]) for t in tasks]
+    cells = collections.defaultdict(list)
+    for row, fence in enumerate(fences):
+        for cell in fence_cells(fence[3], fence[4], fence[5]):
+            cells[cell].append(row)
+    return {
+        "fences": fences,
+        "lat": np.array([f[3] for f in fences], dtype=float),
+        "lng": np.array([f[4] for f in fences], dtype=float),
+        "radius": np.array([f[5] for f in fences], dtype=float),
+        "cells": {cell: np.array(rows) for cell, rows in cells.items()},
+    }
+
+def office_fences(settings):
+    offices = []
+    for office in (settings or {}).get("officeLocations") or ():
+        coords = office.get("coordinates") or {}
+        if isinstance(coords.get("latitude"), (int, float)) and isinstance(coords.get("longitude"), (int, float)):
+            offices.append({
+                "_id": office.get("_id"), "name": office.get("name"), "lat": coords["latitude"], "lng": coords["longitude"],
+                "radius": office.get("geofenceRadius", GEOFENCE_OFFICE_RADIUS) or 0, "doc": office,
+            })
+    return offices
+
+async def load_offices(db, company: ObjectId):
+    return office_fences(await db["organizationsettings"].find_one({"company": company}, {"officeLocations": 1}))
+
+async def load_task_locations(db, company: ObjectId):
+    # Locations of tasks still open, and not yet completed or skipped
+    # themselves; TaskLocation has no company, so it is reached via Task.
+    tasks = await db["tasks"].distinct("_id", {"company": company, "status": {"$ne": "Completed"}})
+    cursor = db["tasklocations"].find(
+        {"task": {"$in": tasks}, "status": {"$in": list(ACTIVE_LOCATION_STATUSES)}},
+        {"task": 1, "name": 1, "coordinates": 1},
+    )
+    locations = []
+    async for loc in cursor:
+        coords = loc.get("coordinates") or {}
+        if isinstance(coords.get("latitude"), (int, float)) and isinstance(coords.get("longitude"), (int, float)):
+            locations.append({"_id": loc["_id"], "task": loc["task"], "name": loc.get("name"), "lat": coords["latitude"], "lng": coords["longitude"]})
+    return locations
+
+async def company_index(company: ObjectId):
+    # Each company's fences load on first use and reload when they age out;
+    # a write only reloads the kind of fence it can have changed.
+    entry = fence_index.get(company)
+    if entry is None:
+        entry = fence_index[company] = {"lock": asyncio.Lock(), "offices": None, "tasks": None, "loaded": {}, "index": None}
+        while len(fence_index) > GEOFENCE_MAX_COMPANIES:
+            fence_index.popitem(last=False)
+    fence_index.move_to_end(company)
+    async with entry["lock"]:
+        now = time.monotonic()
+        stale = [kind for kind in ("offices", "tasks") if now - entry["loaded"].get(kind, -math.inf) > GEOFENCE_MAX_AGE]
+        if stale or entry["index"] is None:
+            db = database()
+            loaders = {"offices": load_offices, "tasks": load_task_locations}
+            for kind, fences in zip(stale, await asyncio.gather(*(loaders[kind](db, company) for kind in stale))):
+                entry[kind] = fences
+                entry["loaded"][kind] = now
+            geofence_stats["loads"] += len(stale)
+            entry["index"] = build_index(entry["offices"], entry["tasks"])
+    return entry
+
+def note_geofence_write(path: str, claims):
+    company = str(claims.get("company") or "")
+    entry = fence_index.get(ObjectId(company)) if ObjectId.is_valid(company) else None
+    if entry is None:
+        return
+    for kind, prefixes in FENCE_WRITE_PREFIXES.items():
+        if path.startswith(prefixes):
+            entry["loaded"].pop(kind, None)
+
+def locate(index, lats, lngs):
+    """Containing fences for each point, nearest first, from one haversine pass."""
+    pings, rows = [], []
+    empty = np.empty(0, dtype=int)
+    for k, (lat, lng) in enumerate(zip(lats, lngs)):
+        candidates = index["cells"].get(cell_of(lat, lng), empty)
+        pings.append(np.full(len(candidates), k))
+        rows.append(candidates)
+    pings = np.concatenate(pings) if pings else empty
+    rows = np.concatenate(rows).astype(int) if rows else empty
+    distance = haversine(np.asarray(lats, dtype=float)[pings], np.asarray(lngs, dtype=float)[pings], index["lat"][rows], index["lng"][rows])
+    inside = distance <= index["radius"][rows]
+    geofence_stats["candidates"] += len(rows)
+    geofence_stats["matches"] += int(inside.sum())
+    order = np.lexsort((distance[inside], pings[inside]))
+    results = [[] for _ in lats]
+    for ping, row, meters in zip(pings[inside][order], rows[inside][order], distance[inside][order]):
+        results[ping].append((int(row), float(meters)))
+    return results
+
+def fence_payload(fence, meters: float):
+    kind, fence_id, name, lat, lng, radius, task = fence
+    payload = {"type": kind, "id": str(fence_id), "name": name, "distance": round(meters, 1), "radius": radius if radius % 1 else int(radius)}
+    if task is not None:
+        payload["taskId"] = str(task)
+    return payload
+
+def check_result(index, matches, offices):
+    office_rows = [row for row, _ in matches if index["fences"][row][0] == "office"]
+    office = offices[min(office_rows)]["doc"] if office_rows else None
+    return {
+        "isWithin": office is not None,
+        "office": jsonable(office),
+        "fences": [fence_payload(index["fences"][row], meters) for row, meters in matches],
+    }
+
+def parse_point(point):
+    # Same test as the check-in controller: both coordinates present and
+    # non-zero, here also required to be numbers.
+    coords = point.get("coordinates", point) if isinstance(point, dict) else None
+    lat = coords.get("latitude") if isinstance(coords, dict) else None
+    lng = coords.get("longitude") if isinstance(coords, dict) else None
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v for v in (lat, lng)):
+        raise RequestError(400, "Geolocation is required")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise RequestError(400, "Geolocation is out of range")
+    return float(lat), float(lng)
+
+async def check_points(company: ObjectId, points):
+    entry = await company_index(company)
+    index = entry["index"]
+    lats, lngs = zip(*points) if points else ((), ())
+    results = locate(index, list(lats), list(lngs))
+    geofence_stats["checks"] += 1
+    geofence_stats["pings"] += len(points)
+    return [check_result(index, matches, entry["offices"]) for matches in results]
+
+async def check_payload(company: ObjectId, body):
+    return (await check_points(company, [parse_point(body)]))[0]
+
+async def check_batch_payload(company: ObjectId, body):
+    pings = body.get("pings") if isinstance(body, dict) else None
+    if not isinstance(pings, list) or not pings:
+        raise RequestError(400, "pings must be a non-empty list")
+    if len(pings) > GEOFENCE_BATCH_LIMIT:
+        raise RequestError(413, f"At most {GEOFENCE_BATCH_LIMIT} pings per batch")
+    return {"results": await check_points(company, [parse_point(p) for p in pings])}
+
+def geofence_summary():
+    return {
+        **geofence_stats,
+        "companies": len(fence_index),
+        "fences": sum(len(e["index"]["fences"]) for e in fence_index.values() if e["index"]),
+    }
@@ -0,0 +1,43 @@
+import hashlib
+import os
+
+from fastapi.responses import Response
+
+ETAG_ENABLED = os.environ.get("ETAG_ENABLED", "1") == "1"
+ETAG_MAX_BYTES = int(os.environ.get("ETAG_MAX_BYTES", str(2 * 1024 * 1024)))
+# Headers a 304 must repeat from the 200 it stands in for (RFC 9110 15.4.5);
+# Date is left to the server, which adds a fresh one to every response.
+NOT_MODIFIED_HEADERS = ("cache-control", "content-location", "etag", "expires", "vary")
+
+def compute_etag(body: bytes):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def etag_eligible(method: str, status_code: int, headers, size):
+    if not ETAG_ENABLED or method != "GET" or status_code != 200 or size is None:
+        return False
+    return "json" in headers.get("content-type", "") and int(size) <= ETAG_MAX_BYTES
+
+ENCODING_SUFFIXES = ("-br", "-gzip")
+
+def variant_etag(etag: str, encoding: str):
+    # Compressed bodies are different representations and need their own
+    # strong validator; the suffix is stripped again when comparing.
+    return f'{etag[:-1]}-{encoding}"'
+
+def base_etag(tag: str):
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored.
+    tag = tag.strip().removeprefix("W/")
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix + '"'):
+            return tag[: -len(suffix) - 1] + '"'
+    return tag
+
+def etag_matches(if_none_match, etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return base_etag(etag) in [base_etag(tag) for tag in if_none_match.split(",")]
+
+def not_modified_response(headers):
+    return Response(status_code=304, headers={k: v for k, v in headers.items() if k in NOT_MODIFIED_HEADERS})
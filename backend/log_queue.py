@@ -0,0 +1,35 @@
+import logging
+import logging.handlers
+import queue
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Callers must never wait on disk; if the writer thread falls behind,
+    # records are dropped and counted instead.
+    def __init__(self, records, stats, dropped_key):
+        super().__init__(records)
+        self.stats = stats
+        self.dropped_key = dropped_key
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats[self.dropped_key] += 1
+
+def start_file_writer(logger, path, max_bytes, backups, queue_size, stats, dropped_key):
+    # Log records go through a bounded queue to a rotating file written on
+    # a listener thread; returns the listener for stop_file_writer().
+    records = queue.Queue(maxsize=queue_size)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    logger.addHandler(DroppingQueueHandler(records, stats, dropped_key))
+    logger.setLevel(logging.INFO)
+    return listener
+
+def stop_file_writer(logger, listener):
+    listener.stop()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    listener.handlers[0].close()
@@ -0,0 +1,103 @@
+import bisect
+import collections
+import os
+import time
+
+from route_labels import route_template
+
+METRICS_MAX_ROUTES = int(os.environ.get("METRICS_MAX_ROUTES", "300"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HISTOGRAMS = {
+    "proxy_request_duration_seconds": "Time from request arrival to the last response byte.",
+    "proxy_upstream_duration_seconds": "Time spent waiting on the Node backend.",
+    "proxy_overhead_seconds": "Request time not spent waiting on the Node backend.",
+}
+
+request_counts = collections.Counter()
+histograms = {name: {} for name in HISTOGRAMS}
+known_routes = set()
+gauges = {"in_flight": 0}
+
+def route_label(path: str):
+    # Unknown paths (scanners, typos) must not grow the series without
+    # bound; past the cap they all share one label.
+    route = route_template(path)
+    if route in known_routes:
+        return route
+    if len(known_routes) >= METRICS_MAX_ROUTES:
+        return "other"
+    known_routes.add(route)
+    return route
+
+def observe(name: str, route: str, seconds: float):
+    series = histograms[name].get(route)
+    if series is None:
+        series = histograms[name][route] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+    series[0][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    series[1] += seconds
+    series[2] += 1
+
+def record_request(route: str, method: str, status: int, total: float, upstream: float):
+    request_counts[(route, method, status)] += 1
+    observe("proxy_request_duration_seconds", route, total)
+    if upstream:
+        observe("proxy_upstream_duration_seconds", route, upstream)
+    observe("proxy_overhead_seconds", route, max(total - upstream, 0.0))
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        gauges["in_flight"] += 1
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            gauges["in_flight"] -= 1
+            upstream = scope.get("state", {}).get("upstream_seconds", 0.0)
+            record_request(route_label(scope["path"][5:]), scope["method"], status, time.perf_counter() - started, upstream)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels):
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items()) + "}" if labels else ""
+
+def render_metrics(extra_gauges=()):
+    lines = [
+        "# HELP proxy_requests_total Proxied API requests by route template, method and status.",
+        "# TYPE proxy_requests_total counter",
+    ]
+    for (route, method, status), count in sorted(request_counts.items()):
+        lines.append(f"proxy_requests_total{format_labels({'route': route, 'method': method, 'status': status})} {count}")
+    lines += [
+        "# HELP proxy_in_flight_requests Proxied API requests currently being served.",
+        "# TYPE proxy_in_flight_requests gauge",
+        f"proxy_in_flight_requests {gauges['in_flight']}",
+    ]
+    for name, help_text in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for route, (buckets, total, count) in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels({'route': route, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{format_labels({'route': route})} {total:.6f}")
+            lines.append(f"{name}_count{format_labels({'route': route})} {count}")
+    for name, help_text, samples in extra_gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for labels, value in samples:
+            lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
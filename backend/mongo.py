@@ -0,0 +1,33 @@
+import os
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+MONGO_URI = os.environ.get("MONGO_URI", "")
+
+mongo_state = {"client": None}
+
+def database():
+    if mongo_state["client"] is None:
+        mongo_state["client"] = AsyncIOMotorClient(MONGO_URI, tz_aware=True)
+    # mongoose uses the database named in the URI, or "test" without one.
+    return mongo_state["client"].get_default_database("test")
+
+def close_database():
+    if mongo_state["client"]:
+        mongo_state["client"].close()
+    mongo_state["client"] = None
+
+def jsonable(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        # Same shape as Express's Date.toJSON(), so clients parse both alike.
+        value = value.astimezone(timezone.utc)
+        return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+    if isinstance(value, dict):
+        return {k: jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [jsonable(v) for v in value]
+    return value
@@ -0,0 +1,102 @@
+import collections
+import itertools
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+from log_queue import start_file_writer, stop_file_writer
+
+NODE_LOG_BUFFER_SIZE = int(os.environ.get("NODE_LOG_BUFFER_SIZE", "5000"))
+NODE_LOG_MAX_LINE = int(os.environ.get("NODE_LOG_MAX_LINE", "8192"))
+NODE_LOG_READ_CHUNK = 64 * 1024
+NODE_LOG_FILE = os.environ.get("NODE_LOG_FILE", "")
+NODE_LOG_FILE_MAX_BYTES = int(os.environ.get("NODE_LOG_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+NODE_LOG_FILE_BACKUPS = int(os.environ.get("NODE_LOG_FILE_BACKUPS", "5"))
+NODE_LOG_FILE_QUEUE = int(os.environ.get("NODE_LOG_FILE_QUEUE", "10000"))
+ERROR_MARKERS = ("error", "exception", "unhandled", "failed")
+WARNING_MARKERS = ("warn", "deprecat")
+
+log_records = collections.deque(maxlen=NODE_LOG_BUFFER_SIZE)
+log_sequence = itertools.count(1)
+log_stats = {"lines": 0, "truncated": 0, "file_dropped": 0}
+file_listener = None
+
+file_logger = logging.getLogger("foratask.node")
+file_logger.propagate = False
+
+def start_log_file():
+    # The pump must never wait on disk; if the writer thread falls behind,
+    # file records are dropped while the in-memory buffer stays complete.
+    global file_listener
+    if not NODE_LOG_FILE or file_listener:
+        return
+    file_listener = start_file_writer(
+        file_logger, NODE_LOG_FILE, NODE_LOG_FILE_MAX_BYTES, NODE_LOG_FILE_BACKUPS, NODE_LOG_FILE_QUEUE,
+        log_stats, "file_dropped",
+    )
+
+def stop_log_file():
+    global file_listener
+    if not file_listener:
+        return
+    stop_file_writer(file_logger, file_listener)
+    file_listener = None
+
+def classify_level(message: str):
+    lowered = message.lower()
+    if any(marker in lowered for marker in ERROR_MARKERS):
+        return "error"
+    if any(marker in lowered for marker in WARNING_MARKERS):
+        return "warning"
+    return "info"
+
+def record_line(worker_id, pid, raw: bytes):
+    if len(raw) > NODE_LOG_MAX_LINE:
+        raw = raw[:NODE_LOG_MAX_LINE]
+        log_stats["truncated"] += 1
+    message = raw.decode("utf-8", "replace").rstrip("\r")
+    if not message:
+        return
+    record = {
+        "seq": next(log_sequence),
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "worker": worker_id,
+        "pid": pid,
+        "level": classify_level(message),
+        "message": message,
+    }
+    log_records.append(record)
+    log_stats["lines"] += 1
+    if file_listener:
+        file_logger.info(json.dumps(record, ensure_ascii=False))
+
+async def pump_node_output(stream, worker_id, pid):
+    # Read fixed-size chunks rather than readline() so an oversized line
+    # can't stall the reader, and Node never blocks on a full pipe.
+    pending = b""
+    while True:
+        chunk = await stream.read(NODE_LOG_READ_CHUNK)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            record_line(worker_id, pid, line)
+        while len(pending) > NODE_LOG_MAX_LINE:
+            record_line(worker_id, pid, pending[:NODE_LOG_MAX_LINE])
+            pending = pending[NODE_LOG_MAX_LINE:]
+    if pending:
+        record_line(worker_id, pid, pending)
+
+def query_logs(worker=None, level=None, since=0, limit=200):
+    matched = [
+        r for r in log_records
+        if r["seq"] > since
+        and (worker is None or r["worker"] == worker)
+        and (level is None or r["level"] == level)
+    ]
+    return matched[-limit:] if limit > 0 else []
+
+def log_buffer_stats():
+    return {**log_stats, "buffered": len(log_records), "capacity": NODE_LOG_BUFFER_SIZE, "file": NODE_LOG_FILE or None}
@@ -0,0 +1,246 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from mongo import database, jsonable
+
+NOTIFY_HEARTBEAT_INTERVAL = float(os.environ.get("NOTIFY_HEARTBEAT_INTERVAL", "15"))
+NOTIFY_CLIENT_BUFFER = int(os.environ.get("NOTIFY_CLIENT_BUFFER", "100"))
+NOTIFY_RESUME_LIMIT = int(os.environ.get("NOTIFY_RESUME_LIMIT", "100"))
+NOTIFY_POLL_INTERVAL = float(os.environ.get("NOTIFY_POLL_INTERVAL", "1"))
+NOTIFY_POLL_LOOKBACK = float(os.environ.get("NOTIFY_POLL_LOOKBACK", "10"))
+NOTIFY_MAX_STREAMS_PER_USER = int(os.environ.get("NOTIFY_MAX_STREAMS_PER_USER", "5"))
+NOTIFY_RETRY_MS = int(os.environ.get("NOTIFY_RETRY_MS", "5000"))
+NOTIFY_TICKET_TTL = float(os.environ.get("NOTIFY_TICKET_TTL", "30"))
+NOTIFY_MAX_TICKETS = int(os.environ.get("NOTIFY_MAX_TICKETS", "10000"))
+NOTIFY_MAX_TICKETS_PER_USER = int(os.environ.get("NOTIFY_MAX_TICKETS_PER_USER", "5"))
+
+subscribers = {}
+feed_state = {"task": None, "source": None, "errors": 0}
+stream_stats = {"opened": 0, "closed": 0, "overflowed": 0, "delivered": 0}
+stream_tickets = {}
+
+class StreamOverflow(Exception):
+    pass
+
+class ReadStateChanged:
+    pass
+
+def notifications_collection():
+    return database()["notifications"]
+
+def parse_event_id(value):
+    try:
+        return ObjectId(value) if value else None
+    except (InvalidId, TypeError):
+        return None
+
+def stream_slots_left(user_id: str):
+    return NOTIFY_MAX_STREAMS_PER_USER - len(subscribers.get(user_id, ()))
+
+def expire_stream_tickets():
+    now = time.monotonic()
+    for ticket in [t for t, (_, _, expires) in stream_tickets.items() if expires <= now]:
+        stream_tickets.pop(ticket, None)
+
+def ticket_slots_left(user_id: str):
+    expire_stream_tickets()
+    return NOTIFY_MAX_TICKETS_PER_USER - sum(1 for _, owner, _ in stream_tickets.values() if owner == user_id)
+
+def issue_stream_ticket(token: str, user_id: str):
+    # EventSource can't send headers, and a JWT in the URL ends up in access
+    # logs; the URL carries a short-lived, single-use ticket instead. Only
+    # tokens already verified get one, and each user holds a few at most.
+    expire_stream_tickets()
+    if len(stream_tickets) >= NOTIFY_MAX_TICKETS:
+        return None
+    ticket = secrets.token_urlsafe(24)
+    stream_tickets[ticket] = (token, user_id, time.monotonic() + NOTIFY_TICKET_TTL)
+    return ticket
+
+def redeem_stream_ticket(ticket: str):
+    token, _, expires = stream_tickets.pop(ticket, (None, None, 0.0))
+    return token if expires > time.monotonic() else None
+
+def subscribe(user_id: str):
+    streams = subscribers.setdefault(user_id, set())
+    queue = asyncio.Queue(maxsize=NOTIFY_CLIENT_BUFFER)
+    streams.add(queue)
+    stream_stats["opened"] += 1
+    return queue
+
+def unsubscribe(user_id: str, queue):
+    streams = subscribers.get(user_id)
+    if streams is None or queue not in streams:
+        return
+    streams.discard(queue)
+    if not streams:
+        subscribers.pop(user_id, None)
+    stream_stats["closed"] += 1
+
+def publish(doc):
+    deliver(str(doc.get("userId")), doc)
+
+def publish_read_change(user_id: str):
+    # Node marks notifications read with updateMany; each stream recounts
+    # once per batch of these, like it does for new notifications.
+    deliver(user_id, ReadStateChanged())
+
+def deliver(user_id: str, item):
+    # A client that can't keep up is cut off instead of buffering without
+    # bound; it reconnects with Last-Event-ID and catches up from Mongo.
+    for queue in list(subscribers.get(user_id, ())):
+        try:
+            queue.put_nowait(item)
+            stream_stats["delivered"] += 1
+        except asyncio.QueueFull:
+            stream_stats["overflowed"] += 1
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(StreamOverflow())
+
+async def watch_change_stream(collection):
+    pipeline = [{"$match": {"$or": [
+        {"operationType": "insert"},
+        {"operationType": "update", "updateDescription.updatedFields.isRead": {"$exists": True}},
+    ]}}]
+    async with collection.watch(pipeline, full_document="updateLookup") as stream:
+        feed_state["source"] = "change_stream"
+        async for change in stream:
+            doc = change.get("fullDocument")
+            if doc is None:
+                continue
+            if change["operationType"] == "insert":
+                publish(doc)
+            else:
+                publish_read_change(str(doc.get("userId")))
+
+async def poll_new_notifications(collection):
+    # Standalone servers have no change streams: one query per interval for
+    # the whole process replaces every client's own poll. Notifications have
+    # no updatedAt, so reads aren't seen here; clients keep a slow poll of
+    # the unread count for that. ObjectIds from
+    # different Node workers aren't strictly ordered, so each query re-reads
+    # a short window and skips what was already published.
+    feed_state["source"] = "polling"
+    started = datetime.now(timezone.utc)
+    published = {}
+    while True:
+        if subscribers:
+            now = datetime.now(timezone.utc)
+            window_start = max(started, now - timedelta(seconds=NOTIFY_POLL_LOOKBACK))
+            cursor = collection.find({"_id": {"$gte": ObjectId.from_datetime(window_start)}}).sort("_id", 1)
+            async for doc in cursor:
+                if doc["_id"] not in published:
+                    published[doc["_id"]] = now
+                    publish(doc)
+            cutoff = now - timedelta(seconds=NOTIFY_POLL_LOOKBACK * 2)
+            published = {doc_id: seen for doc_id, seen in published.items() if seen >= cutoff}
+        await asyncio.sleep(NOTIFY_POLL_INTERVAL)
+
+async def run_notification_feed():
+    collection = notifications_collection()
+    backoff = NOTIFY_POLL_INTERVAL
+    while True:
+        try:
+            try:
+                await watch_change_stream(collection)
+            except OperationFailure:
+                await poll_new_notifications(collection)
+        except PyMongoError as exc:
+            feed_state["errors"] += 1
+            feed_state["source"] = None
+            print(f"Notification feed error: {exc}; retrying in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+        else:
+            backoff = NOTIFY_POLL_INTERVAL
+
+def ensure_notification_feed():
+    if feed_state["task"] is None or feed_state["task"].done():
+        feed_state["task"] = asyncio.create_task(run_notification_feed())
+
+async def stop_notification_feed():
+    task = feed_state["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    feed_state.update(task=None, source=None)
+
+async def missed_notifications(user_id: str, company: str, after: ObjectId):
+    query = {"userId": ObjectId(user_id), "_id": {"$gt": after}}
+    if company:
+        query["company"] = ObjectId(company)
+    cursor = notifications_collection().find(query).sort("_id", 1).limit(NOTIFY_RESUME_LIMIT)
+    return [doc async for doc in cursor]
+
+async def unread_count(user_id: str, company: str):
+    query = {"userId": ObjectId(user_id), "isRead": False}
+    if company:
+        query["company"] = ObjectId(company)
+    return await notifications_collection().count_documents(query)
+
+def sse_event(event: str, data: str, event_id=None):
+    lines = [f"id: {event_id}"] if event_id else []
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+async def notification_events(user_id: str, company: str, last_event_id, unread: int):
+    # Subscribed here rather than by the caller: a generator that never
+    # starts would never run its finally, and the queue would leak.
+    queue = subscribe(user_id)
+    try:
+        async for chunk in stream_events(user_id, company, queue, last_event_id, unread):
+            yield chunk
+    finally:
+        unsubscribe(user_id, queue)
+
+async def stream_events(user_id: str, company: str, queue, last_event_id, unread: int):
+    # Subscribed before the catch-up query, so nothing inserted meanwhile
+    # is lost; live events already sent by the catch-up are skipped.
+    resume_from = parse_event_id(last_event_id)
+    replayed = set()
+    yield f"retry: {NOTIFY_RETRY_MS}\n\n"
+    yield sse_event("unread", json.dumps({"count": unread}))
+    if resume_from:
+        for doc in await missed_notifications(user_id, company, resume_from):
+            replayed.add(doc["_id"])
+            yield sse_event("notification", json.dumps(jsonable(doc)), doc["_id"])
+    while True:
+        try:
+            doc = await asyncio.wait_for(queue.get(), NOTIFY_HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            yield ": ping\n\n"
+            continue
+        if isinstance(doc, StreamOverflow):
+            return
+        recount = False
+        while doc is not None:
+            if isinstance(doc, ReadStateChanged):
+                recount = True
+            elif doc["_id"] not in replayed:
+                recount = True
+                yield sse_event("notification", json.dumps(jsonable(doc)), doc["_id"])
+            doc = queue.get_nowait() if not queue.empty() else None
+            if isinstance(doc, StreamOverflow):
+                return
+        if recount:
+            yield sse_event("unread", json.dumps({"count": await unread_count(user_id, company)}))
+
+def notification_stream_stats():
+    return {
+        **stream_stats,
+        "users": len(subscribers),
+        "streams": sum(len(streams) for streams in subscribers.values()),
+        "tickets": len(stream_tickets),
+        "source": feed_state["source"],
+        "feed_errors": feed_state["errors"],
+    }
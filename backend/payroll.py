@@ -0,0 +1,333 @@
+import asyncio
+import calendar
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from mongo import database
+from request_errors import RequestError
+
+# Fallbacks salaryController uses when a company has no organization
+# settings or no overtime multiplier.
+DEFAULT_WORKING_DAYS = 22
+DEFAULT_OVERTIME_MULTIPLIER = 1.5
+# OrganizationSettings.workingDays schema defaults, indexed by Python's
+# weekday() (Monday is 0).
+WEEKDAY_DEFAULTS = (
+    ("monday", True), ("tuesday", True), ("wednesday", True), ("thursday", True),
+    ("friday", True), ("saturday", False), ("sunday", False),
+)
+STANDARD_DEDUCTIONS = {"pf": 12, "esi": 0.75, "professionalTax": 200, "tds": 0}
+INT32_MAX = 2 ** 31 - 1
+
+payroll_stats = {"runs": 0, "records": 0, "skipped": 0, "last_run_ms": None}
+
+def parse_period(body):
+    # SalaryRecord only accepts months 0-11 (JavaScript's numbering).
+    if not isinstance(body, dict):
+        raise RequestError(400, "Body must be a JSON object")
+    month, year = body.get("month"), body.get("year")
+    if type(month) is not int or type(year) is not int or not 0 <= month <= 11 or not 1 <= year <= 9999:
+        raise RequestError(400, "month (0-11) and year are required")
+    user_ids = body.get("userIds")
+    if user_ids is None:
+        return month, year, None
+    if not isinstance(user_ids, list) or not all(isinstance(u, str) and ObjectId.is_valid(u) for u in user_ids):
+        raise RequestError(400, "userIds must be a list of user ids")
+    return month, year, [ObjectId(u) for u in dict.fromkeys(user_ids)]
+
+def month_bounds(year: int, month: int):
+    # Attendance.getMonthlyStats matches dates from the 1st through
+    # midnight of the last day, in Node's local time (UTC here).
+    start = datetime(year, month + 1, 1, tzinfo=timezone.utc)
+    return start, start + timedelta(days=calendar.monthrange(year, month + 1)[1] - 1)
+
+def bson_number(value):
+    # js-bson stores whole numbers that fit in 32 bits as int32, so records
+    # written here look the same as the ones Node saves.
+    value = float(value)
+    return int(value) if value.is_integer() and abs(value) <= INT32_MAX else value
+
+def working_days_in_month(settings, year: int, month: int):
+    if settings is None:
+        return DEFAULT_WORKING_DAYS
+    days = pd.date_range(datetime(year, month + 1, 1), periods=calendar.monthrange(year, month + 1)[1], freq="D")
+    enabled = settings.get("workingDays") or {}
+    weekdays = [i for i, (name, default) in enumerate(WEEKDAY_DEFAULTS) if enabled.get(name, default)]
+    holidays = {
+        h["date"].astimezone(timezone.utc).day
+        for h in settings.get("holidays") or ()
+        if isinstance(h.get("date"), datetime)
+        and h["date"].astimezone(timezone.utc).month == month + 1
+        and (h["date"].astimezone(timezone.utc).year == year or h.get("isRecurringYearly"))
+    }
+    working = np.isin(days.dayofweek, weekdays) & ~np.isin(days.day, list(holidays))
+    return int(working.sum())
+
+def attendance_frame(records, users):
+    df = pd.DataFrame.from_records(
+        [
+            {
+                "user": r["user"],
+                "status": r.get("status") or "absent",
+                "total": (r.get("workingHours") or {}).get("total"),
+                "overtime": (r.get("workingHours") or {}).get("overtime"),
+                "late": bool((r.get("checkIn") or {}).get("isLate")),
+                "early": bool((r.get("checkOut") or {}).get("isEarlyLeave")),
+            }
+            for r in records
+        ],
+        columns=["user", "status", "total", "overtime", "late", "early"],
+    )
+    # getMonthlyStats keys counts by status.replace('-', ''), so 'on-leave'
+    # lands under "onleave" and its onLeave total stays 0; kept as is so
+    # both paths pay the same.
+    df["key"] = np.where(df["status"] == "half-day", "halfDay", df["status"].str.replace("-", "", n=1))
+    counts = pd.crosstab(df["user"], df["key"]).reindex(
+        index=users, columns=["present", "halfDay", "onLeave", "holiday", "weekend"], fill_value=0
+    )
+    sums = df.groupby("user").agg(
+        minutes=("total", lambda s: s.fillna(0).sum()),
+        overtime=("overtime", lambda s: s.fillna(0).sum()),
+        late=("late", "sum"),
+        early=("early", "sum"),
+    ).reindex(users, fill_value=0)
+    return counts.join(sums)
+
+def component_matrix(configs, kind: str, base):
+    # One column per component position: adding the columns left to right
+    # gives the same floating-point sums as the controller's loops.
+    rows = [
+        (i, c.get("name"), c.get("amount") or 0, bool(c.get("isPercentage")))
+        for i, config in enumerate(configs)
+        for c in config.get("components") or ()
+        if c.get("type") == kind
+    ]
+    comps = pd.DataFrame(rows, columns=["row", "name", "amount", "pct"])
+    comps["position"] = comps.groupby("row").cumcount()
+    amount = comps["amount"].to_numpy(dtype=float)
+    comps["value"] = np.where(comps["pct"], base[comps["row"].to_numpy(dtype=int)] * amount / 100, amount)
+    width = int(comps["position"].max()) + 1 if len(comps) else 0
+    matrix = np.zeros((len(configs), width))
+    matrix[comps["row"].to_numpy(dtype=int), comps["position"].to_numpy(dtype=int)] = comps["value"].to_numpy()
+    return comps, matrix
+
+def row_sums(matrix, start):
+    total = start.copy()
+    for column in matrix.T:
+        total = total + column
+    return total
+
+def standard_deduction(configs, name: str, field: str):
+    settings = [((c.get("standardDeductions") or {}).get(name) or {}) for c in configs]
+    enabled = np.array([bool(s.get("enabled")) for s in settings], dtype=bool)
+    value = np.array([s.get(field, STANDARD_DEDUCTIONS[name]) or 0 for s in settings], dtype=float)
+    return enabled, value
+
+def compute_payroll(configs, attendance, settings, year: int, month: int):
+    """Vectorized salaryController.generateSalaryRecord for a list of configs."""
+    working_days = working_days_in_month(settings, year, month)
+    multiplier = ((settings or {}).get("overtime") or {}).get("rateMultiplier") or DEFAULT_OVERTIME_MULTIPLIER
+    stats = attendance_frame(attendance, [c["user"] for c in configs])
+
+    basic = np.array([c.get("basicSalary") or 0 for c in configs], dtype=float)
+    per_hour = np.array([c.get("perHourSalary") or 0 for c in configs], dtype=float)
+    earning_comps, earnings = component_matrix(configs, "earning", basic)
+    gross = row_sums(earnings, basic)
+    deduction_comps, deductions = component_matrix(configs, "deduction", gross)
+
+    present = stats["present"].to_numpy(dtype=float)
+    half_days = stats["halfDay"].to_numpy(dtype=float)
+    on_leave = stats["onLeave"].to_numpy(dtype=float)
+    effective = present + half_days * 0.5 + on_leave + stats["holiday"].to_numpy() + stats["weekend"].to_numpy()
+    unpaid = np.maximum(0, working_days - effective)
+    overtime_hours = stats["overtime"].to_numpy(dtype=float) / 60
+    overtime_pay = overtime_hours * (per_hour * multiplier)
+    total_earnings = gross + overtime_pay
+
+    loss_of_pay = unpaid * (gross / working_days)
+    pf_on, pf_pct = standard_deduction(configs, "pf", "percentage")
+    esi_on, esi_pct = standard_deduction(configs, "esi", "percentage")
+    pt_on, pt_amount = standard_deduction(configs, "professionalTax", "amount")
+    tds_on, tds_pct = standard_deduction(configs, "tds", "percentage")
+    pf = np.where(pf_on, basic * pf_pct / 100, 0)
+    esi = np.where(esi_on, gross * esi_pct / 100, 0)
+    pt = np.where(pt_on, pt_amount, 0)
+    tds = np.where(tds_on, gross * tds_pct / 100, 0)
+    total_deductions = loss_of_pay + pf + esi + pt + tds + row_sums(deductions, np.zeros(len(configs)))
+
+    return pd.DataFrame({
+        "user": [c["user"] for c in configs],
+        "workingDays": working_days,
+        "presentDays": stats["present"].to_numpy(),
+        "absentDays": unpaid,
+        "halfDays": stats["halfDay"].to_numpy(),
+        "paidLeaveDays": on_leave,
+        "unpaidLeaveDays": on_leave - on_leave,
+        "holidays": stats["holiday"].to_numpy(),
+        "weekends": stats["weekend"].to_numpy(),
+        "totalWorkingHours": stats["minutes"].to_numpy(),
+        "overtimeHours": overtime_hours,
+        "lateDays": stats["late"].to_numpy(),
+        "earlyLeaveDays": stats["early"].to_numpy(),
+        "basicSalary": basic,
+        "earningComponents": component_lists(earning_comps, len(configs)),
+        "overtimePay": overtime_pay,
+        "totalEarnings": total_earnings,
+        "deductionComponents": component_lists(deduction_comps, len(configs)),
+        "lossOfPay": loss_of_pay,
+        "pf": pf,
+        "esi": esi,
+        "professionalTax": pt,
+        "tds": tds,
+        "totalDeductions": total_deductions,
+        "grossSalary": gross,
+        "netSalary": total_earnings - total_deductions,
+    })
+
+def component_lists(comps, count: int):
+    lists = [[] for _ in range(count)]
+    for row, name, value in zip(comps["row"], comps["name"], comps["value"]):
+        lists[row].append({"_id": ObjectId(), "name": name, "amount": bson_number(value)})
+    return lists
+
+ATTENDANCE_FIELDS = (
+    "workingDays", "presentDays", "absentDays", "halfDays", "paidLeaveDays", "unpaidLeaveDays", "holidays",
+    "weekends", "totalWorkingHours", "overtimeHours", "lateDays", "earlyLeaveDays",
+)
+
+def record_update(row, company: ObjectId, month: int, year: int, generated_by: ObjectId, now: datetime):
+    # The same fields record.save() writes; the filter skips records that
+    # were marked paid after they were loaded, so those fail the upsert on
+    # the unique index instead of being overwritten.
+    return UpdateOne(
+        {"user": row["user"], "month": month, "year": year, "paymentStatus": {"$ne": "paid"}},
+        {
+            "$set": {
+                "attendance": {field: bson_number(row[field]) for field in ATTENDANCE_FIELDS},
+                "earnings": {
+                    "basicSalary": bson_number(row["basicSalary"]),
+                    "components": row["earningComponents"],
+                    "overtimePay": bson_number(row["overtimePay"]),
+                    "totalEarnings": bson_number(row["totalEarnings"]),
+                },
+                "deductions": {
+                    "components": row["deductionComponents"],
+                    **{f: bson_number(row[f]) for f in ("lossOfPay", "pf", "esi", "professionalTax", "tds", "totalDeductions")},
+                },
+                "grossSalary": bson_number(row["grossSalary"]),
+                "netSalary": bson_number(row["netSalary"]),
+                "generatedBy": generated_by,
+                "paymentStatus": "pending",
+                "updatedAt": now,
+            },
+            "$setOnInsert": {
+                "company": company, "paymentDate": None, "paymentMode": None, "transactionId": None,
+                "approvedBy": None, "approvedAt": None, "notes": None, "createdAt": now, "__v": 0,
+            },
+        },
+        upsert=True,
+    )
+
+async def load_payroll_inputs(db, company: ObjectId, month: int, year: int, user_ids):
+    query = {"company": company}
+    if user_ids is not None:
+        query["user"] = {"$in": user_ids}
+    configs = [c async for c in db["salaryconfigs"].find(query)]
+    users = [c["user"] for c in configs]
+    start, end = month_bounds(year, month)
+    members, records, settings, attendance = await asyncio.gather(
+        db["users"].distinct("_id", {"_id": {"$in": users}, "company": company}),
+        db["salaryrecords"].find({"user": {"$in": users}, "month": month, "year": year}, {"user": 1, "paymentStatus": 1}).to_list(None),
+        db["organizationsettings"].find_one({"company": company}),
+        db["attendances"].find(
+            {"user": {"$in": users}, "date": {"$gte": start, "$lte": end}},
+            {"user": 1, "status": 1, "workingHours": 1, "checkIn.isLate": 1, "checkOut.isEarlyLeave": 1},
+        ).to_list(None),
+    )
+    return configs, set(members), {r["user"]: r.get("paymentStatus") for r in records}, settings, attendance
+
+async def run_payroll(company: ObjectId, generated_by: ObjectId, month: int, year: int, user_ids=None):
+    """Generate every employee's SalaryRecord for one company-month.
+
+    With no userIds, every active salary configuration is paid; listed users
+    are paid whatever their configuration's isActive says, as the
+    per-employee endpoint does.
+    """
+    started = time.perf_counter()
+    db = database()
+    configs, members, statuses, settings, attendance = await load_payroll_inputs(db, company, month, year, user_ids)
+    skipped = []
+    if user_ids is not None:
+        configured = {c["user"] for c in configs}
+        skipped.extend({"user": str(u), "reason": "Salary configuration not found"} for u in user_ids if u not in configured)
+    payable = []
+    for config in configs:
+        reason = None
+        if config["user"] not in members:
+            reason = "User not found"
+        elif statuses.get(config["user"]) == "paid":
+            reason = "Salary already paid for this month"
+        elif user_ids is None and config.get("isActive") is False:
+            reason = "Salary configuration inactive"
+        if reason:
+            skipped.append({"user": str(config["user"]), "reason": reason})
+        else:
+            payable.append(config)
+    if payable and working_days_in_month(settings, year, month) == 0:
+        raise RequestError(400, "No working days in this month")
+
+    results = await asyncio.to_thread(compute_payroll, payable, attendance, settings, year, month) if payable else None
+    written = set()
+    if payable:
+        now = datetime.now(timezone.utc)
+        operations = [record_update(row, company, month, year, generated_by, now) for row in results.to_dict("records")]
+        failed = {}
+        try:
+            await db["salaryrecords"].bulk_write(operations, ordered=False)
+        except BulkWriteError as exc:
+            failed = {
+                e["index"]: "Salary already paid for this month" if e.get("code") == 11000 else e.get("errmsg", "Write failed")
+                for e in exc.details.get("writeErrors", ())
+            }
+        for index, row in enumerate(results.itertuples(index=False)):
+            if index in failed:
+                skipped.append({"user": str(row.user), "reason": failed[index]})
+            else:
+                written.add(index)
+
+    records = [
+        {
+            "user": str(row["user"]),
+            "grossSalary": bson_number(row["grossSalary"]),
+            "totalDeductions": bson_number(row["totalDeductions"]),
+            "netSalary": bson_number(row["netSalary"]),
+        }
+        for index, row in enumerate(results.to_dict("records") if results is not None else ())
+        if index in written
+    ]
+    payroll_stats["runs"] += 1
+    payroll_stats["records"] += len(records)
+    payroll_stats["skipped"] += len(skipped)
+    payroll_stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return {
+        "success": True,
+        "month": month,
+        "year": year,
+        "generated": len(records),
+        "records": records,
+        "skipped": skipped,
+        "summary": {
+            "totalGross": bson_number(sum(r["grossSalary"] for r in records)),
+            "totalDeductions": bson_number(sum(r["totalDeductions"] for r in records)),
+            "totalNet": bson_number(sum(r["netSalary"] for r in records)),
+        },
+    }
+
+def payroll_summary():
+    return dict(payroll_stats)
@@ -0,0 +1,366 @@
+import asyncio
+import math
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+from mongo import database, jsonable
+
+PLATFORM_SNAPSHOT_ENABLED = os.environ.get("PLATFORM_SNAPSHOT_ENABLED", "1") == "1"
+PLATFORM_SNAPSHOT_INTERVAL = float(os.environ.get("PLATFORM_SNAPSHOT_INTERVAL", "300"))
+PLATFORM_SNAPSHOT_MAX_AGE = float(os.environ.get("PLATFORM_SNAPSHOT_MAX_AGE", "900"))
+PLATFORM_SNAPSHOT_MIN_GAP = float(os.environ.get("PLATFORM_SNAPSHOT_MIN_GAP", "10"))
+PLATFORM_REVENUE_MONTHS = int(os.environ.get("PLATFORM_REVENUE_MONTHS", "36"))
+PLATFORM_TOP_TENANTS = int(os.environ.get("PLATFORM_TOP_TENANTS", "10"))
+PLATFORM_TRIAL_WINDOW_DAYS = int(os.environ.get("PLATFORM_TRIAL_WINDOW_DAYS", "14"))
+SUBSCRIPTION_STATUSES = ("trial", "active", "expired", "cancelled")
+# Writes after which the master-admin screens should not wait a whole
+# interval to reflect them.
+PLATFORM_WRITE_PREFIXES = ("master-admin/companies/", "payment/")
+JS_INT = re.compile(r"\s*([+-]?\d+)")
+# Searches the snapshot can answer exactly as Node's case-insensitive
+# $regex would: no regex metacharacters, ASCII only.
+LITERAL_SEARCH = re.compile(r"[A-Za-z0-9 @_-]*")
+COMPANY_QUERY_PARAMS = ("page", "limit", "search", "status")
+
+COMPANY_FIELDS = (
+    "companyName", "companyEmail", "companyContactNumber", "createdAt", "isActive", "owners", "employees", "subscription",
+)
+SUBSCRIPTION_FIELDS = (
+    "company", "status", "planType", "currentUserCount", "basePrice", "perUserPrice", "basePlanUserLimit",
+    "trialStartDate", "trialEndDate", "currentPeriodEnd", "isManuallyRestricted", "updatedAt",
+)
+PAYMENT_FIELDS = ("company", "amount", "status", "createdAt", "invoiceNumber")
+DATE_FIELDS = ("createdAt", "updatedAt", "trialStartDate", "trialEndDate", "currentPeriodEnd")
+NUMERIC_FIELDS = ("amount", "currentUserCount", "basePrice", "perUserPrice", "basePlanUserLimit")
+
+snapshot_state = {"task": None, "snapshot": None, "companies": None, "built": 0.0, "errors": 0, "refresh": None}
+snapshot_stats = {"builds": 0, "served": 0, "fallbacks": 0, "last_build_ms": None}
+
+def js_number(value):
+    # JSON.stringify prints whole numbers without a fraction.
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+def to_fixed(value: float, digits=1):
+    # parseFloat(x.toFixed(1)): ties round up, where round() rounds to even.
+    return js_number(Decimal(value).quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP))
+
+def js_parse_int(value, default: int):
+    # parseInt(value) || default, as the controllers read page and limit.
+    match = JS_INT.match(value or "")
+    return int(match.group(1)) or default if match else default
+
+def iso(value):
+    return None if pd.isna(value) else jsonable(value.to_pydatetime())
+
+def frame(docs, fields):
+    df = pd.DataFrame.from_records(docs, columns=["_id", *fields])
+    for field in DATE_FIELDS:
+        if field in df:
+            df[field] = pd.to_datetime(df[field], utc=True)
+    # An empty collection would otherwise leave these as object columns,
+    # which sum() and nlargest() refuse.
+    for field in NUMERIC_FIELDS:
+        if field in df:
+            df[field] = pd.to_numeric(df[field], errors="coerce").astype(float)
+    return df
+
+def subscription_amounts(subscriptions):
+    # Subscription.calculateAmount() for every row at once; missing fields
+    # take the schema defaults, as mongoose fills them in on load.
+    users = subscriptions["currentUserCount"].fillna(1).to_numpy(dtype=float)
+    limit = subscriptions["basePlanUserLimit"].fillna(5).to_numpy(dtype=float)
+    base = subscriptions["basePrice"].fillna(249).to_numpy(dtype=float)
+    per_user = subscriptions["perUserPrice"].fillna(50).to_numpy(dtype=float)
+    return np.where(users <= limit, base, base + (users - limit) * per_user)
+
+def subscription_summary(sub):
+    return {
+        "id": str(sub["_id"]),
+        "status": sub["status"],
+        "planType": sub["planType"],
+        "currentUserCount": js_number(sub["currentUserCount"]) if pd.notna(sub["currentUserCount"]) else 1,
+        "totalAmount": js_number(sub["totalAmount"]),
+        "trialEndDate": iso(sub["trialEndDate"]),
+        "currentPeriodEnd": iso(sub["currentPeriodEnd"]),
+        "isManuallyRestricted": bool(sub["isManuallyRestricted"]),
+    }
+
+def company_listing(companies, subs_by_id, owners):
+    """One prebuilt getCompanies() entry per active company, newest first."""
+    records = []
+    for company in companies.to_dict("records"):
+        sub = subs_by_id.get(company["subscription"]) if isinstance(company["subscription"], ObjectId) else None
+        owner_ids = company["owners"] if isinstance(company["owners"], list) else []
+        records.append({
+            "id": str(company["_id"]),
+            "companyName": company["companyName"],
+            "companyEmail": company["companyEmail"],
+            "contactNumber": company["companyContactNumber"],
+            "createdAt": iso(company["createdAt"]),
+            "owners": [owners[owner] for owner in owner_ids if owner in owners],
+            "employeeCount": len(company["employees"]) if isinstance(company["employees"], list) else 0,
+            "subscription": subscription_summary(sub) if sub is not None else None,
+        })
+    return pd.DataFrame({
+        "companyName": companies["companyName"].fillna("").astype(str).to_numpy(),
+        "companyEmail": companies["companyEmail"].fillna("").astype(str).to_numpy(),
+        "status": [record["subscription"]["status"] if record["subscription"] else None for record in records],
+        "record": records,
+    })
+
+def build_snapshot(companies, subscriptions, payments, owners, total_users: int, now: datetime, mrr_history=None):
+    """Everything the master-admin dashboard, revenue chart and company list
+    show, computed from whole-table frames in one pass."""
+    now = pd.Timestamp(now).tz_convert("UTC")
+    month_start = pd.Timestamp(now.year, now.month, 1, tz="UTC")
+    thirty_days_ago = now - timedelta(days=30)
+
+    names = dict(zip(companies["_id"], companies["companyName"]))
+    # Same filter as { isActive: true }: a missing flag does not match.
+    active = companies["isActive"].map(lambda value: isinstance(value, (bool, np.bool_)) and bool(value))
+    companies = companies[active.astype(bool)].sort_values("createdAt", ascending=False, kind="stable")
+    subscriptions = subscriptions.fillna({"status": "trial", "planType": "free_trial", "isManuallyRestricted": False})
+    subscriptions = subscriptions.assign(totalAmount=subscription_amounts(subscriptions))
+    subs_by_id = {sub["_id"]: sub for sub in subscriptions.to_dict("records")}
+    status = subscriptions["status"]
+
+    counts = dict.fromkeys(SUBSCRIPTION_STATUSES, 0)
+    counts.update({str(key): int(count) for key, count in status.value_counts().items()})
+    mrr = js_number(subscriptions.loc[status == "active", "totalAmount"].sum())
+
+    success = payments[payments["status"] == "success"].sort_values("createdAt", ascending=False)
+    failed = (payments["status"] == "failed") & (payments["createdAt"] >= thirty_days_ago)
+    trials = subscriptions["trialStartDate"].notna()
+    converted = trials & (subscriptions["planType"] == "paid")
+    cancelled_recently = int(((status == "cancelled") & (subscriptions["updatedAt"] >= thirty_days_ago)).sum())
+
+    monthly = success.groupby(success["createdAt"].dt.strftime("%Y-%m"))["amount"].agg(["sum", "count"]).sort_index()
+    revenue_by_month = [
+        {"month": month, "revenue": js_number(row["sum"]), "transactions": int(row["count"])}
+        for month, row in monthly.tail(PLATFORM_REVENUE_MONTHS).iterrows()
+    ]
+
+    # MRR is only known as of now; each snapshot records the current
+    # month's value so the history builds up over time.
+    mrr_history = dict(mrr_history or {})
+    mrr_history[now.strftime("%Y-%m")] = mrr
+    mrr_by_month = [{"month": month, "mrr": mrr_history[month]} for month in sorted(mrr_history)[-PLATFORM_REVENUE_MONTHS:]]
+
+    trailing = success[success["createdAt"] >= now - timedelta(days=365)]
+    top = trailing.groupby("company")["amount"].sum().nlargest(PLATFORM_TOP_TENANTS)
+    subs_by_company = {sub["company"]: sub for sub in subs_by_id.values()}
+    top_tenants = []
+    for company, revenue in top.items():
+        sub = subs_by_company.get(company)
+        top_tenants.append({
+            "company": str(company),
+            "companyName": names.get(company),
+            "revenue12m": js_number(revenue),
+            "status": sub["status"] if sub else None,
+            "users": js_number(sub["currentUserCount"]) if sub and pd.notna(sub["currentUserCount"]) else None,
+            "mrr": js_number(sub["totalAmount"]) if sub and sub["status"] == "active" else 0,
+        })
+
+    window_end = now + timedelta(days=PLATFORM_TRIAL_WINDOW_DAYS)
+    expiring = subscriptions[(status == "trial") & subscriptions["trialEndDate"].between(now, window_end)]
+    trial_expirations = [
+        {
+            "company": str(sub["company"]),
+            "companyName": names.get(sub["company"]),
+            "trialEndDate": iso(sub["trialEndDate"]),
+            "daysLeft": math.ceil((sub["trialEndDate"] - now) / timedelta(days=1)),
+        }
+        for sub in expiring.sort_values("trialEndDate").to_dict("records")
+    ]
+
+    recent_signups = []
+    for company in companies.head(5).to_dict("records"):
+        sub = subs_by_id.get(company["subscription"]) if isinstance(company["subscription"], ObjectId) else None
+        recent_signups.append({
+            "_id": str(company["_id"]),
+            "companyName": company["companyName"],
+            "companyEmail": company["companyEmail"],
+            "createdAt": iso(company["createdAt"]),
+            "subscription": {"_id": str(sub["_id"]), "status": sub["status"], "planType": sub["planType"]} if sub else None,
+        })
+    recent_payments = []
+    for payment in success.head(5).to_dict("records"):
+        # Keys Express would drop as undefined are left out.
+        entry = {"id": str(payment["_id"])}
+        if payment["company"] in names:
+            entry["company"] = names[payment["company"]]
+        entry.update(amount=js_number(payment["amount"]), date=iso(payment["createdAt"]))
+        if isinstance(payment["invoiceNumber"], str):
+            entry["invoiceNumber"] = payment["invoiceNumber"]
+        recent_payments.append(entry)
+
+    stats = {
+        "totalCompanies": len(companies),
+        "totalUsers": total_users,
+        "subscriptions": counts,
+        "mrr": mrr,
+        "revenueThisMonth": js_number(success.loc[success["createdAt"] >= month_start, "amount"].sum()),
+        "failedPayments": int(failed.sum()),
+        "conversionRate": to_fixed(converted.sum() / trials.sum() * 100) if trials.sum() else 0,
+        "churnRate": to_fixed(cancelled_recently / (counts["active"] + cancelled_recently) * 100) if counts["active"] > 0 else 0,
+        "recentSignups": recent_signups,
+        "recentPayments": recent_payments,
+        "mrrByMonth": mrr_by_month,
+        "topTenants": top_tenants,
+        "trialExpirations": trial_expirations,
+    }
+    snapshot = {"builtAt": jsonable(now.to_pydatetime()), "stats": stats, "revenueByMonth": revenue_by_month}
+    return snapshot, company_listing(companies, subs_by_id, owners)
+
+async def load_frames():
+    db = database()
+    companies = frame([doc async for doc in db["companies"].find({}, dict.fromkeys(COMPANY_FIELDS, 1))], COMPANY_FIELDS)
+    subscriptions = frame(
+        [doc async for doc in db["subscriptions"].find({}, dict.fromkeys(SUBSCRIPTION_FIELDS, 1))], SUBSCRIPTION_FIELDS
+    )
+    payments = frame([doc async for doc in db["payments"].find({}, dict.fromkeys(PAYMENT_FIELDS, 1))], PAYMENT_FIELDS)
+    owner_ids = list({owner for owners in companies["owners"] if isinstance(owners, list) for owner in owners})
+    owners = {
+        doc["_id"]: jsonable(doc)
+        async for doc in db["users"].find({"_id": {"$in": owner_ids}}, {"firstName": 1, "lastName": 1, "email": 1})
+    }
+    total_users = await db["users"].count_documents({"role": {"$ne": "master-admin"}})
+    return companies, subscriptions, payments, owners, total_users
+
+async def refresh_snapshot():
+    started = time.perf_counter()
+    frames = await load_frames()
+    previous = snapshot_state["snapshot"] or {}
+    history = {entry["month"]: entry["mrr"] for entry in previous.get("stats", {}).get("mrrByMonth", [])}
+    # The pandas pass runs off the event loop so proxied requests don't
+    # stall behind it.
+    snapshot, listing = await asyncio.to_thread(build_snapshot, *frames, datetime.now(timezone.utc), history)
+    await database()["platform_snapshots"].replace_one({"_id": "latest"}, snapshot, upsert=True)
+    snapshot_state.update(snapshot=snapshot, companies=listing, built=time.time())
+    snapshot_stats["builds"] += 1
+    snapshot_stats["last_build_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+async def adopt_stored_snapshot():
+    # A snapshot left by the previous process can answer the dashboard
+    # until the first build finishes; the company list needs a fresh one.
+    stored = await database()["platform_snapshots"].find_one({"_id": "latest"})
+    if stored and snapshot_state["snapshot"] is None:
+        built = datetime.fromisoformat(stored["builtAt"].replace("Z", "+00:00")).timestamp()
+        stored.pop("_id")
+        snapshot_state.update(snapshot=stored, built=built)
+
+async def run_platform_snapshots():
+    try:
+        await adopt_stored_snapshot()
+    except Exception as exc:
+        print(f"Platform snapshot load failed: {exc!r}")
+    while True:
+        try:
+            await refresh_snapshot()
+        except Exception as exc:
+            # Any failure waits for the next interval like a database error;
+            # a dead task would be restarted by every master-admin request.
+            snapshot_state["errors"] += 1
+            print(f"Platform snapshot build failed: {exc!r}")
+        refresh = snapshot_state["refresh"]
+        await asyncio.sleep(PLATFORM_SNAPSHOT_MIN_GAP)
+        try:
+            await asyncio.wait_for(refresh.wait(), max(PLATFORM_SNAPSHOT_INTERVAL - PLATFORM_SNAPSHOT_MIN_GAP, 0))
+        except asyncio.TimeoutError:
+            pass
+        refresh.clear()
+
+def ensure_platform_snapshots():
+    if snapshot_state["task"] is None or snapshot_state["task"].done():
+        snapshot_state["refresh"] = asyncio.Event()
+        snapshot_state["task"] = asyncio.create_task(run_platform_snapshots())
+
+async def stop_platform_snapshots():
+    task = snapshot_state["task"]
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    snapshot_state.update(task=None, snapshot=None, companies=None, built=0.0)
+
+def note_platform_write(path: str):
+    if snapshot_state["refresh"] is not None and path.startswith(PLATFORM_WRITE_PREFIXES):
+        snapshot_state["refresh"].set()
+
+async def master_admin_active(admin_id: str):
+    # masterAdminAuth also rejects deactivated admins, not just bad tokens.
+    return await database()["masteradmins"].find_one({"_id": ObjectId(admin_id), "isActive": True}, {"_id": 1}) is not None
+
+def snapshot_age():
+    return time.time() - snapshot_state["built"]
+
+def current_snapshot():
+    if snapshot_state["snapshot"] is None or snapshot_age() > PLATFORM_SNAPSHOT_MAX_AGE:
+        return None
+    return snapshot_state["snapshot"]
+
+def dashboard_payload(query):
+    snapshot = current_snapshot()
+    if snapshot is None:
+        return None
+    return {"success": True, "stats": snapshot["stats"], "snapshotAt": snapshot["builtAt"]}
+
+def revenue_payload(query):
+    snapshot = current_snapshot()
+    months = js_parse_int(query.get("months"), 12)
+    if snapshot is None or months > PLATFORM_REVENUE_MONTHS:
+        return None
+    now = datetime.now(timezone.utc)
+    start = now.year * 12 + now.month - months
+    first = f"{start // 12:04d}-{start % 12 + 1:02d}" if start >= 0 else ""
+    analytics = [entry for entry in snapshot["revenueByMonth"] if entry["month"] >= first]
+    return {"success": True, "analytics": analytics, "snapshotAt": snapshot["builtAt"]}
+
+def companies_payload(query):
+    # getCompanies() pages the search results first and only then drops
+    # companies whose subscription has another status, so a page can come
+    # back short and the total ignores the status. Searches other than
+    # plain text, and repeated or nested parameters, are left to Node.
+    snapshot, listing = current_snapshot(), snapshot_state["companies"]
+    items = query.multi_items() if hasattr(query, "multi_items") else list(query.items())
+    keys = [key for key, _ in items]
+    if any(keys.count(name) > 1 for name in COMPANY_QUERY_PARAMS) or any("[" in key for key in keys):
+        return None
+    page, limit = js_parse_int(query.get("page"), 0), js_parse_int(query.get("limit"), 20)
+    search, status = query.get("search"), query.get("status")
+    if snapshot is None or listing is None or page < 0 or limit < 0:
+        return None
+    if search:
+        if not LITERAL_SEARCH.fullmatch(search):
+            return None
+        listing = listing[
+            listing["companyName"].str.contains(search, case=False, regex=False)
+            | listing["companyEmail"].str.contains(search, case=False, regex=False)
+        ]
+    total = len(listing)
+    listing = listing.iloc[page * limit:page * limit + limit]
+    if status:
+        listing = listing[listing["status"] == status]
+    return {
+        "success": True,
+        "companies": list(listing["record"]),
+        "pagination": {"total": total, "page": page, "limit": limit, "totalPages": math.ceil(total / limit)},
+        "snapshotAt": snapshot["builtAt"],
+    }
+
+def platform_snapshot_summary():
+    return {
+        **snapshot_stats,
+        "enabled": PLATFORM_SNAPSHOT_ENABLED,
+        "running": snapshot_state["task"] is not None and not snapshot_state["task"].done(),
+        "age_seconds": round(snapshot_age(), 1) if snapshot_state["snapshot"] else None,
+        "companies": len(snapshot_state["companies"]) if snapshot_state["companies"] is not None else None,
+        "errors": snapshot_state["errors"],
+    }
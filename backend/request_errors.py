@@ -0,0 +1,7 @@
+class RequestError(Exception):
+    # Raised by the proxy's own handlers for a request they refuse; server.py
+    # turns it into the same {"detail": ...} body as an HTTPException.
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
@@ -0,0 +1,68 @@
+import base64
+import hashlib
+import json
+import os
+
+import jwt
+
+# Node signs tokens with these secrets from its .env; the proxy can only
+# verify them when the secret is also in its own environment.
+JWT_SECRET = os.environ.get("JWT_SECRET", "")
+MASTER_ADMIN_JWT_SECRET = os.environ.get("MASTER_ADMIN_JWT_SECRET", "")
+
+# Claims are read without verifying the signature where they only group
+# requests (cache invalidation). Rate-limit buckets use verified_tenant().
+# Anything that must not leak across users is keyed on auth_subject(), a
+# hash of the whole token.
+
+def bearer_token(headers):
+    auth = headers.get("authorization", "")
+    scheme, _, token = auth.partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else ""
+
+def auth_subject(headers):
+    token = bearer_token(headers)
+    if not token:
+        return "anonymous"
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+def token_claims(headers):
+    token = bearer_token(headers)
+    parts = token.split(".")
+    if len(parts) != 3:
+        return {}
+    payload = parts[1] + "=" * (-len(parts[1]) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except ValueError:
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+def verified_claims(headers, master_admin=False):
+    # Same check as Node's authMiddleware (jsonwebtoken defaults to HS256
+    # and rejects expired tokens), for routes the proxy answers itself.
+    secret = MASTER_ADMIN_JWT_SECRET if master_admin else JWT_SECRET
+    token = bearer_token(headers)
+    if not secret or not token:
+        return None
+    try:
+        claims = jwt.decode(token, secret, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+    return claims if isinstance(claims, dict) else None
+
+def claims_tenant(claims):
+    if claims.get("company"):
+        return f"company:{claims['company']}"
+    if claims.get("id"):
+        return f"user:{claims['id']}"
+    return "anonymous"
+
+def tenant_of(headers):
+    return claims_tenant(token_claims(headers))
+
+def verified_tenant(headers):
+    # For limits a forged token must not be able to charge to someone else;
+    # None when neither secret can vouch for the token.
+    claims = verified_claims(headers) or verified_claims(headers, master_admin=True)
+    return claims_tenant(claims) if claims else None
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+from starlette.datastructures import MutableHeaders
+
+from route_labels import route_template
+
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_SECONDS", "1"))
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+PHASES = ("queue", "connect", "ttfb", "body")
+
+slow_logger = logging.getLogger("foratask.slow_requests")
+
+def request_id_from(raw_headers):
+    # Keep a caller's id (a load balancer or the frontend may have logged
+    # it already) as long as it is safe to echo into headers and logs.
+    for name, value in raw_headers:
+        if name == b"x-request-id":
+            candidate = value.decode("latin-1")
+            if REQUEST_ID_PATTERN.fullmatch(candidate):
+                return candidate
+            break
+    return uuid.uuid4().hex
+
+def add_phase(timings: dict, phase: str, seconds: float):
+    timings[phase] = timings.get(phase, 0.0) + seconds
+
+def upstream_tracer(timings: dict):
+    # httpx trace hook: connect covers the pool wait plus any new TCP
+    # connection, ttfb runs from sending headers to Node's response headers,
+    # body until the last upstream byte has been read.
+    marks = {"start": time.perf_counter()}
+
+    async def trace(event: str, info):
+        now = time.perf_counter()
+        if event == "http11.send_request_headers.started":
+            add_phase(timings, "connect", now - marks["start"])
+            marks["sent"] = now
+        elif event == "http11.receive_response_headers.complete":
+            add_phase(timings, "ttfb", now - marks.get("sent", marks["start"]))
+            marks["headers"] = now
+        elif event == "http11.receive_response_body.complete":
+            add_phase(timings, "body", now - marks.get("headers", now))
+
+    return trace
+
+def server_timing(timings: dict, total: float):
+    entries = [f"{phase};dur={timings[phase] * 1000:.1f}" for phase in PHASES if phase in timings]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def log_slow_request(scope, request_id: str, status: int, timings: dict, total: float):
+    slow_logger.warning(json.dumps({
+        "event": "slow_request",
+        "request_id": request_id,
+        "method": scope["method"],
+        "route": route_template(scope["path"][5:]),
+        "status": status,
+        "total_ms": round(total * 1000, 1),
+        **{f"{phase}_ms": round(timings[phase] * 1000, 1) for phase in PHASES if phase in timings},
+    }))
+
+class RequestTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        state = scope.setdefault("state", {})
+        request_id = state["request_id"] = request_id_from(scope["headers"])
+        timings = state["timings"] = {}
+        status = 500
+        # Long-polls and event streams are slow by design.
+        long_lived = scope["path"].startswith("/api/socket.io")
+
+        async def send_wrapper(message):
+            nonlocal status, long_lived
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                long_lived = long_lived or headers.get("content-type", "").startswith("text/event-stream")
+                headers["x-request-id"] = request_id
+                headers.append("server-timing", server_timing(timings, time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            total = time.perf_counter() - started
+            if total >= SLOW_REQUEST_SECONDS and not long_lived:
+                log_slow_request(scope, request_id, status, timings, total)
@@ -0,0 +1,108 @@
+import collections
+import os
+import time
+from urllib.parse import parse_qsl, urlencode
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+# "prefix=seconds" pairs; the longest matching prefix of the proxied path wins.
+RESPONSE_CACHE_ROUTES = os.environ.get(
+    "RESPONSE_CACHE_ROUTES",
+    "stats/=30,reports/=60,me/usersList=60,me/userinfo=30",
+)
+# Mutations under these prefixes never touch cached tenant data.
+NON_INVALIDATING_PREFIXES = ("auth/", "socket.io")
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+def parse_route_ttls(spec: str):
+    ttls = {}
+    for item in spec.split(","):
+        prefix, _, seconds = item.strip().partition("=")
+        if prefix and seconds:
+            ttls[prefix.lstrip("/")] = float(seconds)
+    return ttls
+
+route_ttls = parse_route_ttls(RESPONSE_CACHE_ROUTES)
+entries = collections.OrderedDict()
+tenant_keys = collections.defaultdict(set)
+cache_stats_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+cache_bytes = 0
+
+def cache_ttl_for(path: str):
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    matches = [prefix for prefix in route_ttls if path.startswith(prefix)]
+    return route_ttls[max(matches, key=len)] if matches else None
+
+def normalize_query(query: str):
+    return urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+def cache_key(path: str, query: str, subject: str):
+    return (path, normalize_query(query), subject)
+
+def drop_entry(key):
+    global cache_bytes
+    entry = entries.pop(key, None)
+    if entry:
+        cache_bytes -= entry["size"]
+        keys = tenant_keys.get(entry["tenant"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                tenant_keys.pop(entry["tenant"], None)
+
+def cache_get(key):
+    entry = entries.get(key)
+    if entry is None:
+        cache_stats_counters["misses"] += 1
+        return None
+    if entry["expires"] <= time.monotonic():
+        drop_entry(key)
+        cache_stats_counters["expired"] += 1
+        cache_stats_counters["misses"] += 1
+        return None
+    entries.move_to_end(key)
+    cache_stats_counters["hits"] += 1
+    return entry
+
+def cache_put(key, tenant, ttl, status_code, headers, body: bytes):
+    global cache_bytes
+    size = len(body) + sum(len(k) + len(v) for k, v in headers.items())
+    if size > RESPONSE_CACHE_MAX_ENTRY_BYTES:
+        return
+    drop_entry(key)
+    entries[key] = {
+        "tenant": tenant,
+        "expires": time.monotonic() + ttl,
+        "status_code": status_code,
+        "headers": headers,
+        "body": body,
+        "size": size,
+    }
+    tenant_keys[tenant].add(key)
+    cache_bytes += size
+    cache_stats_counters["stores"] += 1
+    while cache_bytes > RESPONSE_CACHE_MAX_BYTES and entries:
+        drop_entry(next(iter(entries)))
+        cache_stats_counters["evictions"] += 1
+
+def invalidates_cache(method: str, path: str):
+    return method in MUTATING_METHODS and not path.startswith(NON_INVALIDATING_PREFIXES)
+
+def invalidate_tenant(tenant):
+    keys = list(tenant_keys.get(tenant, ()))
+    for key in keys:
+        drop_entry(key)
+    if keys:
+        cache_stats_counters["invalidations"] += 1
+
+def cache_stats():
+    return {
+        **cache_stats_counters,
+        "enabled": RESPONSE_CACHE_ENABLED,
+        "entries": len(entries),
+        "bytes": cache_bytes,
+        "max_bytes": RESPONSE_CACHE_MAX_BYTES,
+        "routes": route_ttls,
+    }
@@ -0,0 +1,20 @@
+import re
+
+# Collapse per-record path segments so labels stay low-cardinality:
+# task/getTask/65f0c1e2a9b8c7d6e5f4a3b2 -> task/getTask/:id
+OBJECT_ID = re.compile(r"^[0-9a-fA-F]{24}$")
+UUID = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+NUMBER = re.compile(r"^\d+$")
+
+def route_template(path: str):
+    segments = [s for s in path.strip("/").split("/") if s]
+    if not segments:
+        return "/"
+    if segments[0] == "uploads":
+        return "uploads/:file"
+    if segments[0] == "socket.io":
+        return "socket.io"
+    return "/".join(
+        ":id" if OBJECT_ID.match(s) or UUID.match(s) or NUMBER.match(s) else s
+        for s in segments
+    )
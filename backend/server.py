@@ -1,69 +1,1161 @@
-import subprocess
 import os
 import signal
 import asyncio
+import functools
+import hmac
+import itertools
+import json
+import re
+import time
 import httpx
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse, Response
+import websockets
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from websockets.asyncio.client import connect as websocket_connect, unix_connect as websocket_unix_connect
+from typing import Optional
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
 from contextlib import asynccontextmanager
+from admission import AdmissionRejected, admission_enabled, admission_slot, admission_stats, busiest_tenants, route_class
+from batch import BATCH_MAX_BODY_BYTES, batch_result, parse_batch, run_batch
+from compression import compress_for, compression_candidate, compression_summary
+from exports import EXPORT_COLUMNS, EXPORT_MEDIA_TYPES, EXPORTS_ENABLED, export_filename, export_query, export_stream, export_summary
+from geofence import GEOFENCE_ENABLED, check_batch_payload, check_payload, geofence_summary, note_geofence_write
+from http_validators import compute_etag, etag_eligible, etag_matches, not_modified_response, variant_etag
+from metrics import MetricsMiddleware, render_metrics
+from mongo import MONGO_URI, close_database
+from node_logs import log_buffer_stats, pump_node_output, query_logs, start_log_file, stop_log_file
+from notification_stream import NOTIFY_TICKET_TTL, ensure_notification_feed, issue_stream_ticket, notification_events, notification_stream_stats, redeem_stream_ticket, stop_notification_feed, stream_slots_left, ticket_slots_left
+from payroll import parse_period, payroll_summary, run_payroll
+from platform_snapshot import PLATFORM_SNAPSHOT_ENABLED, companies_payload, dashboard_payload, ensure_platform_snapshots, master_admin_active, note_platform_write, platform_snapshot_summary, revenue_payload, snapshot_age, snapshot_stats, stop_platform_snapshots
+from request_errors import RequestError
+from request_timing import RequestTimingMiddleware, add_phase, upstream_tracer
+from request_identity import JWT_SECRET, auth_subject, bearer_token, tenant_of, token_claims, verified_claims, verified_tenant
+from response_cache import cache_get, cache_key, cache_put, cache_stats, cache_ttl_for, invalidate_tenant, invalidates_cache
+from route_labels import route_template
+from single_flight import single_flight, single_flight_enabled_for, single_flight_stats
+from task_stats import TASK_STATS_ENABLED, ensure_task_stats_feed, note_task_write, rollup_stats, rollups_ready, statistics_graph, stop_task_stats_feed, task_stats_summary, tasks_summary
+from traffic_capture import TrafficCaptureMiddleware, capture_summary, start_capture, stop_capture
+from uploads import UPLOADS_SERVE_LOCAL, serve_upload
 
 NODE_BACKEND_PORT = 3333
 NODE_BACKEND_URL = f"http://127.0.0.1:{NODE_BACKEND_PORT}"
-node_process = None
+# One worker unless asked: socket.io has no cross-process adapter here and
+# global.connectedUsers is per process, so an HTTP-triggered emit (chat,
+# task assignment, discussions) misses sockets held by any other worker.
+NODE_WORKERS = max(1, int(os.environ.get("NODE_WORKERS", "1")))
+# "uds" has each worker listen on a Unix socket instead of a loopback port:
+# no ephemeral ports, no TIME_WAIT, and a shorter path through the kernel.
+NODE_TRANSPORT = os.environ.get("NODE_TRANSPORT", "tcp")
+NODE_SOCKET_DIR = os.environ.get("NODE_SOCKET_DIR", "/tmp/foratask-node")
+NODE_HEALTH_INTERVAL = float(os.environ.get("NODE_HEALTH_INTERVAL", "5"))
+NODE_HEALTH_TIMEOUT = float(os.environ.get("NODE_HEALTH_TIMEOUT", "2"))
+NODE_DEV_RELOAD = os.environ.get("NODE_DEV_RELOAD", "0") == "1"
+NODE_STARTUP_TIMEOUT = float(os.environ.get("NODE_STARTUP_TIMEOUT", "30"))
+NODE_STARTUP_POLL_INTERVAL = float(os.environ.get("NODE_STARTUP_POLL_INTERVAL", "0.1"))
+NODE_RESTART_BACKOFF_MIN = float(os.environ.get("NODE_RESTART_BACKOFF_MIN", "0.5"))
+NODE_RESTART_BACKOFF_MAX = float(os.environ.get("NODE_RESTART_BACKOFF_MAX", "30"))
+NODE_STABLE_AFTER = float(os.environ.get("NODE_STABLE_AFTER", "60"))
+NODE_STOP_TIMEOUT = float(os.environ.get("NODE_STOP_TIMEOUT", "10"))
+SOCKET_SESSION_TTL = float(os.environ.get("SOCKET_SESSION_TTL", "120"))
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "60"))
+UPSTREAM_WRITE_TIMEOUT = float(os.environ.get("UPSTREAM_WRITE_TIMEOUT", "60"))
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get("UPSTREAM_POOL_TIMEOUT", "10"))
+PROXY_STREAMING = os.environ.get("PROXY_STREAMING", "1") == "1"
+PROXY_MAX_BODY_BYTES = int(os.environ.get("PROXY_MAX_BODY_BYTES", str(25 * 1024 * 1024)))
+LONGPOLL_MAX_CONCURRENCY = int(os.environ.get("LONGPOLL_MAX_CONCURRENCY", "1000"))
+LONGPOLL_MAX_KEEPALIVE = int(os.environ.get("LONGPOLL_MAX_KEEPALIVE", "100"))
+LONGPOLL_READ_TIMEOUT = float(os.environ.get("LONGPOLL_READ_TIMEOUT", "40"))
+LONGPOLL_QUEUE_TIMEOUT = float(os.environ.get("LONGPOLL_QUEUE_TIMEOUT", "2"))
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", "90"))
+WS_PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.environ.get("WS_PING_TIMEOUT", "20"))
+WS_MAX_QUEUE = int(os.environ.get("WS_MAX_QUEUE", "32"))
+WS_MAX_MESSAGE_BYTES = int(os.environ.get("WS_MAX_MESSAGE_BYTES", str(1024 * 1024)))
+WS_FORWARDED_HEADERS = {"authorization", "cookie", "user-agent", "x-forwarded-for"}
+PROXY_ADMIN_TOKEN = os.environ.get("PROXY_ADMIN_TOKEN", "")
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade",
+}
+CONDITIONAL_HEADERS = {"if-none-match", "if-modified-since", "if-match", "if-unmodified-since", "if-range"}
+node_workers = [
+    {
+        "id": i,
+        # Under uds the host is only a routing key for the client's mounts.
+        "url": f"http://node-{i}" if NODE_TRANSPORT == "uds" else f"http://127.0.0.1:{NODE_BACKEND_PORT + i}",
+        "socket": os.path.join(NODE_SOCKET_DIR, f"worker-{i}.sock") if NODE_TRANSPORT == "uds" else None,
+        "process": None,
+        "supervisor": None,
+        "log_pump": None,
+        "state": "stopped",
+        "restarts": 0,
+        "last_exit_code": None,
+        "healthy": False,
+        "outstanding": 0,
+        "served": 0,
+        "failures": 0,
+    }
+    for i in range(NODE_WORKERS)
+]
+socket_sessions = {}
+ENGINE_IO_SID = re.compile(rb'"sid":"([^"]+)"')
+node_ready = False
+upstream_client = None
+longpoll_client = None
+longpoll_slots = asyncio.Semaphore(LONGPOLL_MAX_CONCURRENCY)
+longpoll_stats = {"in_flight": 0, "served": 0, "rejected": 0}
+ws_connection_ids = itertools.count(1)
+ws_connections = {}
+ws_totals = {"opened": 0, "closed": 0, "upstream_failures": 0}
 
-def start_node_backend():
-    global node_process
+def node_command():
+    if NODE_DEV_RELOAD:
+        return ["npx", "nodemon", "--watch", ".", "--ignore", "uploads/", "--ext", "js,json", "server.js"]
+    return ["node", "server.js"]
+
+def remove_stale_socket(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+async def spawn_node_worker(worker):
+    port = NODE_BACKEND_PORT + worker["id"]
     env = os.environ.copy()
-    env["PORT"] = str(NODE_BACKEND_PORT)
-    node_process = subprocess.Popen(
-        ["npx", "nodemon", "--watch", ".", "--ext", "js,json", "server.js"],
+    # Node's listen() treats a non-numeric PORT as a socket path.
+    env["PORT"] = worker["socket"] or str(port)
+    if worker["socket"]:
+        os.makedirs(NODE_SOCKET_DIR, exist_ok=True)
+        remove_stale_socket(worker["socket"])
+    # server.js schedules the cron jobs; only one worker may run them.
+    env["CRON_ENABLED"] = "true" if worker["id"] == 0 else "false"
+    process = await asyncio.create_subprocess_exec(
+        *node_command(),
         cwd="/app/foratask-backend",
         env=env,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True,
     )
-    print(f"Node.js backend started on port {NODE_BACKEND_PORT} (PID: {node_process.pid})")
+    worker["log_pump"] = asyncio.create_task(pump_node_output(process.stdout, worker["id"], process.pid))
+    print(f"Node.js worker {worker['id']} started on {worker['socket'] or f'port {port}'} (PID: {process.pid})")
+    return process
+
+async def supervise_node_worker(worker):
+    backoff = NODE_RESTART_BACKOFF_MIN
+    while True:
+        started = time.monotonic()
+        worker["state"] = "starting"
+        try:
+            worker["process"] = await spawn_node_worker(worker)
+        except OSError as exc:
+            # A missing node binary or checkout is retried like a crash, so
+            # the worker comes back once the host is fixed.
+            worker["healthy"] = False
+            worker["state"] = "backoff"
+            print(f"Node.js worker {worker['id']} failed to start ({exc}), retrying in {backoff:.1f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, NODE_RESTART_BACKOFF_MAX)
+            continue
+        worker["last_exit_code"] = await worker["process"].wait()
+        worker["healthy"] = False
+        worker["restarts"] += 1
+        if time.monotonic() - started >= NODE_STABLE_AFTER:
+            backoff = NODE_RESTART_BACKOFF_MIN
+        worker["state"] = "backoff"
+        print(f"Node.js worker {worker['id']} exited with {worker['last_exit_code']}, restarting in {backoff:.1f}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, NODE_RESTART_BACKOFF_MAX)
+
+async def terminate_node_process(process):
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), NODE_STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+    except ProcessLookupError:
+        pass
+
+async def start_node_backend():
+    start_log_file()
+    for worker in node_workers:
+        worker["supervisor"] = asyncio.create_task(supervise_node_worker(worker))
+
+async def stop_node_backend():
+    supervisors = [w["supervisor"] for w in node_workers if w["supervisor"]]
+    for task in supervisors:
+        task.cancel()
+    await asyncio.gather(*supervisors, return_exceptions=True)
+    await asyncio.gather(*(terminate_node_process(w["process"]) for w in node_workers if w["process"]))
+    pumps = [w["log_pump"] for w in node_workers if w["log_pump"]]
+    if pumps:
+        await asyncio.wait(pumps, timeout=1)
+    for task in pumps:
+        task.cancel()
+    for worker in node_workers:
+        worker.update(supervisor=None, process=None, log_pump=None, state="stopped", healthy=False)
+        if worker["socket"]:
+            remove_stale_socket(worker["socket"])
+    stop_log_file()
+
+async def wait_for_node_ready():
+    # Gate startup on real answers from every worker rather than a fixed
+    # sleep: quick boots are served immediately, slow ones get no 502s.
+    deadline = time.monotonic() + NODE_STARTUP_TIMEOUT
+    while True:
+        await asyncio.gather(*(probe_node_worker(w) for w in node_workers))
+        if all(w["healthy"] for w in node_workers):
+            return True
+        if time.monotonic() >= deadline:
+            print(f"Node.js workers not ready after {NODE_STARTUP_TIMEOUT:.0f}s; serving with what is up")
+            return False
+        await asyncio.sleep(NODE_STARTUP_POLL_INTERVAL)
 
-def stop_node_backend():
-    global node_process
-    if node_process:
-        os.killpg(os.getpgid(node_process.pid), signal.SIGTERM)
-        node_process = None
+def pick_node_worker(sid=None):
+    # Engine.IO sessions only exist in the worker that created them, so a
+    # known sid always goes back there; everything else goes to the healthy
+    # worker with the fewest requests in flight.
+    session = socket_sessions.get(sid) if sid else None
+    if session:
+        session["seen"] = time.monotonic()
+        return node_workers[session["worker"]]
+    candidates = [w for w in node_workers if w["healthy"]] or node_workers
+    return min(candidates, key=lambda w: (w["outstanding"], w["served"]))
+
+def release_node_worker(worker):
+    worker["outstanding"] -= 1
+    worker["served"] += 1
+
+def remember_socket_session(body: bytes, worker):
+    match = ENGINE_IO_SID.search(body[:512])
+    if match:
+        socket_sessions[match.group(1).decode()] = {"worker": worker["id"], "seen": time.monotonic()}
+
+def expire_socket_sessions():
+    cutoff = time.monotonic() - SOCKET_SESSION_TTL
+    for sid in [sid for sid, session in socket_sessions.items() if session["seen"] < cutoff]:
+        socket_sessions.pop(sid, None)
+
+async def probe_node_worker(worker):
+    # Any HTTP answer (the bare root returns 401) proves the event loop is
+    # serving; only transport failures take a worker out of rotation.
+    try:
+        await upstream_client.get(f"{worker['url']}/", timeout=NODE_HEALTH_TIMEOUT)
+    except httpx.TransportError:
+        if worker["healthy"]:
+            worker["failures"] += 1
+        worker["healthy"] = False
+    else:
+        worker["healthy"] = True
+        if worker["state"] == "starting":
+            worker["state"] = "running"
+
+async def node_health_loop():
+    while True:
+        await asyncio.gather(*(probe_node_worker(w) for w in node_workers))
+        expire_socket_sessions()
+        await asyncio.sleep(NODE_HEALTH_INTERVAL)
+
+def create_upstream_client(
+    max_connections=UPSTREAM_MAX_CONNECTIONS,
+    max_keepalive=UPSTREAM_MAX_KEEPALIVE,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+):
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=UPSTREAM_CONNECT_TIMEOUT,
+        read=read_timeout,
+        write=UPSTREAM_WRITE_TIMEOUT,
+        pool=UPSTREAM_POOL_TIMEOUT,
+    )
+    if NODE_TRANSPORT == "uds":
+        # One transport per worker socket; the limits apply per worker.
+        mounts = {w["url"]: httpx.AsyncHTTPTransport(uds=w["socket"], limits=limits) for w in node_workers}
+        return httpx.AsyncClient(base_url=node_workers[0]["url"], limits=limits, timeout=timeout, mounts=mounts)
+    return httpx.AsyncClient(base_url=NODE_BACKEND_URL, limits=limits, timeout=timeout)
+
+def upstream_pool_stats(client):
+    # httpx keeps its connection pool private; read it defensively so a
+    # library upgrade degrades /health instead of breaking it.
+    transports = [t for t in getattr(client, "_mounts", {}).values() if t] or [getattr(client, "_transport", None)]
+    pools = [getattr(t, "_pool", None) for t in transports]
+    pool = pools[0]
+    connections = [conn for p in pools for conn in getattr(p, "connections", [])]
+    requests = [req for p in pools for req in getattr(p, "_requests", [])]
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "queued": sum(1 for req in requests if req.is_queued()),
+        "max_connections": getattr(pool, "_max_connections", None),
+        "max_keepalive": getattr(pool, "_max_keepalive_connections", None),
+    }
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    start_node_backend()
-    await asyncio.sleep(2)
-    yield
-    stop_node_backend()
+    global upstream_client, longpoll_client, node_ready
+    upstream_client = create_upstream_client()
+    # Engine.IO polling GETs are held open for the whole ping interval, so
+    # they get their own pool and read timeout instead of pinning
+    # connections that interactive API calls need.
+    longpoll_client = create_upstream_client(
+        max_connections=LONGPOLL_MAX_CONCURRENCY,
+        max_keepalive=LONGPOLL_MAX_KEEPALIVE,
+        read_timeout=LONGPOLL_READ_TIMEOUT,
+    )
+    if admission_enabled() and not JWT_SECRET:
+        print("Admission control is on without JWT_SECRET: every caller is bucketed by client address, "
+              "which behind an ingress is one bucket for everyone unless uvicorn trusts its X-Forwarded-For")
+    start_capture()
+    await start_node_backend()
+    node_ready = await wait_for_node_ready()
+    health_task = asyncio.create_task(node_health_loop())
+    try:
+        yield
+    finally:
+        health_task.cancel()
+        await asyncio.gather(health_task, return_exceptions=True)
+        await stop_node_backend()
+        await upstream_client.aclose()
+        await longpoll_client.aclose()
+        await stop_notification_feed()
+        await stop_task_stats_feed()
+        await stop_platform_snapshots()
+        close_database()
+        stop_capture()
+        upstream_client = None
+        longpoll_client = None
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestTimingMiddleware)
+app.add_middleware(TrafficCaptureMiddleware)
 
-@app.api_route("/api/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE","OPTIONS","HEAD"])
-async def proxy(path: str, request: Request):
-    url = f"{NODE_BACKEND_URL}/{path}"
-    headers = dict(request.headers)
+class RequestBodyTooLarge(Exception):
+    pass
+
+@app.exception_handler(RequestError)
+async def request_error_response(request: Request, exc: RequestError):
+    return JSONResponse({"detail": exc.message}, status_code=exc.status_code)
+
+def require_proxy_admin(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if not PROXY_ADMIN_TOKEN or not hmac.compare_digest(token, PROXY_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Proxy admin token required")
+
+# Proxy-owned endpoints under /api must be registered before the catch-all.
+@app.get("/api/_proxy/logs", dependencies=[Depends(require_proxy_admin)])
+async def node_logs(worker: Optional[int] = None, level: Optional[str] = None, since: int = 0, limit: int = 200):
+    records = query_logs(worker=worker, level=level, since=since, limit=min(limit, 1000))
+    return {"records": records, "stats": log_buffer_stats()}
+
+@app.get("/api/_proxy/status", dependencies=[Depends(require_proxy_admin)])
+async def proxy_status():
+    # What /health leaves out: where the workers listen and which tenants
+    # are holding admission slots.
+    return {
+        "node_workers": [
+            {"id": w["id"], "url": w["url"], "socket": w["socket"], "pid": w["process"].pid if w["process"] else None}
+            for w in node_workers
+        ],
+        "admission_busiest": busiest_tenants(),
+    }
+
+@app.api_route("/api/uploads/{file_path:path}", methods=["GET", "HEAD"])
+async def uploaded_file(file_path: str, request: Request):
+    # Node writes uploads to a directory on this host; reading them here
+    # keeps attachment downloads off the Node event loop entirely.
+    if not UPLOADS_SERVE_LOCAL:
+        return await proxy(f"uploads/{file_path}", request)
+    return serve_upload(file_path, request.method, request.headers)
+
+# Sub-requests inherit the caller's headers (auth, client hints) but must
+# come back as plain identity 200s, and carry their own body framing.
+BATCH_EXCLUDED_HEADERS = HOP_BY_HOP_HEADERS | CONDITIONAL_HEADERS | {
+    "accept-encoding", "content-length", "content-type", "x-request-id",
+}
+
+def batch_sub_request(request: Request, item, raw_headers):
+    body = b"" if item["body"] is None else json.dumps(item["body"]).encode()
+    headers = list(raw_headers)
+    if body:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    parent_id = getattr(request.state, "request_id", None)
+    scope = {
+        **request.scope,
+        "method": item["method"],
+        "path": f"/api/{item['path']}",
+        "raw_path": f"/api/{item['path']}".encode(),
+        "query_string": item["query"].encode(),
+        "headers": headers,
+        "state": {"request_id": f"{parent_id}.{item['id']}"} if parent_id else {},
+    }
+
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        # After the body the client just stays connected; streamed handlers
+        # wait here for a disconnect that never comes.
+        if pending:
+            return pending.pop()
+        await asyncio.Event().wait()
+
+    return Request(scope, receive)
+
+async def dispatch_sub_request(sub: Request):
+    # Through the router rather than straight to proxy(), so an item reaches
+    # the same handler as the request it stands for: local uploads, stats
+    # rollups, platform snapshots, geofence checks and payroll included.
+    start, chunks = {}, []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app.router(sub.scope, sub.receive, send)
+    return start["status"], Headers(raw=start.get("headers", [])), b"".join(chunks)
+
+async def node_unread_count(auth):
+    # Node's authMiddleware is the only verifier of tokens the proxy has no
+    # secret for; a 200 here means Node accepted this one.
+    worker = pick_node_worker()
+    worker["outstanding"] += 1
+    try:
+        return await upstream_client.get(f"{worker['url']}/notifications/unreadCount", headers=auth)
+    except httpx.TransportError as exc:
+        mark_worker_failed(worker, exc)
+        raise
+    finally:
+        release_node_worker(worker)
+
+def relayed_error_response(resp: httpx.Response):
+    return Response(content=resp.content, status_code=resp.status_code, media_type=resp.headers.get("content-type"))
+
+def notification_user(claims):
+    user_id = str(claims.get("id", ""))
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=403, detail="Notification stream needs a user token")
+    return user_id
+
+@app.post("/api/notifications/stream-ticket")
+async def notification_stream_ticket(request: Request):
+    if not MONGO_URI:
+        raise HTTPException(status_code=503, detail="Notification stream is not configured")
+    token = bearer_token(request.headers)
+    if not token:
+        raise HTTPException(status_code=401, detail="No token provided")
+    # Checked before a ticket is stored, so tokens Node would refuse can't
+    # fill the ticket store.
+    if JWT_SECRET:
+        claims = verified_claims(request.headers)
+        if claims is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+    else:
+        try:
+            resp = await node_unread_count({"authorization": f"Bearer {token}"})
+        except httpx.TransportError as exc:
+            return upstream_error_response(exc)
+        if resp.status_code != 200:
+            return relayed_error_response(resp)
+        claims = token_claims(request.headers)
+    user_id = notification_user(claims)
+    if ticket_slots_left(user_id) <= 0:
+        raise HTTPException(status_code=429, detail="Too many pending stream tickets for this user")
+    ticket = issue_stream_ticket(token, user_id)
+    if ticket is None:
+        raise HTTPException(status_code=503, detail="Too many pending stream tickets; retry shortly")
+    return {"ticket": ticket, "expiresIn": NOTIFY_TICKET_TTL}
+
+@app.get("/api/notifications/stream")
+async def notification_stream(request: Request):
+    if not MONGO_URI:
+        raise HTTPException(status_code=503, detail="Notification stream is not configured")
+    # Browsers' EventSource can't set headers; they pass ?ticket= from
+    # /notifications/stream-ticket instead of the token itself.
+    token = bearer_token(request.headers) or redeem_stream_ticket(request.query_params.get("ticket", "")) or ""
+    auth = {"authorization": f"Bearer {token}"} if token else {}
+    # The unread count Node returns doubles as the stream's first event.
+    try:
+        resp = await node_unread_count(auth)
+    except httpx.TransportError as exc:
+        return upstream_error_response(exc)
+    if resp.status_code != 200:
+        return relayed_error_response(resp)
+    claims = token_claims(auth)
+    user_id, company = notification_user(claims), str(claims.get("company") or "")
+    if company and not ObjectId.is_valid(company):
+        raise HTTPException(status_code=403, detail="Notification stream needs a user token")
+    if stream_slots_left(user_id) <= 0:
+        raise HTTPException(status_code=429, detail="Too many notification streams for this user")
+    ensure_notification_feed()
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("lastEventId")
+    return StreamingResponse(
+        notification_events(user_id, company, last_event_id, resp.json().get("count", 0)),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+async def local_json_response(path: str, request: Request, payload, headers):
+    response = Response(content=json.dumps(payload, separators=(",", ":")).encode(), media_type="application/json", headers=headers)
+    response = await compress_response(path, request, response)
+    return conditional_response(request, response)
+
+async def rollup_stats_response(path: str, request: Request, build):
+    # Answered from the rollups only when the proxy can verify the token
+    # itself and the company's rollups are current; Node answers the rest,
+    # including every error response.
+    claims = verified_claims(request.headers) if TASK_STATS_ENABLED and MONGO_URI else None
+    self_tasks = {"true": True, "false": False}.get(request.query_params.get("isSelfTask"))
+    user_id, company = str((claims or {}).get("id", "")), str((claims or {}).get("company") or "")
+    if claims is not None and self_tasks is not None and ObjectId.is_valid(user_id) and ObjectId.is_valid(company):
+        ensure_task_stats_feed()
+        try:
+            payload = None
+            if rollups_ready(ObjectId(company)):
+                payload = await build(ObjectId(company), ObjectId(user_id), claims.get("role") == "admin", self_tasks)
+        except PyMongoError as exc:
+            print(f"Task stats rollup read failed: {exc}")
+        if payload is not None:
+            rollup_stats["served"] += 1
+            return await local_json_response(path, request, payload, {"x-proxy-stats": "rollup"})
+    rollup_stats["fallbacks"] += 1
+    return await proxy(path, request)
+
+@app.get("/api/stats/statisticsGraph")
+async def stats_graph(request: Request):
+    # Node's year starts at its local midnight; both run in UTC.
+    year = time.gmtime().tm_year
+    return await rollup_stats_response(
+        "stats/statisticsGraph", request, lambda *audience: statistics_graph(*audience, year)
+    )
+
+@app.get("/api/stats/tasks-summary")
+async def stats_summary(request: Request):
+    today = time.strftime("%Y-%m-%d", time.gmtime())
+    return await rollup_stats_response("stats/tasks-summary", request, lambda *audience: tasks_summary(*audience, today))
+
+async def platform_snapshot_response(path: str, request: Request, render):
+    # Master-admin reads come from the latest platform snapshot when the
+    # proxy can check the token the way masterAdminAuth does; Node answers
+    # everything else, including while no fresh snapshot exists.
+    claims = verified_claims(request.headers, master_admin=True) if PLATFORM_SNAPSHOT_ENABLED and MONGO_URI else None
+    admin_id = str((claims or {}).get("id", ""))
+    if claims is not None and claims.get("role") == "master-admin" and ObjectId.is_valid(admin_id):
+        ensure_platform_snapshots()
+        payload = render(request.query_params)
+        try:
+            if payload is not None and not await master_admin_active(admin_id):
+                payload = None
+        except PyMongoError as exc:
+            print(f"Master admin lookup failed: {exc}")
+            payload = None
+        if payload is not None:
+            snapshot_stats["served"] += 1
+            return await local_json_response(path, request, payload, {"x-snapshot-age": f"{snapshot_age():.0f}"})
+    snapshot_stats["fallbacks"] += 1
+    return await proxy(path, request)
+
+@app.get("/api/master-admin/dashboard")
+async def master_admin_dashboard(request: Request):
+    return await platform_snapshot_response("master-admin/dashboard", request, dashboard_payload)
+
+@app.get("/api/master-admin/analytics/revenue")
+async def master_admin_revenue(request: Request):
+    return await platform_snapshot_response("master-admin/analytics/revenue", request, revenue_payload)
+
+@app.get("/api/master-admin/companies")
+async def master_admin_companies(request: Request):
+    return await platform_snapshot_response("master-admin/companies", request, companies_payload)
+
+async def geofence_response(path: str, request: Request, check):
+    if not GEOFENCE_ENABLED or not MONGO_URI or not JWT_SECRET:
+        raise HTTPException(status_code=503, detail="Geofence checks are not configured")
+    claims = verified_claims(request.headers)
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    company = str(claims.get("company") or "")
+    if not ObjectId.is_valid(company):
+        raise HTTPException(status_code=403, detail="Geofence checks need a company token")
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be JSON")
+    try:
+        payload = await check(ObjectId(company), body)
+    except PyMongoError as exc:
+        print(f"Geofence lookup failed: {exc}")
+        raise HTTPException(status_code=503, detail="Geofences could not be loaded; retry shortly")
+    return await local_json_response(path, request, payload, {})
+
+@app.post("/api/geofence/check")
+async def geofence_check(request: Request):
+    return await geofence_response("geofence/check", request, check_payload)
+
+@app.post("/api/geofence/check-batch")
+async def geofence_check_batch(request: Request):
+    return await geofence_response("geofence/check-batch", request, check_batch_payload)
+
+@app.post("/api/salary/payroll/generate")
+async def generate_payroll(request: Request):
+    # Month-end payroll for the whole company in one pass; Node keeps the
+    # per-employee /salary/generate/:userId.
+    if not MONGO_URI or not JWT_SECRET:
+        raise HTTPException(status_code=503, detail="Batch payroll is not configured")
+    claims = verified_claims(request.headers)
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user_id, company = str(claims.get("id", "")), str(claims.get("company") or "")
+    if claims.get("role") != "admin" or not ObjectId.is_valid(user_id) or not ObjectId.is_valid(company):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be JSON")
+    try:
+        month, year, user_ids = parse_period(body)
+        payload = await run_payroll(ObjectId(company), ObjectId(user_id), month, year, user_ids)
+    except PyMongoError as exc:
+        print(f"Batch payroll failed: {exc}")
+        raise HTTPException(status_code=503, detail="Payroll could not be generated; retry shortly")
+    invalidate_tenant(tenant_of(request.headers))
+    return await local_json_response("salary/payroll/generate", request, payload, {})
+
+@app.get("/api/exports/{dataset}")
+async def export_rows(dataset: str, request: Request):
+    # Rows go from the Mongo cursor to the client a chunk at a time, so a
+    # year of attendance costs the same memory as a day of it.
+    fmt = request.query_params.get("format", "csv")
+    if dataset not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be csv or xlsx")
+    if not EXPORTS_ENABLED or not MONGO_URI or not JWT_SECRET:
+        raise HTTPException(status_code=503, detail="Exports are not configured")
+    claims = verified_claims(request.headers)
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if not ObjectId.is_valid(str(claims.get("id", ""))) or not ObjectId.is_valid(str(claims.get("company") or "")):
+        raise HTTPException(status_code=403, detail="Exports need a company token")
+    query = export_query(dataset, claims, request.query_params)
+
+    async def start():
+        return StreamingResponse(
+            export_stream(dataset, fmt, query, ObjectId(claims["company"])),
+            media_type=EXPORT_MEDIA_TYPES[fmt],
+            headers={
+                "content-disposition": f'attachment; filename="{export_filename(dataset, fmt)}"',
+                "cache-control": "no-store",
+                "x-accel-buffering": "no",
+            },
+        )
+
+    # Admitted as a heavy route, like a streamed proxy response: the token
+    # is spent when the export starts.
+    try:
+        return await admitted(f"exports/{dataset}", request, start)
+    except AdmissionRejected as exc:
+        return admission_rejected_response(exc)
+
+@app.post("/api/batch")
+async def batch(request: Request):
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > BATCH_MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail="Batch body too large")
+    # Chunked bodies have no length to check up front; the limit is
+    # enforced while reading instead.
+    try:
+        body = b"".join([chunk async for chunk in stream_request_body(request, BATCH_MAX_BODY_BYTES)])
+    except RequestBodyTooLarge:
+        raise HTTPException(status_code=413, detail="Batch body too large")
+    try:
+        items, deadline = parse_batch(json.loads(body))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Batch body must be JSON")
+    raw_headers = [(k, v) for k, v in request.headers.raw if k.decode("latin-1").lower() not in BATCH_EXCLUDED_HEADERS]
+
+    async def execute(item):
+        # Each item is routed like a request of its own, so caching,
+        # coalescing, admission and invalidation apply per item.
+        return batch_result(item, *await dispatch_sub_request(batch_sub_request(request, item, raw_headers)))
+
+    started = time.perf_counter()
+    results = await run_batch(items, execute, deadline)
+    payload = {"responses": results, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+    response = Response(content=json.dumps(payload).encode(), media_type="application/json")
+    return await compress_response("batch", request, response)
+
+def upstream_request_headers(request: Request, excluded=HOP_BY_HOP_HEADERS):
+    headers = {k: v for k, v in request.headers.items() if k not in excluded}
     headers.pop("host", None)
-    params = dict(request.query_params)
-    body = await request.body()
-    content_type = request.headers.get("content-type", "")
+    request_id = getattr(request.state, "request_id", None)
+    if request_id:
+        headers["x-request-id"] = request_id
+    return headers
+
+def upstream_extensions(request: Request):
+    timings = getattr(request.state, "timings", None)
+    return {"trace": upstream_tracer(timings)} if timings is not None else None
+
+def proxy_response_headers(resp: httpx.Response, excluded):
+    # uvicorn stamps its own Date on every response; Node's would repeat it.
+    return {k: v for k, v in resp.headers.items() if k.lower() not in excluded and k.lower() != "date"}
+
+def upstream_error_response(exc: Exception):
+    if isinstance(exc, RequestBodyTooLarge):
+        return Response(content=b"Request body too large", status_code=413)
+    if isinstance(exc, httpx.PoolTimeout):
+        return Response(content=b"Upstream connection pool exhausted", status_code=503)
+    if isinstance(exc, httpx.TimeoutException):
+        return Response(content=b"Upstream timed out", status_code=504)
+    return Response(content=b"Upstream unavailable", status_code=502)
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
+async def stream_request_body(request: Request, limit=None):
+    limit = PROXY_MAX_BODY_BYTES if limit is None else limit
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise RequestBodyTooLarge()
+        if chunk:
+            yield chunk
+
+def note_upstream_time(request: Request, started: float):
+    # Read back by MetricsMiddleware to split latency into Node time and
+    # proxy overhead.
+    request.state.upstream_seconds = getattr(request.state, "upstream_seconds", 0.0) + time.perf_counter() - started
+
+def note_queue_time(request: Request, queued: float):
+    timings = getattr(request.state, "timings", None)
+    if timings is not None:
+        add_phase(timings, "queue", time.perf_counter() - queued)
+
+def mark_worker_failed(worker, exc: Exception):
+    if isinstance(exc, httpx.ConnectError):
+        worker["healthy"] = False
+        worker["failures"] += 1
+
+async def buffered_proxy(path: str, request: Request, client: httpx.AsyncClient, worker, shared=False):
+    body = await request.body()
+    if len(body) > PROXY_MAX_BODY_BYTES:
+        return upstream_error_response(RequestBodyTooLarge())
+    worker["outstanding"] += 1
+    started = time.perf_counter()
+    try:
+        # A response shared between callers must be a full 200, never a
+        # 304 computed against one caller's validators.
+        excluded = HOP_BY_HOP_HEADERS | CONDITIONAL_HEADERS if shared else HOP_BY_HOP_HEADERS
         resp = await client.request(
             method=request.method,
-            url=url,
-            headers=headers,
-            params=params,
+            url=f"{worker['url']}/{path}",
+            headers=upstream_request_headers(request, excluded),
+            params=request.url.query,
             content=body,
+            extensions=upstream_extensions(request),
+        )
+    except httpx.TransportError as exc:
+        mark_worker_failed(worker, exc)
+        return upstream_error_response(exc)
+    finally:
+        release_node_worker(worker)
+        note_upstream_time(request, started)
+    return buffered_response(request, resp)
+
+def buffered_response(request: Request, resp: httpx.Response):
+    excluded = {"content-encoding", "content-length"} | HOP_BY_HOP_HEADERS
+    headers = proxy_response_headers(resp, excluded)
+    body = resp.content
+    if etag_eligible(request.method, resp.status_code, resp.headers, len(body)):
+        # Replaces Express's weak per-worker ETag with a strong one owned by
+        # the proxy, so cached hits can be validated without touching Node.
+        headers["etag"] = compute_etag(body)
+    return Response(content=body, status_code=resp.status_code, headers=headers)
+
+def conditional_response(request: Request, response: Response):
+    if isinstance(response, StreamingResponse) or response.status_code != 200 or "etag" not in response.headers:
+        return response
+    if etag_matches(request.headers.get("if-none-match"), response.headers["etag"]):
+        return not_modified_response(response.headers)
+    return response
+
+async def close_upstream_response(resp: Optional[httpx.Response], worker):
+    try:
+        if resp is not None:
+            await resp.aclose()
+    finally:
+        release_node_worker(worker)
+
+async def streaming_proxy(path: str, request: Request, client: httpx.AsyncClient, worker):
+    # Bodies are relayed chunk by chunk in both directions and the upstream
+    # encoding is passed through untouched, so memory per request stays flat.
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    upstream_req = client.build_request(
+        method=request.method,
+        url=f"{worker['url']}/{path}",
+        headers=upstream_request_headers(request),
+        params=request.url.query,
+        content=stream_request_body(request) if has_body else None,
+        extensions=upstream_extensions(request),
+    )
+    worker["outstanding"] += 1
+    resp = None
+    handed_off = False
+    try:
+        started = time.perf_counter()
+        try:
+            resp = await client.send(upstream_req, stream=True)
+        except (RequestBodyTooLarge, httpx.TransportError) as exc:
+            mark_worker_failed(worker, exc)
+            return upstream_error_response(exc)
+        finally:
+            note_upstream_time(request, started)
+        size = resp.headers.get("content-length")
+        if etag_eligible(request.method, resp.status_code, resp.headers, size) or compression_candidate(path, resp.headers, size):
+            started = time.perf_counter()
+            try:
+                await resp.aread()
+            except httpx.TransportError as exc:
+                return upstream_error_response(exc)
+            finally:
+                note_upstream_time(request, started)
+            return buffered_response(request, resp)
+        response = StreamingResponse(
+            resp.aiter_raw(),
+            status_code=resp.status_code,
+            headers=proxy_response_headers(resp, HOP_BY_HOP_HEADERS),
+            background=BackgroundTask(close_upstream_response, resp, worker),
+        )
+        handed_off = True
+        return response
+    finally:
+        # Also reached when the caller is cancelled mid-call (a client
+        # disconnect, a batch deadline); the response's background task owns
+        # the release once it has been handed off.
+        if not handed_off:
+            await close_upstream_response(resp, worker)
+
+def is_long_poll(path: str, request: Request):
+    return path.startswith("socket.io") and request.query_params.get("transport") == "polling"
+
+async def long_poll_proxy(path: str, request: Request):
+    queued = time.perf_counter()
+    try:
+        await asyncio.wait_for(longpoll_slots.acquire(), LONGPOLL_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        longpoll_stats["rejected"] += 1
+        return Response(content=b"Long-poll lane saturated", status_code=503, headers={"Retry-After": "1"})
+    note_queue_time(request, queued)
+    longpoll_stats["in_flight"] += 1
+    sid = request.query_params.get("sid")
+    worker = pick_node_worker(sid)
+    try:
+        # Polling payloads are small; buffering keeps the slot held until the
+        # upstream exchange is really finished.
+        response = await buffered_proxy(path, request, longpoll_client, worker)
+        if not sid and response.status_code == 200:
+            remember_socket_session(response.body, worker)
+        elif sid and response.status_code == 400:
+            socket_sessions.pop(sid, None)
+        return response
+    finally:
+        longpoll_stats["in_flight"] -= 1
+        longpoll_stats["served"] += 1
+        longpoll_slots.release()
+
+async def cached_proxy(path: str, request: Request, ttl: float):
+    # Keyed on a hash of the whole bearer token so one user's cached
+    # response can never be served to another, even within a company.
+    key = cache_key(path, request.url.query, auth_subject(request.headers))
+    entry = cache_get(key)
+    if entry:
+        return Response(
+            content=entry["body"],
+            status_code=entry["status_code"],
+            headers={**entry["headers"], "x-proxy-cache": "HIT"},
         )
-    excluded = {"content-encoding", "content-length", "transfer-encoding"}
-    resp_headers = {k: v for k, v in resp.headers.items() if k.lower() not in excluded}
-    return Response(content=resp.content, status_code=resp.status_code, headers=resp_headers)
+    response = await coalesced_proxy(path, request)
+    cache_control = response.headers.get("cache-control", "")
+    if response.status_code == 200 and "no-store" not in cache_control and "set-cookie" not in response.headers:
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        cache_put(key, tenant_of(request.headers), ttl, response.status_code, headers, response.body)
+    response.headers["x-proxy-cache"] = "MISS"
+    return response
+
+async def coalesced_proxy(path: str, request: Request):
+    # Same key as the response cache: callers only share a response when
+    # they present the same bearer token.
+    key = cache_key(path, request.url.query, auth_subject(request.headers))
+
+    async def fetch():
+        response = await admitted(
+            path, request, lambda: buffered_proxy(path, request, upstream_client, pick_node_worker(), shared=True)
+        )
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+        return response.status_code, headers, response.body
+
+    status_code, headers, body = await single_flight(route_template(path), key, fetch)
+    return Response(content=body, status_code=status_code, headers=headers)
+
+def admission_tenant(request: Request):
+    # Only a token the proxy has verified picks the bucket; anything else is
+    # charged to the client address, which uvicorn takes from X-Forwarded-For
+    # only for trusted proxies (--forwarded-allow-ips).
+    tenant = verified_tenant(request.headers)
+    if tenant not in (None, "anonymous"):
+        return tenant
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def admission_rejected_response(exc: AdmissionRejected):
+    return Response(
+        content=f"Too much load from this account ({exc.reason}); retry shortly".encode(),
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+async def admitted(path: str, request: Request, call):
+    # Only requests that will really reach Node take a token: cache hits
+    # and coalesced followers are answered before this is reached.
+    if not admission_enabled():
+        return await call()
+    queued = time.perf_counter()
+    async with admission_slot(admission_tenant(request), route_class(request.method, path)):
+        note_queue_time(request, queued)
+        return await call()
+
+@app.api_route("/api/{path:path}", methods=["GET","POST","PUT","PATCH","DELETE","OPTIONS","HEAD"])
+async def proxy(path: str, request: Request):
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > PROXY_MAX_BODY_BYTES:
+        return upstream_error_response(RequestBodyTooLarge())
+    if is_long_poll(path, request):
+        return await long_poll_proxy(path, request)
+    ttl = cache_ttl_for(path) if request.method == "GET" else None
+    try:
+        if ttl:
+            response = await cached_proxy(path, request, ttl)
+        elif request.method == "GET" and single_flight_enabled_for(path):
+            response = await coalesced_proxy(path, request)
+        elif PROXY_STREAMING:
+            response = await admitted(path, request, lambda: streaming_proxy(path, request, upstream_client, pick_node_worker()))
+        else:
+            response = await admitted(path, request, lambda: buffered_proxy(path, request, upstream_client, pick_node_worker()))
+    except AdmissionRejected as exc:
+        return admission_rejected_response(exc)
+    # Drop the tenant's cached reads once Node has answered the write, so a
+    # read racing the write can't re-cache the old state afterwards.
+    if invalidates_cache(request.method, path):
+        invalidate_tenant(tenant_of(request.headers))
+        note_task_write(request.method, path)
+        note_platform_write(path)
+        note_geofence_write(path, token_claims(request.headers))
+    # Encoding is settled before validating, so a 304 carries the same
+    # variant ETag and Vary as the 200 it stands in for.
+    response = await compress_response(path, request, response)
+    return conditional_response(request, response)
+
+async def compress_response(path: str, request: Request, response: Response):
+    # Only buffered bodies are compressed; the cache keeps identity bodies
+    # so one entry serves clients with any Accept-Encoding.
+    if isinstance(response, StreamingResponse) or response.status_code == 304 or not response.body:
+        return response
+    body, encoding = await compress_for(
+        route_template(path), path, request.headers.get("accept-encoding", ""), response.headers, response.body
+    )
+    if encoding is None:
+        return response
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    headers["content-encoding"] = encoding
+    headers["vary"] = ", ".join(filter(None, [headers.get("vary"), "Accept-Encoding"]))
+    if "etag" in headers:
+        headers["etag"] = variant_etag(headers["etag"], encoding)
+    return Response(content=body, status_code=response.status_code, headers=headers)
+
+async def relay_client_to_upstream(websocket: WebSocket, upstream, stats):
+    # Each frame is forwarded before the next one is read, so a slow Node
+    # socket pushes back on the browser instead of queueing in Python.
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("text")
+            if data is None:
+                data = message.get("bytes") or b""
+            await upstream.send(data)
+            stats["frames_in"] += 1
+            stats["bytes_in"] += len(data)
+            stats["last_activity"] = time.monotonic()
+    except (WebSocketDisconnect, websockets.ConnectionClosed):
+        return
+
+async def relay_upstream_to_client(websocket: WebSocket, upstream, stats):
+    try:
+        async for data in upstream:
+            if isinstance(data, str):
+                await websocket.send_text(data)
+            else:
+                await websocket.send_bytes(data)
+            stats["frames_out"] += 1
+            stats["bytes_out"] += len(data)
+            stats["last_activity"] = time.monotonic()
+    except (WebSocketDisconnect, websockets.ConnectionClosed, RuntimeError):
+        return
+
+async def websocket_idle_watchdog(stats):
+    while True:
+        idle_for = time.monotonic() - stats["last_activity"]
+        if idle_for >= WS_IDLE_TIMEOUT:
+            return
+        await asyncio.sleep(WS_IDLE_TIMEOUT - idle_for)
+
+@app.websocket("/api/socket.io/{path:path}")
+async def socket_io_tunnel(websocket: WebSocket, path: str):
+    worker = pick_node_worker(websocket.query_params.get("sid"))
+    url = f"{worker['url'].replace('http', 'ws', 1)}/socket.io/{path}"
+    if websocket.url.query:
+        url = f"{url}?{websocket.url.query}"
+    headers = [(k, v) for k, v in websocket.headers.items() if k in WS_FORWARDED_HEADERS]
+    connect = functools.partial(websocket_unix_connect, worker["socket"]) if worker["socket"] else websocket_connect
+    try:
+        upstream = await connect(
+            url,
+            additional_headers=headers,
+            origin=websocket.headers.get("origin"),
+            ping_interval=WS_PING_INTERVAL,
+            ping_timeout=WS_PING_TIMEOUT,
+            max_queue=WS_MAX_QUEUE,
+            max_size=WS_MAX_MESSAGE_BYTES,
+            open_timeout=UPSTREAM_CONNECT_TIMEOUT,
+        )
+    except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake):
+        ws_totals["upstream_failures"] += 1
+        await websocket.close(code=1011)
+        return
+
+    await websocket.accept()
+    conn_id = next(ws_connection_ids)
+    stats = {
+        "opened_at": time.time(),
+        "last_activity": time.monotonic(),
+        "frames_in": 0,
+        "frames_out": 0,
+        "bytes_in": 0,
+        "bytes_out": 0,
+    }
+    ws_connections[conn_id] = stats
+    ws_totals["opened"] += 1
+    tasks = [
+        asyncio.create_task(relay_client_to_upstream(websocket, upstream, stats)),
+        asyncio.create_task(relay_upstream_to_client(websocket, upstream, stats)),
+        asyncio.create_task(websocket_idle_watchdog(stats)),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        ws_connections.pop(conn_id, None)
+        ws_totals["closed"] += 1
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await upstream.close()
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
+
+def websocket_stats():
+    now = time.monotonic()
+    return {
+        **ws_totals,
+        "active": len(ws_connections),
+        "connections": [
+            {
+                "id": conn_id,
+                "age_seconds": round(time.time() - stats["opened_at"], 1),
+                "idle_seconds": round(now - stats["last_activity"], 1),
+                "frames_in": stats["frames_in"],
+                "frames_out": stats["frames_out"],
+                "bytes_in": stats["bytes_in"],
+                "bytes_out": stats["bytes_out"],
+            }
+            for conn_id, stats in ws_connections.items()
+        ],
+    }
 
 @app.get("/api")
 async def api_root():
     return {"status": "ok", "message": "ForaTask API proxy running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    workers = [({"worker": w["id"]}, w) for w in node_workers]
+    return PlainTextResponse(
+        render_metrics([
+            ("proxy_node_worker_healthy", "1 if the Node worker passed its last health probe.",
+             [(labels, int(w["healthy"])) for labels, w in workers]),
+            ("proxy_node_worker_outstanding", "Requests currently in flight to each Node worker.",
+             [(labels, w["outstanding"]) for labels, w in workers]),
+            ("proxy_websocket_connections", "Open socket.io WebSocket tunnels.", [({}, len(ws_connections))]),
+            ("proxy_longpoll_in_flight", "Long-poll requests holding a lane slot.", [({}, longpoll_stats["in_flight"])]),
+        ]),
+        media_type="text/plain; version=0.0.4",
+    )
+
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    pool = upstream_pool_stats(upstream_client) if upstream_client else None
+    longpoll = {
+        **longpoll_stats,
+        "max_concurrency": LONGPOLL_MAX_CONCURRENCY,
+        "pool": upstream_pool_stats(longpoll_client) if longpoll_client else None,
+    }
+    workers = [
+        {
+            "id": w["id"],
+            "state": w["state"],
+            "healthy": w["healthy"],
+            "restarts": w["restarts"],
+            "last_exit_code": w["last_exit_code"],
+            "outstanding": w["outstanding"],
+            "served": w["served"],
+            "failures": w["failures"],
+        }
+        for w in node_workers
+    ]
+    return {
+        "status": "ok",
+        "supervisor": {"mode": "dev-reload" if NODE_DEV_RELOAD else "production", "transport": NODE_TRANSPORT, "ready": node_ready},
+        "node_workers": workers,
+        "socket_sessions": len(socket_sessions),
+        "node_logs": log_buffer_stats(),
+        "response_cache": cache_stats(),
+        "compression": compression_summary(),
+        "single_flight": single_flight_stats(),
+        "admission": admission_stats(),
+        "traffic_capture": capture_summary(),
+        "upstream_pool": pool,
+        "longpoll": longpoll,
+        "websockets": websocket_stats(),
+        "notification_streams": notification_stream_stats(),
+        "task_stats": task_stats_summary(),
+        "platform_snapshot": platform_snapshot_summary(),
+        "payroll": payroll_summary(),
+        "geofence": geofence_summary(),
+        "exports": export_summary(),
+    }
@@ -0,0 +1,42 @@
+import asyncio
+import collections
+import os
+
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1") == "1"
+# Comma-separated path prefixes whose identical concurrent GETs share one
+# upstream call.
+SINGLE_FLIGHT_ROUTES = tuple(
+    prefix.strip().lstrip("/")
+    for prefix in os.environ.get(
+        "SINGLE_FLIGHT_ROUTES",
+        "stats/,reports/,task/getTaskList,me/usersList,me/userinfo,notifications/unreadCount,chat/rooms",
+    ).split(",")
+    if prefix.strip()
+)
+
+in_flight = {}
+flight_stats = collections.defaultdict(lambda: {"upstream_calls": 0, "coalesced": 0})
+
+def single_flight_enabled_for(path: str):
+    return SINGLE_FLIGHT_ENABLED and path.startswith(SINGLE_FLIGHT_ROUTES)
+
+async def single_flight(route: str, key, fetch):
+    # The upstream call runs as its own task so a leader whose client
+    # disconnects doesn't cancel the call the other waiters depend on.
+    task = in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        in_flight[key] = task
+        task.add_done_callback(lambda _: in_flight.pop(key, None))
+        flight_stats[route]["upstream_calls"] += 1
+    else:
+        flight_stats[route]["coalesced"] += 1
+    return await asyncio.shield(task)
+
+def single_flight_stats():
+    return {
+        "enabled": SINGLE_FLIGHT_ENABLED,
+        "in_flight": len(in_flight),
+        "saved_upstream_calls": sum(s["coalesced"] for s in flight_stats.values()),
+        "routes": dict(flight_stats),
+    }
@@ -0,0 +1,311 @@
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+
+from mongo import database
+
+TASK_STATS_ENABLED = os.environ.get("TASK_STATS_ENABLED", "1") == "1"
+TASK_STATS_POLL_INTERVAL = float(os.environ.get("TASK_STATS_POLL_INTERVAL", "2"))
+TASK_STATS_POLL_LOOKBACK = float(os.environ.get("TASK_STATS_POLL_LOOKBACK", "30"))
+TASK_STATS_REBUILD_BATCH = int(os.environ.get("TASK_STATS_REBUILD_BATCH", "1000"))
+TASK_FIELDS = ("company", "isSelfTask", "createdBy", "assignees", "observers", "status", "priority", "dueDateTime", "createdAt")
+TASK_CHANGES = ("insert", "update", "replace", "delete")
+DELETE_TASK_PATH = re.compile(r"task/delete-task/([0-9a-f]{24})/?", re.IGNORECASE)
+
+# Rollups are only served for companies rebuilt by this process while the
+# feed has been running; anything else is answered by Node.
+ready_companies = set()
+rebuilds = {}
+pending_refresh = set()
+apply_lock = asyncio.Lock()
+stats_state = {"task": None, "source": None, "errors": 0, "wake": None}
+rollup_stats = {"applied": 0, "unchanged": 0, "rebuilds": 0, "rebuild_errors": 0, "served": 0, "fallbacks": 0}
+
+def tasks_collection():
+    return database()["tasks"]
+
+def rollups_collection():
+    return database()["task_stats_rollups"]
+
+def ledger_collection():
+    return database()["task_stats_ledger"]
+
+def count_bucket(task):
+    return f"{task.get('status')}|{task.get('priority')}"
+
+def due_day(value):
+    # Node's "today" window is [00:00, 23:59:59.999) UTC, so a task due at
+    # exactly 23:59:59.999 - the frontend's end-of-day - is never "today".
+    if not isinstance(value, datetime):
+        return None
+    value = value.astimezone(timezone.utc)
+    if (value.hour, value.minute, value.second, value.microsecond // 1000) == (23, 59, 59, 999):
+        return None
+    return value.strftime("%Y-%m-%d")
+
+def task_audiences(task):
+    # The three ways statsController.js selects tasks: a user's own self
+    # tasks, a whole company's team tasks (admins), and the team tasks a
+    # user created, is assigned to or observes (everyone else).
+    if task["isSelfTask"]:
+        return [("self", task.get("createdBy"), False)] if task.get("createdBy") else []
+    observers = set(task.get("observers") or [])
+    members = set(task.get("assignees") or []) | observers | {task.get("createdBy")}
+    members.discard(None)
+    return [("team", None, False)] + [("member", user, user in observers) for user in sorted(members)]
+
+def rollup_keys(task):
+    company = task.get("company")
+    if company is None or not isinstance(task.get("isSelfTask"), bool):
+        return []
+    created, due = task.get("createdAt"), task.get("dueDateTime")
+    day = due_day(due)
+    keys = []
+    for scope, user, observer in task_audiences(task):
+        # Month 0 and year 0 hold tasks without a due date or creation
+        # time: they count towards all-time totals but never in a chart.
+        month = due.astimezone(timezone.utc).month if isinstance(due, datetime) else 0
+        year = created.astimezone(timezone.utc).year if isinstance(created, datetime) else 0
+        keys.append((
+            f"m:{company}:{scope}:{user}:{int(observer)}:{year}:{month}",
+            {"company": company, "scope": scope, "user": user, "observer": observer,
+             "period": "month", "year": year, "month": month},
+        ))
+        if day:
+            keys.append((
+                f"d:{company}:{scope}:{user}:{int(observer)}:{day}",
+                {"company": company, "scope": scope, "user": user, "observer": observer, "period": "day", "day": day},
+            ))
+    return keys
+
+async def apply_task(task_id, task):
+    """Bring the rollups in line with one task's current state.
+
+    The ledger remembers which rollup documents each task was counted in,
+    so applying the same state twice is a no-op and events may be replayed
+    or arrive out of order. task is None when the task was deleted.
+    """
+    entry = await ledger_collection().find_one({"_id": task_id})
+    company = task.get("company") if task else entry and entry["company"]
+    if company not in ready_companies:
+        return
+    keys = rollup_keys(task) if task else []
+    bucket = count_bucket(task) if task else None
+    key_ids = [key for key, _ in keys]
+    if entry and entry["bucket"] == bucket and entry["keys"] == key_ids:
+        rollup_stats["unchanged"] += 1
+        return
+    ops = []
+    if entry:
+        ops.extend(UpdateOne({"_id": key}, {"$inc": {f"counts.{entry['bucket']}": -1}}) for key in entry["keys"])
+    ops.extend(
+        UpdateOne({"_id": key}, {"$inc": {f"counts.{bucket}": 1}, "$setOnInsert": fields}, upsert=True)
+        for key, fields in keys
+    )
+    if ops:
+        await rollups_collection().bulk_write(ops, ordered=False)
+    if keys:
+        await ledger_collection().replace_one(
+            {"_id": task_id}, {"company": company, "keys": key_ids, "bucket": bucket}, upsert=True
+        )
+    elif entry:
+        await ledger_collection().delete_one({"_id": task_id})
+    rollup_stats["applied"] += 1
+
+async def rebuild_company(company: ObjectId):
+    # Holds the apply lock throughout, so changes made while the company's
+    # tasks are scanned are applied after the rebuild, against its ledger.
+    async with apply_lock:
+        ready_companies.discard(company)
+        await rollups_collection().delete_many({"company": company})
+        await ledger_collection().delete_many({"company": company})
+        counts, fields_by_key, entries = {}, {}, []
+        async for task in tasks_collection().find({"company": company}, dict.fromkeys(TASK_FIELDS, 1)):
+            keys = rollup_keys(task)
+            if not keys:
+                continue
+            bucket = count_bucket(task)
+            for key, fields in keys:
+                fields_by_key[key] = fields
+                key_counts = counts.setdefault(key, {})
+                key_counts[bucket] = key_counts.get(bucket, 0) + 1
+            entries.append({"_id": task["_id"], "company": company, "keys": [key for key, _ in keys], "bucket": bucket})
+            if len(entries) >= TASK_STATS_REBUILD_BATCH:
+                await ledger_collection().insert_many(entries, ordered=False)
+                entries = []
+        if entries:
+            await ledger_collection().insert_many(entries, ordered=False)
+        docs = [{"_id": key, **fields_by_key[key], "counts": key_counts} for key, key_counts in counts.items()]
+        for start in range(0, len(docs), TASK_STATS_REBUILD_BATCH):
+            await rollups_collection().insert_many(docs[start:start + TASK_STATS_REBUILD_BATCH], ordered=False)
+        ready_companies.add(company)
+        rollup_stats["rebuilds"] += 1
+
+def rollups_ready(company: ObjectId):
+    """True when company's rollups can be served; otherwise starts building them."""
+    if stats_state["source"] is None:
+        return False
+    if company in ready_companies:
+        return True
+    task = rebuilds.get(company)
+    if task is None or task.done():
+        if task is not None and not task.cancelled() and task.exception() is not None:
+            rollup_stats["rebuild_errors"] += 1
+        rebuilds[company] = asyncio.create_task(rebuild_company(company))
+    return False
+
+def change_pipeline():
+    projection = {"operationType": 1, "documentKey": 1}
+    projection.update({f"fullDocument.{field}": 1 for field in TASK_FIELDS})
+    return [{"$match": {"operationType": {"$in": list(TASK_CHANGES)}}}, {"$project": projection}]
+
+async def watch_task_changes(collection):
+    async with collection.watch(change_pipeline(), full_document="updateLookup") as stream:
+        stats_state["source"] = "change_stream"
+        async for change in stream:
+            # updateLookup returns the task as it is now (None once deleted),
+            # which is all apply_task needs.
+            async with apply_lock:
+                await apply_task(change["documentKey"]["_id"], change.get("fullDocument"))
+
+async def poll_task_changes(collection):
+    # Standalone servers have no change streams. mongoose stamps updatedAt
+    # on every save and updateMany, so recently touched tasks are re-read
+    # each interval; deletes are learned from the proxied delete route.
+    await collection.create_index("updatedAt")
+    stats_state["source"] = "polling"
+    seen = {}
+    projection = dict.fromkeys(TASK_FIELDS + ("updatedAt",), 1)
+    while True:
+        if ready_companies:
+            since = datetime.now(timezone.utc) - timedelta(seconds=TASK_STATS_POLL_LOOKBACK)
+            async for task in collection.find({"updatedAt": {"$gte": since}}, projection):
+                if seen.get(task["_id"]) != task["updatedAt"]:
+                    seen[task["_id"]] = task["updatedAt"]
+                    async with apply_lock:
+                        await apply_task(task["_id"], task)
+            seen = {task_id: updated for task_id, updated in seen.items() if updated >= since}
+            while pending_refresh:
+                task_id = pending_refresh.pop()
+                task = await collection.find_one({"_id": task_id}, dict.fromkeys(TASK_FIELDS, 1))
+                async with apply_lock:
+                    await apply_task(task_id, task)
+        stats_state["wake"].clear()
+        try:
+            await asyncio.wait_for(stats_state["wake"].wait(), TASK_STATS_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def run_task_stats_feed():
+    collection = tasks_collection()
+    await rollups_collection().create_index([
+        ("company", ASCENDING), ("scope", ASCENDING), ("user", ASCENDING), ("period", ASCENDING), ("year", ASCENDING),
+    ])
+    await ledger_collection().create_index("company")
+    backoff = TASK_STATS_POLL_INTERVAL
+    while True:
+        try:
+            try:
+                await watch_task_changes(collection)
+            except OperationFailure:
+                await poll_task_changes(collection)
+        except PyMongoError as exc:
+            # Changes made while the feed was down were missed; every
+            # company is rebuilt once it is back.
+            stats_state["errors"] += 1
+            stats_state["source"] = None
+            ready_companies.clear()
+            print(f"Task stats feed error: {exc}; retrying in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+        else:
+            backoff = TASK_STATS_POLL_INTERVAL
+
+def ensure_task_stats_feed():
+    if stats_state["task"] is None or stats_state["task"].done():
+        stats_state["wake"] = asyncio.Event()
+        stats_state["task"] = asyncio.create_task(run_task_stats_feed())
+
+async def stop_task_stats_feed():
+    running = [task for task in [stats_state["task"], *rebuilds.values()] if task]
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
+    rebuilds.clear()
+    ready_companies.clear()
+    stats_state.update(task=None, source=None)
+
+def note_task_write(method: str, path: str):
+    # Lets the polling feed pick up a write right away instead of at its
+    # next interval; a deleted task can only be found by its id.
+    if stats_state["source"] != "polling" or not path.startswith(("task/", "task-extended/")):
+        return
+    deleted = DELETE_TASK_PATH.fullmatch(path) if method == "DELETE" else None
+    if deleted:
+        pending_refresh.add(ObjectId(deleted.group(1)))
+    stats_state["wake"].set()
+
+def audience_query(company: ObjectId, user: ObjectId, admin: bool, self_tasks: bool):
+    if self_tasks:
+        return {"company": company, "scope": "self", "user": user}
+    if admin:
+        return {"company": company, "scope": "team", "user": None}
+    return {"company": company, "scope": "member", "user": user}
+
+def split_bucket(bucket: str):
+    status, _, priority = bucket.partition("|")
+    return status, priority
+
+async def statistics_graph(company: ObjectId, user: ObjectId, admin: bool, self_tasks: bool, year: int):
+    # Team members see "For Approval" as done: it is waiting on someone else.
+    completed = {"Completed"} if self_tasks or admin else {"Completed", "For Approval"}
+    months = [{"month": month, "completed": 0, "incomplete": 0} for month in range(1, 13)]
+    query = {**audience_query(company, user, admin, self_tasks), "period": "month", "year": year}
+    async for doc in rollups_collection().find(query, {"month": 1, "counts": 1}):
+        if not doc["month"]:
+            continue
+        for bucket, count in doc["counts"].items():
+            group = "completed" if split_bucket(bucket)[0] in completed else "incomplete"
+            months[doc["month"] - 1][group] += count
+    return months
+
+async def tasks_summary(company: ObjectId, user: ObjectId, admin: bool, self_tasks: bool, today: str):
+    summary = dict.fromkeys((
+        "todayoverduePriority", "todayhighPriority", "todaymediumPriority", "todaylowPriority",
+        "allTimeOverdueTasks", "allTimeTotalTasks", "allTimeCompletedTasks",
+    ), 0)
+    query = audience_query(company, user, admin, self_tasks)
+    # Members don't count tasks they only observe as done while those wait
+    # for approval - the approval is theirs to give.
+    member = not self_tasks and not admin
+    async for doc in rollups_collection().find({**query, "period": "month"}, {"observer": 1, "counts": 1}):
+        for bucket, count in doc["counts"].items():
+            status = split_bucket(bucket)[0]
+            summary["allTimeTotalTasks"] += count
+            if status == "Completed" or member and status == "For Approval" and not doc["observer"]:
+                summary["allTimeCompletedTasks"] += count
+            elif status == "Overdue":
+                summary["allTimeOverdueTasks"] += count
+    async for doc in rollups_collection().find({**query, "period": "day", "day": today}, {"counts": 1}):
+        for bucket, count in doc["counts"].items():
+            status, priority = split_bucket(bucket)
+            if status == "Overdue":
+                summary["todayoverduePriority"] += count
+            elif priority in ("High", "Medium", "Low"):
+                summary[f"today{priority.lower()}Priority"] += count
+    return summary
+
+def task_stats_summary():
+    return {
+        **rollup_stats,
+        "enabled": TASK_STATS_ENABLED,
+        "source": stats_state["source"],
+        "feed_errors": stats_state["errors"],
+        "companies": len(ready_companies),
+        "rebuilding": sum(1 for task in rebuilds.values() if not task.done()),
+    }
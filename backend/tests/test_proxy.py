@@ -0,0 +1,1425 @@
+"""
+ForaTask proxy layer tests - run offline against the Python modules
+- Upstream connection pool and its lifespan
+- Streaming proxy and request body limits
+- socket.io WebSocket tunnel
+- Long-poll lane
+- Node worker balancing and sid stickiness
+- Node worker supervision
+- Node log pump, ring buffer and queued file writer
+- Response cache keys, LRU bounds and tenant invalidation
+- ETag validators and conditional variants
+- Compression negotiation and route labels
+- Local upload serving
+- Single-flight coalescing
+- Per-tenant admission control
+- Prometheus metrics
+- Request IDs and Server-Timing phases
+- Load benchmark generator and regression check
+- Traffic capture anonymization and replay
+- Batch validation and dependency scheduling
+- Notification stream fan-out, resume and overflow
+- Task stats rollup keys and reads
+- Platform snapshot figures and master-admin reads
+- Batch payroll figures and period checks
+- Geofence grid lookups
+- Streaming CSV/XLSX exports and their benchmark
+"""
+import asyncio
+import base64
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import zipfile
+from datetime import datetime, timezone
+from xml.dom import minidom
+
+import httpx
+import jwt
+import pytest
+import websockets.asyncio.server
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission
+import batch
+import compression
+import exports
+import geofence
+import log_queue
+import metrics
+import node_logs
+import notification_stream
+import payroll
+import platform_snapshot
+import request_identity
+import request_timing
+import response_cache
+import server
+import single_flight
+import task_stats
+import traffic_capture
+import uploads
+from benchmarks import export_bench, proxy_bench, replay
+from http_validators import compute_etag, etag_eligible, etag_matches
+from request_errors import RequestError
+from request_identity import auth_subject, tenant_of
+from route_labels import route_template
+from starlette.datastructures import QueryParams
+from starlette.requests import Request
+
+
+class TestUpstreamPool:
+    """Test the shared upstream clients the lifespan opens and closes"""
+
+    def test_lifespan_owns_both_pools(self, monkeypatch):
+        """One pooled client for API calls, one for long-polls, both closed on shutdown"""
+        async def idle(*args):
+            return True
+
+        async def forever():
+            await asyncio.Event().wait()
+
+        for name in ("start_node_backend", "stop_node_backend", "wait_for_node_ready"):
+            monkeypatch.setattr(server, name, idle)
+        monkeypatch.setattr(server, "node_health_loop", forever)
+
+        async def run():
+            async with server.lifespan(server.app):
+                clients = server.upstream_client, server.longpoll_client
+                pools = [server.upstream_pool_stats(client) for client in clients]
+            return clients, pools
+
+        (api, longpoll), (api_pool, longpoll_pool) = asyncio.run(run())
+        assert api_pool["max_connections"] == server.UPSTREAM_MAX_CONNECTIONS and api_pool["connections"] == 0
+        assert longpoll_pool["max_connections"] == server.LONGPOLL_MAX_CONCURRENCY
+        assert api.timeout.read == server.UPSTREAM_READ_TIMEOUT and longpoll.timeout.read == server.LONGPOLL_READ_TIMEOUT
+        assert api.is_closed and longpoll.is_closed
+        assert server.upstream_client is None and server.longpoll_client is None
+
+
+def stub_node(worker_id):
+    """One Node worker's worth of endpoints for the proxy to relay to."""
+    stub = FastAPI()
+
+    @stub.get("/files/report.bin")
+    async def download():
+        async def chunks():
+            for i in range(8):
+                yield bytes([i]) * 4096
+        return StreamingResponse(chunks(), media_type="application/octet-stream")
+
+    @stub.post("/echo")
+    async def echo(request: Request):
+        return {"bytes": len(await request.body())}
+
+    @stub.get("/slow")
+    async def slow():
+        await asyncio.sleep(5)
+        return {"slow": True}
+
+    @stub.get("/socket.io/")
+    async def poll(request: Request):
+        sid = request.query_params.get("sid")
+        if not sid:
+            return PlainTextResponse('0{"sid":"w%d-%s","upgrades":["websocket"]}' % (worker_id, ObjectId()))
+        if not sid.startswith(f"w{worker_id}-"):
+            return PlainTextResponse('{"code":1,"message":"Session ID unknown"}', status_code=400)
+        await asyncio.sleep(float(request.query_params.get("hold", "0")))
+        return PlainTextResponse("2")
+
+    return stub
+
+
+def proxy_with_stub_workers(monkeypatch, count=2):
+    workers = [
+        {"id": i, "url": f"http://node-{i}", "socket": None, "process": None, "supervisor": None, "log_pump": None,
+         "state": "running", "restarts": 0, "last_exit_code": None, "healthy": True, "outstanding": 0, "served": 0, "failures": 0}
+        for i in range(count)
+    ]
+    mounts = {w["url"]: httpx.ASGITransport(app=stub_node(w["id"])) for w in workers}
+    monkeypatch.setattr(server, "node_workers", workers)
+    monkeypatch.setattr(server, "socket_sessions", {})
+    monkeypatch.setattr(server, "upstream_client", httpx.AsyncClient(mounts=mounts))
+    monkeypatch.setattr(server, "longpoll_client", httpx.AsyncClient(mounts=mounts))
+    return workers, httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://proxy")
+
+
+def poll_params(**extra):
+    return {"EIO": "4", "transport": "polling", **extra}
+
+
+class TestStreamingProxy:
+    """Test streamed relaying and request body limits over ASGI against stub workers"""
+
+    def test_streamed_download_and_body_limits(self, monkeypatch):
+        """Downloads relay chunk by chunk; oversized bodies are a 413 by length or while streaming"""
+        workers, client = proxy_with_stub_workers(monkeypatch)
+        monkeypatch.setattr(server, "PROXY_MAX_BODY_BYTES", 1024)
+
+        async def chunks():
+            for _ in range(4):
+                yield b"x" * 512
+
+        async def run():
+            async with client:
+                download = await client.get("/api/files/report.bin")
+                declared = await client.post("/api/echo", content=b"x" * 2048)
+                chunked = await client.post("/api/echo", content=chunks())
+                small = await client.post("/api/echo", content=b"x" * 100)
+                return download, declared, chunked, small
+
+        download, declared, chunked, small = asyncio.run(run())
+        assert download.content == b"".join(bytes([i]) * 4096 for i in range(8))
+        assert "etag" not in download.headers and "content-length" not in download.headers
+        assert (declared.status_code, chunked.status_code) == (413, 413)
+        assert small.json() == {"bytes": 100}
+        assert [w["outstanding"] for w in workers] == [0, 0]
+
+
+class TestWebSocketTunnel:
+    """Test the socket.io WebSocket relay against a real upstream socket"""
+
+    def test_websocket_relay_and_close(self, monkeypatch):
+        """Frames relay both ways and an upstream close reaches the client"""
+        workers, _ = proxy_with_stub_workers(monkeypatch, count=1)
+        upstream_closed = asyncio.Event()
+
+        async def echo(connection):
+            async for message in connection:
+                if message == "bye":
+                    await connection.close()
+                    break
+                await connection.send(f"echo:{message}")
+            upstream_closed.set()
+
+        async def run():
+            async with websockets.asyncio.server.serve(echo, "127.0.0.1", 0) as upstream:
+                workers[0]["url"] = f"http://127.0.0.1:{upstream.sockets[0].getsockname()[1]}"
+                inbox, outbox = asyncio.Queue(), asyncio.Queue()
+                scope = {
+                    "type": "websocket", "path": "/api/socket.io/", "raw_path": b"/api/socket.io/", "root_path": "",
+                    "query_string": b"EIO=4&transport=websocket", "headers": [(b"host", b"proxy")], "scheme": "ws",
+                    "server": ("proxy", 80), "client": ("203.0.113.9", 5000), "subprotocols": [],
+                }
+                tunnel = asyncio.create_task(server.app(scope, inbox.get, outbox.put))
+                await inbox.put({"type": "websocket.connect"})
+                accepted = await outbox.get()
+                await inbox.put({"type": "websocket.receive", "text": "2probe"})
+                reply = await outbox.get()
+                await inbox.put({"type": "websocket.receive", "text": "bye"})
+                closed = await asyncio.wait_for(outbox.get(), 2)
+                await asyncio.wait_for(tunnel, 2)
+                await asyncio.wait_for(upstream_closed.wait(), 2)
+                return accepted, reply, closed
+
+        accepted, reply, closed = asyncio.run(run())
+        assert accepted["type"] == "websocket.accept"
+        assert reply["type"] == "websocket.send" and reply["text"] == "echo:2probe"
+        assert closed["type"] == "websocket.close"
+        assert server.ws_connections == {}
+
+
+class TestLongPollLane:
+    """Test the bounded lane Engine.IO long-polls run in"""
+
+    def test_full_lane_sheds_with_retry_after(self, monkeypatch):
+        """A poll that can't get a lane slot in time is a 503 with Retry-After"""
+        _, client = proxy_with_stub_workers(monkeypatch, count=1)
+        monkeypatch.setattr(server, "longpoll_slots", asyncio.Semaphore(1))
+        monkeypatch.setattr(server, "LONGPOLL_QUEUE_TIMEOUT", 0.05)
+
+        async def run():
+            async with client:
+                held = poll_params(sid="w0-held", hold="0.3")
+                return await asyncio.gather(client.get("/api/socket.io/", params=held), client.get("/api/socket.io/", params=held))
+
+        lane = asyncio.run(run())
+        assert sorted(r.status_code for r in lane) == [200, 503]
+        assert [r.headers.get("retry-after") for r in lane if r.status_code == 503] == ["1"]
+        assert server.longpoll_stats["in_flight"] == 0
+
+
+class TestWorkerBalancing:
+    """Test least-outstanding worker choice and Engine.IO sid stickiness"""
+
+    def test_least_outstanding_worker_is_picked(self, monkeypatch):
+        """Busy and unhealthy workers are passed over"""
+        workers, _ = proxy_with_stub_workers(monkeypatch, count=3)
+        workers[0]["outstanding"], workers[1]["healthy"] = 2, False
+        assert server.pick_node_worker() is workers[2]
+
+    def test_polls_follow_their_handshake(self, monkeypatch):
+        """Once a sid is known its polls go back to the worker that created it"""
+        _, client = proxy_with_stub_workers(monkeypatch)
+
+        async def run():
+            async with client:
+                handshake = await client.get("/api/socket.io/", params=poll_params())
+                sid = json.loads(handshake.text[1:])["sid"]
+                # The handshake's worker is now the busier one; polls still go back to it.
+                polls = [await client.get("/api/socket.io/", params=poll_params(sid=sid)) for _ in range(4)]
+                return sid, polls
+
+        sid, polls = asyncio.run(run())
+        assert [p.text for p in polls] == ["2"] * 4
+        assert server.socket_sessions[sid]["worker"] == int(sid[1])
+
+
+class TestSupervisor:
+    """Test restarting Node workers that exit or fail to start"""
+
+    def test_supervisor_restarts_crashes_and_failed_spawns(self, monkeypatch):
+        """A crashed worker is restarted with backoff, and a failed spawn is retried"""
+        worker = {"id": 0, "socket": None, "process": None, "state": "stopped", "restarts": 0, "last_exit_code": None, "healthy": True}
+        monkeypatch.setattr(server, "NODE_RESTART_BACKOFF_MIN", 0.001)
+        spawned = []
+
+        class Process:
+            def __init__(self, code):
+                self.code = code
+
+            async def wait(self):
+                if self.code is None:
+                    await asyncio.sleep(3600)
+                return self.code
+
+        async def spawn(w):
+            spawned.append(w["state"])
+            if len(spawned) == 2:
+                raise FileNotFoundError("node")
+            return Process(1 if len(spawned) == 1 else None)
+
+        async def run():
+            monkeypatch.setattr(server, "spawn_node_worker", spawn)
+            supervisor = asyncio.create_task(server.supervise_node_worker(worker))
+            while len(spawned) < 3:
+                await asyncio.sleep(0.01)
+            state = dict(worker)
+            supervisor.cancel()
+            await asyncio.gather(supervisor, return_exceptions=True)
+            return state
+
+        state = asyncio.run(run())
+        assert spawned == ["starting"] * 3
+        assert state["restarts"] == 1 and state["last_exit_code"] == 1
+        assert state["state"] == "starting" and not state["healthy"]
+
+
+def feed_pump(chunks):
+    async def run():
+        reader = asyncio.StreamReader()
+        for chunk in chunks:
+            reader.feed_data(chunk)
+        reader.feed_eof()
+        await node_logs.pump_node_output(reader, worker_id=7, pid=1234)
+    asyncio.run(run())
+
+
+class TestNodeLogs:
+    """Test draining Node output into the ring buffer"""
+
+    def setup_method(self):
+        node_logs.log_records.clear()
+
+    def test_lines_split_across_chunks(self):
+        """Lines spanning read boundaries are reassembled"""
+        feed_pump([b"MongoDB Con", b"nected\nServer running", b" on 3000\n"])
+        messages = [r["message"] for r in node_logs.query_logs(worker=7)]
+        assert messages == ["MongoDB Connected", "Server running on 3000"]
+
+    def test_levels_and_filters(self):
+        """Error lines are classified and filterable"""
+        feed_pump([b"Cron job error: boom\nNo pending notifications.\n"])
+        errors = node_logs.query_logs(level="error")
+        assert [r["message"] for r in errors] == ["Cron job error: boom"]
+        last_seq = node_logs.query_logs()[-1]["seq"]
+        assert node_logs.query_logs(since=last_seq) == []
+
+    def test_oversized_line_is_truncated(self):
+        """A line without newline larger than the limit is flushed, not held"""
+        feed_pump([b"x" * (node_logs.NODE_LOG_MAX_LINE * 2 + 10)])
+        records = node_logs.query_logs()
+        assert all(len(r["message"]) <= node_logs.NODE_LOG_MAX_LINE for r in records)
+        assert sum(len(r["message"]) for r in records) == node_logs.NODE_LOG_MAX_LINE * 2 + 10
+
+    def test_file_writer_drops_when_behind(self, tmp_path):
+        """A full queue drops and counts records instead of blocking the caller"""
+        logger = logging.getLogger("foratask.test")
+        logger.propagate = False
+        stats = {"dropped": 0}
+        listener = log_queue.start_file_writer(logger, tmp_path / "out.log", 1024, 1, 1, stats, "dropped")
+        listener.stop()
+        for i in range(3):
+            logger.info("line %d", i)
+        listener.start()
+        log_queue.stop_file_writer(logger, listener)
+        assert stats["dropped"] == 2 and logger.handlers == []
+        assert (tmp_path / "out.log").read_text() == "line 0\n"
+
+
+def bearer(claims, signature="sig"):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=")
+    return {"authorization": f"Bearer header.{payload}.{signature}"}
+
+
+class TestResponseCache:
+    """Test the per-user response cache"""
+
+    def setup_method(self):
+        for key in list(response_cache.entries):
+            response_cache.drop_entry(key)
+
+    def test_identity_from_token(self):
+        """Tenant comes from the company claim, subject from the whole token"""
+        alice = bearer({"id": "u1", "company": "c1"}, "a")
+        forged = bearer({"id": "u1", "company": "c1"}, "b")
+        assert tenant_of(alice) == tenant_of(forged) == "company:c1"
+        assert auth_subject(alice) != auth_subject(forged)
+        assert tenant_of({}) == "anonymous"
+
+    def test_query_order_is_normalized(self):
+        """Equivalent query strings share a cache entry"""
+        assert response_cache.cache_key("stats/x", "b=2&a=1", "s") == response_cache.cache_key("stats/x", "a=1&b=2", "s")
+
+    def test_lru_eviction_respects_byte_budget(self, monkeypatch):
+        """Least recently used entries go first once the budget is exceeded"""
+        monkeypatch.setattr(response_cache, "RESPONSE_CACHE_MAX_BYTES", 250)
+        for name in ("a", "b", "c"):
+            response_cache.cache_put((name,), "company:c1", 60, 200, {}, b"x" * 100)
+            if name == "b":
+                response_cache.cache_get(("a",))
+        assert response_cache.cache_get(("b",)) is None
+        assert response_cache.cache_get(("a",)) is not None
+        assert response_cache.cache_bytes <= 250
+
+    def test_mutation_invalidates_only_that_tenant(self):
+        """A write from one company leaves other companies cached"""
+        response_cache.cache_put(("one",), "company:c1", 60, 200, {}, b"1")
+        response_cache.cache_put(("two",), "company:c2", 60, 200, {}, b"2")
+        assert response_cache.invalidates_cache("PATCH", "task/updateStatus/1")
+        assert not response_cache.invalidates_cache("POST", "auth/login")
+        response_cache.invalidate_tenant("company:c1")
+        assert response_cache.cache_get(("one",)) is None
+        assert response_cache.cache_get(("two",)) is not None
+
+
+class TestETags:
+    """Test proxy-generated validators"""
+
+    def test_etag_is_strong_and_stable(self):
+        """Same body gives the same quoted strong ETag"""
+        etag = compute_etag(b'{"tasks":[]}')
+        assert etag == compute_etag(b'{"tasks":[]}')
+        assert etag.startswith('"') and not etag.startswith("W/")
+        assert etag != compute_etag(b'{"tasks":[1]}')
+
+    def test_if_none_match_comparison(self):
+        """Lists, weak forms and * all match per RFC 9110"""
+        etag = compute_etag(b"body")
+        assert etag_matches(f'"other", W/{etag}', etag)
+        assert etag_matches("*", etag)
+        assert etag_matches(f'"{etag[1:-1]}-gzip"', etag)
+        assert not etag_matches('"other"', etag)
+        assert not etag_matches(None, etag)
+
+    def test_only_small_json_gets_are_eligible(self):
+        """Binary, non-GET and oversized responses keep streaming"""
+        json_headers = {"content-type": "application/json; charset=utf-8"}
+        assert etag_eligible("GET", 200, json_headers, 512)
+        assert not etag_eligible("POST", 200, json_headers, 512)
+        assert not etag_eligible("GET", 200, {"content-type": "application/pdf"}, 512)
+        assert not etag_eligible("GET", 200, json_headers, None)
+
+    def test_not_modified_matches_the_compressed_variant(self):
+        """A 304 for a gzip client repeats the variant ETag and Vary, and no upstream Date"""
+        def get(headers):
+            scope = {"type": "http", "method": "GET", "path": "/api/tasks", "query_string": b"",
+                     "headers": [(k.encode(), v.encode()) for k, v in headers.items()]}
+            payload = {"tasks": [{"title": f"task {i}"} for i in range(200)]}
+            body = json.dumps(payload, separators=(",", ":")).encode()
+            return asyncio.run(server.local_json_response("tasks", Request(scope), payload, {"etag": compute_etag(body)}))
+
+        full = get({"accept-encoding": "gzip"})
+        assert full.headers["content-encoding"] == "gzip" and full.headers["etag"].endswith('-gzip"')
+        cached = get({"accept-encoding": "gzip", "if-none-match": full.headers["etag"]})
+        assert cached.status_code == 304
+        assert cached.headers["etag"] == full.headers["etag"]
+        assert cached.headers["vary"] == "Accept-Encoding"
+        assert "date" not in cached.headers
+        assert "date" not in server.proxy_response_headers(server.httpx.Response(200, headers={"date": "x"}), set())
+
+
+class TestCompression:
+    """Test Accept-Encoding negotiation and compression bookkeeping"""
+
+    def test_negotiation_honours_q_values(self):
+        """The highest q-value wins and br only breaks ties; q=0 excludes, wildcard allows"""
+        preferred = "br" if compression.brotli is not None else "gzip"
+        assert compression.choose_encoding("gzip, deflate, br") == preferred
+        assert compression.choose_encoding("br;q=0, gzip;q=0.5") == "gzip"
+        assert compression.choose_encoding("br;q=0.1, gzip") == "gzip"
+        assert compression.choose_encoding("gzip;q=0.5, br;q=0.9") == preferred
+        assert compression.choose_encoding("identity") is None
+        assert compression.choose_encoding("*") == preferred
+
+    def test_uploads_and_small_bodies_are_skipped(self):
+        """Attachments and tiny JSON pass through untouched"""
+        text = {"content-type": "text/csv"}
+        assert not compression.compression_candidate("uploads/report.csv", text, 50000)
+        assert not compression.compression_candidate("task/getTaskList", {"content-type": "application/json"}, 10)
+        assert compression.compression_candidate("task/getTaskList", {"content-type": "application/json"}, 50000)
+
+    def test_compress_for_records_ratio(self):
+        """Compressed output is smaller and is recorded per route"""
+        body = b'{"tasks": [' + b'{"status": "Pending"},' * 500 + b"{}]}"
+        headers = {"content-type": "application/json"}
+        out, encoding = asyncio.run(compression.compress_for("task/getTaskList", "task/getTaskList", "gzip", headers, body))
+        assert encoding == "gzip" and len(out) < len(body)
+        assert compression.compression_stats["task/getTaskList"]["bytes_in"] >= len(body)
+
+    def test_route_template_collapses_ids(self):
+        """ObjectIds and numbers become :id"""
+        assert route_template("task/getTask/65f0c1e2a9b8c7d6e5f4a3b2") == "task/getTask/:id"
+        assert route_template("/reports/monthly/2024/") == "reports/monthly/:id"
+        assert route_template("uploads/avatar-1700000000.png") == "uploads/:file"
+
+
+class TestUploads:
+    """Test serving /api/uploads straight from disk"""
+
+    def setup_method(self, method):
+        self.body = bytes(range(256)) * 40
+
+    def serve(self, tmp_path, monkeypatch, name, headers=None):
+        monkeypatch.setattr(uploads, "UPLOADS_DIR", str(tmp_path))
+        upload = tmp_path / "report-1700000000.pdf"
+        if not upload.exists():
+            upload.write_bytes(self.body)
+        return uploads.serve_upload(name, "GET", headers or {})
+
+    def test_traversal_is_rejected(self, tmp_path, monkeypatch):
+        """Paths escaping the upload directory are 404"""
+        (tmp_path.parent / "secret.txt").write_text("secret")
+        for name in ("../secret.txt", "a/../../secret.txt", "/etc/passwd", ""):
+            assert self.serve(tmp_path, monkeypatch, name).status_code == 404
+
+    def test_validators_and_cache_headers(self, tmp_path, monkeypatch):
+        """ETag / Last-Modified round-trip to 304"""
+        resp = self.serve(tmp_path, monkeypatch, "report-1700000000.pdf")
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/pdf"
+        assert "immutable" in resp.headers["cache-control"]
+        again = self.serve(tmp_path, monkeypatch, "report-1700000000.pdf", {"if-none-match": resp.headers["etag"]})
+        assert again.status_code == 304
+
+    def test_range_requests(self, tmp_path, monkeypatch):
+        """Single ranges give 206, impossible ones 416"""
+        resp = self.serve(tmp_path, monkeypatch, "report-1700000000.pdf", {"range": "bytes=100-199"})
+        assert resp.status_code == 206
+        assert resp.headers["content-range"] == f"bytes 100-199/{len(self.body)}"
+        assert uploads.parse_range("bytes=-10", 50) == (40, 49)
+        assert uploads.parse_range("bytes=0-1,5-6", 50) is None
+        assert uploads.parse_range("bytes=60-", 50) == "unsatisfiable"
+
+
+class TestSingleFlight:
+    """Test coalescing of identical concurrent GETs"""
+
+    def test_concurrent_callers_share_one_call(self):
+        """Ten waiters on one key trigger a single fetch"""
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 200, {}, b"{}"
+
+        async def run():
+            return await asyncio.gather(*(single_flight.single_flight("stats/x", ("k",), fetch) for _ in range(10)))
+
+        results = asyncio.run(run())
+        assert len(calls) == 1
+        assert all(r == (200, {}, b"{}") for r in results)
+        assert single_flight.flight_stats["stats/x"]["coalesced"] >= 9
+        assert single_flight.in_flight == {}
+
+    def test_errors_reach_every_waiter(self):
+        """A failed upstream call fails all callers, then the key is free"""
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        async def run():
+            return await asyncio.gather(
+                *(single_flight.single_flight("stats/y", ("e",), fetch) for _ in range(3)), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert ("e",) not in single_flight.in_flight
+
+    def test_allowlist(self):
+        """Only configured prefixes are coalesced"""
+        assert single_flight.single_flight_enabled_for("task/getTaskList")
+        assert not single_flight.single_flight_enabled_for("task/65f0c1e2a9b8c7d6e5f4a3b2")
+
+
+class TestAdmission:
+    """Test per-tenant token buckets and concurrency limits"""
+
+    def setup_method(self):
+        admission.tenant_states.clear()
+
+    def test_route_classes(self):
+        """Reports and master-admin analytics are heavy, writes are separate"""
+        assert admission.route_class("GET", "reports/admin-report-summary") == "heavy"
+        assert admission.route_class("GET", "master-admin/analytics/revenue") == "heavy"
+        assert admission.route_class("POST", "task/create") == "write"
+        assert admission.route_class("GET", "task/getTaskList") == "read"
+
+    def test_burst_then_shed_with_retry_after(self, monkeypatch):
+        """Past the burst and queue deadline requests are shed"""
+        monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+        monkeypatch.setitem(admission.class_limits, "heavy", {"rate": 0.1, "burst": 2, "concurrency": 5})
+
+        async def run():
+            outcomes = []
+            for _ in range(3):
+                try:
+                    async with admission.admission_slot("company:big", "heavy"):
+                        outcomes.append("ok")
+                except admission.AdmissionRejected as exc:
+                    outcomes.append(exc.retry_after)
+            return outcomes
+
+        outcomes = asyncio.run(run())
+        assert outcomes[:2] == ["ok", "ok"]
+        assert isinstance(outcomes[2], int) and outcomes[2] >= 1
+
+    def test_tenants_are_isolated(self, monkeypatch):
+        """One tenant's exhausted bucket doesn't affect another"""
+        monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+        monkeypatch.setitem(admission.class_limits, "heavy", {"rate": 0.1, "burst": 1, "concurrency": 5})
+
+        async def run():
+            async with admission.admission_slot("company:big", "heavy"):
+                pass
+            async with admission.admission_slot("company:small", "heavy"):
+                return "ok"
+
+        assert asyncio.run(run()) == "ok"
+
+    def test_buckets_follow_verified_tokens_only(self, monkeypatch):
+        """A forged company claim is charged to the caller's address, not the company"""
+        def tenant(headers):
+            scope = {"type": "http", "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+                     "client": ("203.0.113.9", 5000)}
+            return server.admission_tenant(Request(scope))
+
+        signed = {"authorization": f"Bearer {jwt.encode({'id': 'u1', 'company': 'c1'}, 'a' * 32, algorithm='HS256')}"}
+        forged = {**bearer({"id": "u2", "company": "c1"}), "x-forwarded-for": "198.51.100.1"}
+        monkeypatch.setattr(request_identity, "JWT_SECRET", "")
+        assert tenant(signed) == tenant(forged) == "ip:203.0.113.9"
+        monkeypatch.setattr(request_identity, "JWT_SECRET", "a" * 32)
+        assert tenant(signed) == "company:c1"
+        assert tenant(forged) == "ip:203.0.113.9"
+
+    def test_disabled_admission_skips_tenant_lookup(self, monkeypatch):
+        """With admission off no token is decoded to pick a bucket"""
+        def verified_tenant(headers):
+            raise AssertionError("tenant resolved while admission is disabled")
+
+        async def call():
+            return "called"
+
+        monkeypatch.setattr(server, "verified_tenant", verified_tenant)
+        request = Request({"type": "http", "method": "GET", "headers": [], "client": ("203.0.113.9", 5000)})
+        assert asyncio.run(server.admitted("task/getTaskList", request, call)) == "called"
+
+    def test_health_names_no_tenants_or_endpoints(self, monkeypatch):
+        """Tenant ids and worker addresses are only on the admin status route"""
+        monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+        monkeypatch.setattr(server, "PROXY_ADMIN_TOKEN", "admin")
+        admission.tenant_state("company:c1", "read")["in_flight"] = 1
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+                health = await client.get("/health")
+                anonymous = await client.get("/api/_proxy/status")
+                status = await client.get("/api/_proxy/status", headers={"x-admin-token": "admin"})
+                return health, anonymous, status
+
+        health, anonymous, status = asyncio.run(run())
+        assert "company:c1" not in health.text and "127.0.0.1" not in health.text
+        assert health.json()["admission"]["busy"] == 1
+        assert anonymous.status_code == 403
+        assert status.json()["admission_busiest"][0]["tenant"] == "company:c1"
+
+    def test_cache_hits_and_followers_take_no_tokens(self, monkeypatch):
+        """Only the request that reaches Node is admitted"""
+        monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+        monkeypatch.setitem(admission.class_limits, "read", {"rate": 0.01, "burst": 1, "concurrency": 1})
+        calls = []
+
+        async def upstream(path, request, client, worker, shared=False):
+            calls.append(path)
+            await asyncio.sleep(0.02)
+            return server.Response(content=b'{"tasks":[]}', media_type="application/json")
+
+        monkeypatch.setattr(server, "buffered_proxy", upstream)
+        scope = {"type": "http", "method": "GET", "path": "/api/task/getTaskList", "query_string": b"",
+                 "headers": [], "client": ("203.0.113.9", 5000)}
+
+        async def run():
+            followers = await asyncio.gather(*(server.coalesced_proxy("task/getTaskList", Request(scope)) for _ in range(4)))
+            response_cache.cache_put(response_cache.cache_key("stats/x", "", "anonymous"), "anonymous", 60, 200, {}, b"{}")
+            hits = [await server.cached_proxy("stats/x", Request(scope), 60) for _ in range(3)]
+            return followers, hits
+
+        followers, hits = asyncio.run(run())
+        assert [r.status_code for r in followers] == [200] * 4 and calls == ["task/getTaskList"]
+        assert [r.headers["x-proxy-cache"] for r in hits] == ["HIT"] * 3
+        assert [key for key in admission.tenant_states] == [("ip:203.0.113.9", "read")]
+
+
+class TestMetrics:
+    """Test request counters, latency histograms and the text exposition"""
+
+    def setup_method(self):
+        metrics.request_counts.clear()
+        metrics.known_routes.clear()
+        for series in metrics.histograms.values():
+            series.clear()
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Each observation lands in its bucket and every bucket above it"""
+        metrics.record_request("task/:id", "GET", 200, 0.2, 0.15)
+        metrics.record_request("task/:id", "GET", 200, 3.0, 0.0)
+        text = metrics.render_metrics()
+        assert 'proxy_requests_total{route="task/:id",method="GET",status="200"} 2' in text
+        assert 'proxy_request_duration_seconds_bucket{route="task/:id",le="0.1"} 0' in text
+        assert 'proxy_request_duration_seconds_bucket{route="task/:id",le="0.25"} 1' in text
+        assert 'proxy_request_duration_seconds_bucket{route="task/:id",le="+Inf"} 2' in text
+        assert 'proxy_upstream_duration_seconds_count{route="task/:id"} 1' in text
+        assert 'proxy_overhead_seconds_count{route="task/:id"} 2' in text
+
+    def test_route_cardinality_is_capped(self, monkeypatch):
+        """Routes past the cap share the "other" label"""
+        monkeypatch.setattr(metrics, "METRICS_MAX_ROUTES", 2)
+        labels = [metrics.route_label(path) for path in ("task/a", "stats/b", "scan/c", "task/a")]
+        assert labels == ["task/a", "stats/b", "other", "task/a"]
+
+    def test_middleware_reads_upstream_time_from_state(self):
+        """The middleware records status and the handler's upstream time"""
+        async def app(scope, receive, send):
+            scope["state"]["upstream_seconds"] = 0.05
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "path": "/api/task/65f0c1e2a9b8c7d6e5f4a3b2", "method": "GET", "state": {}}
+        asyncio.run(metrics.MetricsMiddleware(app)(scope, None, send))
+        assert metrics.request_counts[("task/:id", "GET", 404)] == 1
+        assert metrics.histograms["proxy_upstream_duration_seconds"]["task/:id"][1] == 0.05
+        assert metrics.gauges["in_flight"] == 0
+
+
+class TestRequestTiming:
+    """Test request id propagation, Server-Timing and the slow-request log"""
+
+    def test_request_id_is_kept_or_assigned(self):
+        """A well-formed incoming id is kept, anything else is replaced"""
+        assert request_timing.request_id_from([(b"x-request-id", b"lb-1234")]) == "lb-1234"
+        assigned = request_timing.request_id_from([(b"x-request-id", b"bad id\r\nx: y")])
+        assert len(assigned) == 32 and assigned.isalnum()
+
+    def test_server_timing_lists_measured_phases(self):
+        """Only phases that happened are reported, in milliseconds"""
+        header = request_timing.server_timing({"ttfb": 0.0421, "queue": 0.001}, 0.05)
+        assert header == "queue;dur=1.0, ttfb;dur=42.1, total;dur=50.0"
+
+    def test_middleware_sets_headers_and_logs_slow_requests(self, monkeypatch, caplog):
+        """Responses carry the id and timings; slow ones are logged as JSON"""
+        monkeypatch.setattr(request_timing, "SLOW_REQUEST_SECONDS", 0)
+        sent = []
+
+        async def app(scope, receive, send):
+            request_timing.add_phase(scope["state"]["timings"], "ttfb", 0.02)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"{}"})
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "path": "/api/task/getTaskList", "method": "GET", "headers": [(b"x-request-id", b"abc")]}
+        with caplog.at_level("WARNING", logger="foratask.slow_requests"):
+            asyncio.run(request_timing.RequestTimingMiddleware(app)(scope, None, send))
+        headers = dict(sent[0]["headers"])
+        assert headers[b"x-request-id"] == b"abc"
+        assert headers[b"server-timing"].startswith(b"ttfb;dur=20.0, total;dur=")
+        record = json.loads(caplog.records[-1].getMessage())
+        assert record["request_id"] == "abc" and record["route"] == "task/getTaskList" and record["ttfb_ms"] == 20.0
+
+
+class TestLoadBenchmark:
+    """Test the benchmark load generator and baseline comparison"""
+
+    def test_percentiles_use_nearest_rank(self):
+        """p50/p99 of 1..100 are the 50th and 99th values"""
+        values = list(range(1, 101))
+        assert proxy_bench.percentile(values, 50) == 50
+        assert proxy_bench.percentile(values, 99) == 99
+        assert proxy_bench.percentile([], 95) == 0.0
+
+    def test_open_loop_keeps_the_schedule(self):
+        """At a fixed rate the generator offers rps * duration requests"""
+        async def send(user):
+            await asyncio.sleep(0.01)
+            return 200
+
+        samples = asyncio.run(proxy_bench.run_load(send, concurrency=5, duration=0.5, rps=40))
+        summary = proxy_bench.summarize(samples, 0.5)
+        assert 18 <= summary["requests"] <= 21
+        assert summary["errors"] == 0 and summary["statuses"] == {"200": summary["requests"]}
+
+    def test_regressions_against_baseline(self):
+        """Slower p95, lower throughput and new errors are all flagged"""
+        baseline = [{"scenario": "tasks", "p95_ms": 10.0, "rps": 1000.0, "errors": 0}]
+        current = [{"scenario": "tasks", "p95_ms": 15.0, "rps": 700.0, "errors": 2}]
+        assert len(proxy_bench.find_regressions(current, baseline, 0.2)) == 3
+        assert proxy_bench.find_regressions(baseline, baseline, 0.2) == []
+
+
+class TestTrafficCapture:
+    """Test capture anonymization and how replay rebuilds requests"""
+
+    def setup_method(self):
+        traffic_capture.capture_state.update(started=1000.0, salt=b"0" * 16)
+
+    def test_query_keeps_shape_but_not_identities(self):
+        """Pagination and enum filters survive; ids and free text don't"""
+        query = traffic_capture.anonymize_query(
+            "page=2&isSelfTask=true&status=pending&search=Asha%20Patel&userId=65f0c1e2a9b8c7d6e5f4a3b2&name=asha"
+        )
+        values = dict(query)
+        assert values["page"] == "2" and values["isSelfTask"] == "true" and values["status"] == "pending"
+        assert values["userId"] == ":id"
+        assert values["search"].startswith("~") and values["name"].startswith("~")
+        assert traffic_capture.anonymize_query("search=Asha%20Patel") == [["search", values["search"]]]
+
+    def test_record_has_no_raw_path_or_token(self):
+        """Records carry route templates and pseudonyms only"""
+        token = b"Bearer x.eyJpZCI6IjEiLCJjb21wYW55IjoiYWNtZSJ9.sig"
+        scope = {
+            "method": "GET",
+            "path": "/api/task/65f0c1e2a9b8c7d6e5f4a3b2",
+            "query_string": b"",
+            "headers": [(b"authorization", token)],
+        }
+        record = traffic_capture.capture_record(scope, 200, 0, 512, 1001.5, 0.0123)
+        assert record["route"] == "task/:id" and record["t"] == 1.5 and record["ms"] == 12.3
+        assert "65f0c1e2" not in json.dumps(record) and "acme" not in json.dumps(record)
+
+    def test_replay_rebuilds_requests(self):
+        """Ids are substituted, uploads need a file and writes keep their size"""
+        record = {"route": "task/:id/history", "query": [["userId", ":id"], ["page", "1"]]}
+        assert replay.replay_path(record, "a" * 24) == f"/api/task/{'a' * 24}/history"
+        assert replay.replay_query(record, "a" * 24) == [("userId", "a" * 24), ("page", "1")]
+        assert replay.replay_path({"route": "uploads/:file"}, "a" * 24) is None
+        assert len(replay.write_body(300)) == 300
+
+
+class TestBatch:
+    """Test batch parsing, dependency ordering, concurrency and deadlines"""
+
+    def test_parse_normalizes_and_rejects(self):
+        """Paths are made relative to /api; cycles and long-polls are refused"""
+        items, deadline = batch.parse_batch({
+            "requests": [{"id": "s", "path": "/api/stats/tasks-summary?x=1", "query": {"y": 2}}],
+            "deadline_ms": 2500,
+        })
+        assert items[0]["path"] == "stats/tasks-summary" and items[0]["query"] == "x=1&y=2" and deadline == 2.5
+        for payload in (
+            {"requests": [{"path": "socket.io/"}]},
+            {"requests": [{"path": "../admin"}]},
+            {"requests": [{"id": "a", "path": "x", "depends_on": "b"}, {"id": "b", "path": "y", "depends_on": "a"}]},
+            {"requests": [{"path": "x"}] * (batch.BATCH_MAX_ITEMS + 1)},
+        ):
+            with pytest.raises(RequestError):
+                batch.parse_batch(payload)
+
+    def test_dependencies_and_concurrency_cap(self):
+        """Dependents wait, failures cascade as 424 and the cap is respected"""
+        items, _ = batch.parse_batch({"requests": [
+            {"id": "a", "path": "task/a"},
+            {"id": "b", "path": "task/b", "depends_on": "a"},
+            {"id": "bad", "path": "task/missing"},
+            {"id": "c", "path": "task/c", "depends_on": ["bad"]},
+            {"id": "d", "path": "task/d"},
+        ]})
+        order, running = [], {"now": 0, "peak": 0}
+
+        async def execute(item):
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+            order.append(item["id"])
+            return {"id": item["id"], "status": 404 if item["id"] == "bad" else 200}
+
+        results = asyncio.run(batch.run_batch(items, execute, deadline=1, max_concurrency=2))
+        assert [r["status"] for r in results] == [200, 200, 404, 424, 200]
+        assert order.index("a") < order.index("b") and "c" not in order
+        assert running["peak"] <= 2
+
+    def test_deadline_cancels_stragglers(self):
+        """Items still running at the deadline come back as 504"""
+        items, _ = batch.parse_batch({"requests": [{"id": "fast", "path": "a"}, {"id": "slow", "path": "b"}]})
+
+        async def execute(item):
+            await asyncio.sleep(0 if item["id"] == "fast" else 5)
+            return {"id": item["id"], "status": 200}
+
+        results = asyncio.run(batch.run_batch(items, execute, deadline=0.05))
+        assert [r["status"] for r in results] == [200, 504]
+
+    def test_items_are_routed_and_chunked_bodies_are_bounded(self, monkeypatch):
+        """Items reach proxy-owned routes, and a chunked body over the limit is a 413"""
+        monkeypatch.setattr(server, "BATCH_MAX_BODY_BYTES", 1024)
+        monkeypatch.setattr(server, "GEOFENCE_ENABLED", False)
+
+        async def chunks():
+            for _ in range(4):
+                yield b" " * 512
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+                routed = await client.post("/api/batch", json={"requests": [
+                    {"id": "fence", "method": "POST", "path": "geofence/check", "body": {}},
+                ]})
+                invalid = await client.post("/api/batch", json={"requests": "all"})
+                return routed, invalid, await client.post("/api/batch", content=chunks())
+
+        routed, invalid, chunked = asyncio.run(run())
+        assert (invalid.status_code, invalid.json()) == (400, {"detail": 'Expected {"requests": [...]}'})
+        assert routed.json()["responses"][0]["status"] == 503
+        assert routed.json()["responses"][0]["body"] == {"detail": "Geofence checks are not configured"}
+        assert chunked.status_code == 413
+        for path in ("notifications/stream", "exports/tasks"):
+            with pytest.raises(RequestError):
+                batch.parse_batch({"requests": [{"path": path}]})
+
+    def test_deadline_releases_the_worker(self, monkeypatch):
+        """An item cut off by the deadline gives its worker slot back"""
+        workers, client = proxy_with_stub_workers(monkeypatch, count=1)
+
+        async def run():
+            async with client:
+                return await client.post("/api/batch", json={"deadline_ms": 50, "requests": [{"id": "slow", "path": "slow"}]})
+
+        response = asyncio.run(run())
+        assert response.json()["responses"][0]["status"] == 504
+        assert workers[0]["outstanding"] == 0
+
+
+class TestNotificationStream:
+    """Test SSE framing, per-user fan-out, resume and bounded buffers"""
+
+    def setup_method(self):
+        notification_stream.subscribers.clear()
+
+    def test_sse_framing(self):
+        """Multi-line data is split into data: lines after id and event"""
+        assert notification_stream.sse_event("notification", "a\nb", "42") == "id: 42\nevent: notification\ndata: a\ndata: b\n\n"
+
+    def test_stream_tickets_are_single_use_and_expire(self, monkeypatch):
+        """The URL carries a ticket that redeems once for the token, never the token itself"""
+        monkeypatch.setattr(notification_stream, "stream_tickets", {})
+        ticket = notification_stream.issue_stream_ticket("jwt-token", "u1")
+        assert "jwt-token" not in ticket
+        assert notification_stream.redeem_stream_ticket(ticket) == "jwt-token"
+        assert notification_stream.redeem_stream_ticket(ticket) is None
+        monkeypatch.setattr(notification_stream, "NOTIFY_TICKET_TTL", -1)
+        assert notification_stream.redeem_stream_ticket(notification_stream.issue_stream_ticket("jwt-token", "u1")) is None
+        monkeypatch.setattr(notification_stream, "NOTIFY_MAX_TICKETS", 0)
+        assert notification_stream.issue_stream_ticket("jwt-token", "u1") is None
+
+    def test_tickets_need_a_valid_token_and_are_capped_per_user(self, monkeypatch):
+        """Forged tokens get no ticket, and one user can't hold more than a few"""
+        monkeypatch.setattr(notification_stream, "stream_tickets", {})
+        monkeypatch.setattr(notification_stream, "NOTIFY_MAX_TICKETS_PER_USER", 2)
+        monkeypatch.setattr(server, "MONGO_URI", "mongodb://test")
+        monkeypatch.setattr(server, "JWT_SECRET", "a" * 32)
+        monkeypatch.setattr(request_identity, "JWT_SECRET", "a" * 32)
+        token = jwt.encode({"id": str(ObjectId())}, "a" * 32, algorithm="HS256")
+        forged = jwt.encode({"id": str(ObjectId())}, "b" * 32, algorithm="HS256")
+
+        async def run():
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+                return [
+                    (await client.post("/api/notifications/stream-ticket", headers={"authorization": f"Bearer {t}"})).status_code
+                    for t in (forged, token, token, token)
+                ]
+
+        assert asyncio.run(run()) == [401, 200, 200, 429]
+        assert len(notification_stream.stream_tickets) == 2
+
+    def test_resume_skips_replayed_and_other_users(self, monkeypatch):
+        """Catch-up comes from Mongo; the same document arriving live is not sent twice"""
+        user, other = ObjectId(), ObjectId()
+        missed = {"_id": ObjectId(), "userId": user, "message": "missed"}
+        fresh = {"_id": ObjectId(), "userId": user, "message": "fresh"}
+
+        async def missed_notifications(user_id, company, after):
+            return [missed]
+
+        async def unread_count(user_id, company):
+            return 2
+
+        monkeypatch.setattr(notification_stream, "missed_notifications", missed_notifications)
+        monkeypatch.setattr(notification_stream, "unread_count", unread_count)
+
+        async def run():
+            stream = notification_stream.notification_events(str(user), "", str(ObjectId()), 1)
+            chunks = [await stream.__anext__() for _ in range(3)]
+            for doc in (missed, {"_id": ObjectId(), "userId": other, "message": "not yours"}, fresh):
+                notification_stream.publish(doc)
+            chunks += [await stream.__anext__() for _ in range(2)]
+            await stream.aclose()
+            return chunks
+
+        chunks = asyncio.run(run())
+        assert chunks[1] == 'event: unread\ndata: {"count": 1}\n\n'
+        assert '"missed"' in chunks[2] and '"fresh"' in chunks[3]
+        assert chunks[4] == 'event: unread\ndata: {"count": 2}\n\n'
+        assert notification_stream.subscribers == {}
+
+    def test_reads_push_a_recount(self, monkeypatch):
+        """isRead updates from the change stream reach the user's streams as one recount"""
+        user = ObjectId()
+        changes = [
+            {"operationType": "update", "fullDocument": {"_id": ObjectId(), "userId": user, "isRead": True}}
+            for _ in range(3)
+        ]
+
+        class ChangeStream:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def __aiter__(self):
+                for change in changes:
+                    yield change
+
+        class Collection:
+            def watch(self, pipeline, full_document=None):
+                assert full_document == "updateLookup"
+                return ChangeStream()
+
+        async def unread_count(user_id, company):
+            return 0
+
+        monkeypatch.setattr(notification_stream, "unread_count", unread_count)
+
+        async def run():
+            stream = notification_stream.notification_events(str(user), "", None, 3)
+            chunks = [await stream.__anext__() for _ in range(2)]
+            await notification_stream.watch_change_stream(Collection())
+            chunks.append(await stream.__anext__())
+            await stream.aclose()
+            return chunks
+
+        chunks = asyncio.run(run())
+        assert chunks[1:] == ['event: unread\ndata: {"count": 3}\n\n', 'event: unread\ndata: {"count": 0}\n\n']
+
+    def test_slow_client_is_cut_off(self, monkeypatch):
+        """A full buffer is dropped and the stream ends so the client resumes"""
+        monkeypatch.setattr(notification_stream, "NOTIFY_CLIENT_BUFFER", 2)
+        user = ObjectId()
+
+        async def run():
+            stream = notification_stream.notification_events(str(user), "", None, 0)
+            await stream.__anext__()
+            await stream.__anext__()
+            for _ in range(3):
+                notification_stream.publish({"_id": ObjectId(), "userId": user})
+            return [chunk async for chunk in stream]
+
+        assert asyncio.run(run()) == []
+        assert notification_stream.stream_stats["overflowed"] >= 1
+        assert notification_stream.subscribers == {}
+
+
+class FakeRollups:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def find(self, query, projection=None):
+        for doc in self.docs:
+            if all(doc.get(k) == v for k, v in query.items()):
+                yield doc
+
+
+def rollup_docs(tasks):
+    docs = {}
+    for task in tasks:
+        for key, fields in task_stats.rollup_keys(task):
+            doc = docs.setdefault(key, {**fields, "counts": {}})
+            bucket = task_stats.count_bucket(task)
+            doc["counts"][bucket] = doc["counts"].get(bucket, 0) + 1
+    return list(docs.values())
+
+
+class TestTaskStats:
+    """Test rollup keys and the dashboard stats computed from them"""
+
+    def test_team_task_counts_once_per_member(self):
+        """A team task lands in the company rollup and once for each distinct member"""
+        company, creator, observer = ObjectId(), ObjectId(), ObjectId()
+        task = {
+            "company": company, "isSelfTask": False, "createdBy": creator,
+            "assignees": [creator], "observers": [observer], "status": "Pending", "priority": "Low",
+            "dueDateTime": datetime(2026, 3, 4, 10, tzinfo=timezone.utc), "createdAt": datetime(2026, 1, 2, tzinfo=timezone.utc),
+        }
+        months = [fields for _, fields in task_stats.rollup_keys(task) if fields["period"] == "month"]
+        assert sorted((f["scope"], f["user"], f["observer"]) for f in months) == sorted(
+            [("team", None, False), ("member", creator, False), ("member", observer, True)], key=str
+        )
+        assert {(f["year"], f["month"]) for f in months} == {(2026, 3)}
+
+    def test_end_of_day_due_date_is_never_today(self):
+        """Node's today window ends just before 23:59:59.999 UTC"""
+        assert task_stats.due_day(datetime(2026, 3, 4, 23, 59, 59, 998000, tzinfo=timezone.utc)) == "2026-03-04"
+        assert task_stats.due_day(datetime(2026, 3, 4, 23, 59, 59, 999000, tzinfo=timezone.utc)) is None
+
+    def test_reads_follow_node_semantics(self, monkeypatch):
+        """Members count For Approval as done, except on tasks they observe"""
+        company, user, boss = ObjectId(), ObjectId(), ObjectId()
+        due = datetime(2026, 5, 1, 9, tzinfo=timezone.utc)
+
+        def task(status, observers=(), created=datetime(2026, 1, 5, tzinfo=timezone.utc)):
+            return {
+                "company": company, "isSelfTask": False, "createdBy": boss, "assignees": [user],
+                "observers": list(observers), "status": status, "priority": "High", "dueDateTime": due, "createdAt": created,
+            }
+
+        tasks = [
+            task("Completed"), task("For Approval"), task("For Approval", observers=[user]), task("Overdue"),
+            task("Completed", created=datetime(2025, 12, 31, tzinfo=timezone.utc)),
+        ]
+        monkeypatch.setattr(task_stats, "rollups_collection", lambda: FakeRollups(rollup_docs(tasks)))
+        member = asyncio.run(task_stats.tasks_summary(company, user, False, False, "2026-05-01"))
+        admin = asyncio.run(task_stats.tasks_summary(company, boss, True, False, "2026-05-01"))
+        assert (member["allTimeTotalTasks"], member["allTimeCompletedTasks"], member["allTimeOverdueTasks"]) == (5, 3, 1)
+        assert admin["allTimeCompletedTasks"] == 2
+        assert (member["todayhighPriority"], member["todayoverduePriority"]) == (4, 1)
+        graph = asyncio.run(task_stats.statistics_graph(company, user, False, False, 2026))
+        assert graph[4] == {"month": 5, "completed": 3, "incomplete": 1}
+        assert sum(m["completed"] + m["incomplete"] for m in graph) == 4
+
+    def test_only_verified_tokens_are_answered_locally(self, monkeypatch):
+        """Tokens are checked against JWT_SECRET; without it nothing verifies"""
+        token = jwt.encode({"id": "u1", "company": "c1"}, "a" * 32, algorithm="HS256")
+        headers = {"authorization": f"Bearer {token}"}
+        monkeypatch.setattr(request_identity, "JWT_SECRET", "")
+        assert request_identity.verified_claims(headers) is None
+        monkeypatch.setattr(request_identity, "JWT_SECRET", "a" * 32)
+        assert request_identity.verified_claims(headers)["company"] == "c1"
+        monkeypatch.setattr(request_identity, "JWT_SECRET", "b" * 32)
+        assert request_identity.verified_claims(headers) is None
+
+
+def platform_frames(now):
+    company, other, paid, trial = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+    companies = [
+        {"_id": company, "companyName": "Acme (India)", "companyEmail": "ops@acme.in", "createdAt": now, "isActive": True, "subscription": paid},
+        {"_id": other, "companyName": "Beta", "companyEmail": "hi@beta.io", "createdAt": now, "isActive": False, "subscription": trial},
+    ]
+    subscriptions = [
+        {"_id": paid, "company": company, "status": "active", "planType": "paid", "currentUserCount": 8, "trialStartDate": now},
+        {"_id": trial, "company": other, "status": "trial", "currentUserCount": 2, "trialStartDate": now,
+         "trialEndDate": now + platform_snapshot.timedelta(days=3)},
+    ]
+    payments = [
+        {"_id": ObjectId(), "company": company, "amount": 399, "status": "success", "createdAt": now, "invoiceNumber": "INV-1"},
+        {"_id": ObjectId(), "company": company, "amount": 99.5, "status": "success", "createdAt": datetime(2020, 1, 5, tzinfo=timezone.utc)},
+        {"_id": ObjectId(), "company": other, "amount": 249, "status": "failed", "createdAt": now},
+    ]
+    return (
+        platform_snapshot.frame(companies, platform_snapshot.COMPANY_FIELDS),
+        platform_snapshot.frame(subscriptions, platform_snapshot.SUBSCRIPTION_FIELDS),
+        platform_snapshot.frame(payments, platform_snapshot.PAYMENT_FIELDS),
+    )
+
+
+class TestPlatformSnapshot:
+    """Test the master-admin snapshot figures and the reads served from it"""
+
+    def test_dashboard_figures_match_controller(self):
+        """MRR uses calculateAmount() and rates round like toFixed(1)"""
+        now = datetime.now(timezone.utc)
+        snapshot, _ = platform_snapshot.build_snapshot(*platform_frames(now), {}, 7, now)
+        stats = snapshot["stats"]
+        assert stats["mrr"] == 249 + 3 * 50
+        assert stats["subscriptions"] == {"trial": 1, "active": 1, "expired": 0, "cancelled": 0}
+        assert (stats["totalCompanies"], stats["totalUsers"], stats["failedPayments"]) == (1, 7, 1)
+        assert stats["conversionRate"] == 50 and stats["revenueThisMonth"] == 399
+        assert stats["recentPayments"][0] == {
+            "id": stats["recentPayments"][0]["id"], "company": "Acme (India)", "amount": 399,
+            "date": platform_snapshot.jsonable(now), "invoiceNumber": "INV-1",
+        }
+        assert "invoiceNumber" not in stats["recentPayments"][1]
+        assert [t["daysLeft"] for t in stats["trialExpirations"]] == [3]
+        assert platform_snapshot.to_fixed(12.25) == 12.3
+
+    def test_reads_from_snapshot(self, monkeypatch):
+        """Plain searches and paging match getCompanies(), the rest and old months fall back"""
+        now = datetime.now(timezone.utc)
+        snapshot, listing = platform_snapshot.build_snapshot(*platform_frames(now), {}, 7, now)
+        monkeypatch.setitem(platform_snapshot.snapshot_state, "snapshot", snapshot)
+        monkeypatch.setitem(platform_snapshot.snapshot_state, "companies", listing)
+        monkeypatch.setitem(platform_snapshot.snapshot_state, "built", platform_snapshot.time.time())
+        found = platform_snapshot.companies_payload({"search": "INDIA", "status": "active", "limit": "x"})
+        assert [c["companyName"] for c in found["companies"]] == ["Acme (India)"]
+        assert found["pagination"] == {"total": 1, "page": 0, "limit": 20, "totalPages": 1}
+        assert found["companies"][0]["subscription"]["totalAmount"] == 399
+        # The status filter runs on the page, after the total is counted.
+        trial = platform_snapshot.companies_payload({"status": "trial"})
+        assert trial["companies"] == [] and trial["pagination"]["total"] == 1
+        assert platform_snapshot.companies_payload({"search": "(INDIA)"}) is None
+        assert platform_snapshot.companies_payload(QueryParams("page=1&page=2")) is None
+        assert platform_snapshot.companies_payload(QueryParams("search[$ne]=x")) is None
+        revenue = platform_snapshot.revenue_payload({"months": "2"})
+        assert [m["revenue"] for m in revenue["analytics"]] == [399]
+        assert platform_snapshot.revenue_payload({"months": "120"}) is None
+        monkeypatch.setitem(platform_snapshot.snapshot_state, "built", 0.0)
+        assert platform_snapshot.dashboard_payload({}) is None
+
+    def test_no_payments_and_failed_builds(self, monkeypatch):
+        """A platform without payments builds, and a failed build doesn't end the loop"""
+        now = datetime.now(timezone.utc)
+        companies, subscriptions, _ = platform_frames(now)
+        payments = platform_snapshot.frame([], platform_snapshot.PAYMENT_FIELDS)
+        snapshot, _ = platform_snapshot.build_snapshot(companies, subscriptions, payments, {}, 1, now)
+        assert snapshot["stats"]["topTenants"] == [] and snapshot["stats"]["revenueThisMonth"] == 0
+        assert snapshot["revenueByMonth"] == []
+
+        builds = []
+
+        async def refresh():
+            builds.append(len(builds))
+            raise TypeError("bad frame")
+
+        async def run():
+            platform_snapshot.snapshot_state["refresh"] = asyncio.Event()
+            task = asyncio.create_task(platform_snapshot.run_platform_snapshots())
+            await asyncio.sleep(0.05)
+            alive = not task.done()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return alive
+
+        monkeypatch.setattr(platform_snapshot, "adopt_stored_snapshot", refresh)
+        monkeypatch.setattr(platform_snapshot, "refresh_snapshot", refresh)
+        monkeypatch.setattr(platform_snapshot, "PLATFORM_SNAPSHOT_MIN_GAP", 0.01)
+        monkeypatch.setattr(platform_snapshot, "PLATFORM_SNAPSHOT_INTERVAL", 0.01)
+        monkeypatch.setitem(platform_snapshot.snapshot_state, "errors", 0)
+        monkeypatch.setitem(platform_snapshot.snapshot_state, "refresh", None)
+        assert asyncio.run(run())
+        assert len(builds) >= 3 and platform_snapshot.snapshot_state["errors"] == len(builds) - 1
+
+
+class TestPayroll:
+    """Test the batch payroll engine against generateSalaryRecord's arithmetic"""
+
+    def test_record_matches_controller(self):
+        """Percent components, standard deductions, loss of pay and overtime"""
+        user = ObjectId()
+        config = {
+            "user": user, "basicSalary": 30000, "perHourSalary": 100,
+            "components": [
+                {"name": "HRA", "type": "earning", "amount": 40, "isPercentage": True},
+                {"name": "Travel", "type": "earning", "amount": 3000},
+                {"name": "Welfare", "type": "deduction", "amount": 2, "isPercentage": True},
+            ],
+            "standardDeductions": {"pf": {"enabled": True}, "professionalTax": {"enabled": True}},
+        }
+        day = datetime(2026, 2, 2, tzinfo=timezone.utc)
+        attendance = [{"user": user, "date": day, "status": "present", "workingHours": {"total": 480}}] * 18
+        attendance += [{"user": user, "date": day, "status": "half-day", "checkIn": {"isLate": True}}] * 2
+        attendance += [
+            {"user": user, "date": day, "status": "on-leave"},
+            {"user": user, "date": day, "status": "holiday", "workingHours": {"overtime": 120}},
+        ]
+        row = payroll.compute_payroll([config], attendance, None, 2026, 1).to_dict("records")[0]
+        # 22 default working days; 'on-leave' is not counted as paid leave,
+        # just as getMonthlyStats files it under "onleave".
+        assert (row["workingDays"], row["absentDays"], row["paidLeaveDays"], row["lateDays"]) == (22, 2, 0, 2)
+        assert row["grossSalary"] == 45000 and row["totalWorkingHours"] == 18 * 480
+        assert row["overtimePay"] == 2 * (100 * 1.5)
+        assert row["lossOfPay"] == 2 * (45000 / 22)
+        assert row["totalDeductions"] == 2 * (45000 / 22) + 3600 + 0 + 200 + 0 + 900
+        assert row["netSalary"] == 45300 - row["totalDeductions"]
+        assert [c["amount"] for c in row["earningComponents"]] == [12000, 3000]
+
+    def test_working_days_and_period(self):
+        """Holidays match by day and month, recurring ones in any year"""
+        settings = {
+            "workingDays": {"saturday": True},
+            "holidays": [
+                {"date": datetime(2020, 2, 3, tzinfo=timezone.utc), "isRecurringYearly": True},
+                {"date": datetime(2026, 2, 10, tzinfo=timezone.utc)},
+                {"date": datetime(2024, 2, 11, tzinfo=timezone.utc)},
+            ],
+        }
+        assert payroll.working_days_in_month(settings, 2026, 1) == 24 - 2
+        assert payroll.working_days_in_month({}, 2026, 1) == 20
+        assert payroll.month_bounds(2026, 11) == (datetime(2026, 12, 1, tzinfo=timezone.utc), datetime(2026, 12, 31, tzinfo=timezone.utc))
+        user = str(ObjectId())
+        assert payroll.parse_period({"month": 0, "year": 2026, "userIds": [user, user]}) == (0, 2026, [ObjectId(user)])
+        for body in ({"month": 12, "year": 2026}, {"month": "1", "year": 2026}, {"month": 1, "year": 2026, "userIds": ["x"]}, []):
+            with pytest.raises(RequestError):
+                payroll.parse_period(body)
+
+
+class TestGeofence:
+    """Test the geofence grid against OrganizationSettings.isWithinOfficeGeofence"""
+
+    def test_office_order_and_task_fences(self):
+        """The first office in settings order is reported; every fence is listed nearest first"""
+        big, near = ObjectId(), ObjectId()
+        offices = geofence.office_fences({"officeLocations": [
+            {"_id": big, "name": "Campus", "coordinates": {"latitude": 19.07, "longitude": 72.87}, "geofenceRadius": 800},
+            {"_id": near, "name": "Annex", "coordinates": {"latitude": 19.0711, "longitude": 72.87}},
+            {"_id": ObjectId(), "name": "Broken", "coordinates": {"latitude": None, "longitude": 72.0}},
+        ]})
+        task = {"_id": ObjectId(), "task": ObjectId(), "name": "Site", "lat": 19.071, "lng": 72.8702}
+        index = geofence.build_index(offices, [task])
+        matches = geofence.locate(index, [19.071, 19.2], [72.87, 72.87])
+        result = geofence.check_result(index, matches[0], offices)
+        assert result["isWithin"] and result["office"]["_id"] == str(big)
+        assert [f["name"] for f in result["fences"]] == ["Annex", "Site", "Campus"]
+        assert result["fences"][1] == {
+            "type": "task", "id": str(task["_id"]), "name": "Site", "distance": result["fences"][1]["distance"],
+            "radius": 300, "taskId": str(task["task"]),
+        }
+        assert matches[1] == []
+
+    def test_edges_and_input(self):
+        """Fences across a cell edge or the antimeridian are still found"""
+        edge = geofence.CELL_DEGREES * 40
+        offices = geofence.office_fences({"officeLocations": [
+            {"_id": ObjectId(), "name": "Edge", "coordinates": {"latitude": edge, "longitude": 10.0}},
+            {"_id": ObjectId(), "name": "Fiji", "coordinates": {"latitude": -17.0, "longitude": 179.999}},
+        ]})
+        index = geofence.build_index(offices, [])
+        matches = geofence.locate(index, [edge - 0.001, -17.0], [10.0, -179.999])
+        assert [[index["fences"][row][2] for row, _ in m] for m in matches] == [["Edge"], ["Fiji"]]
+        assert round(matches[1][0][1]) == round(float(geofence.haversine(-17.0, 179.999, -17.0, -179.999)))
+        assert geofence.parse_point({"coordinates": {"latitude": 19.5, "longitude": 72}}) == (19.5, 72.0)
+        for point in ({"coordinates": {"latitude": 0, "longitude": 72}}, {"latitude": "19", "longitude": 72}, {"latitude": 91, "longitude": 1}, None):
+            with pytest.raises(RequestError):
+                geofence.parse_point(point)
+
+
+def encoded(dataset, fmt, docs, users):
+    async def source():
+        for doc in docs:
+            yield doc
+
+    async def collect():
+        batches = exports.row_batches(dataset, source(), users)
+        return b"".join([chunk async for chunk in exports.encode_stream(exports.encoder_for(dataset, fmt), batches)])
+
+    return asyncio.run(collect())
+
+
+class TestExports:
+    """Test the export encoders, tenant scoping and the throughput benchmark"""
+
+    def test_csv_rows_and_formula_guard(self, monkeypatch):
+        """Rows arrive in chunks; user text that looks like a formula is quoted"""
+        monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 2)
+        user = ObjectId()
+        users = {user: {"firstName": "=HYPERLINK(1)", "lastName": "X"}}
+        day = datetime(2026, 1, 5, tzinfo=timezone.utc)
+        docs = [{"_id": ObjectId(), "user": user, "date": day, "status": "present", "workingHours": {"total": 480}}] * 5
+        body = encoded("attendance", "csv", docs, users)
+        rows = list(csv.reader(io.StringIO(body.decode("utf-8-sig"))))
+        assert rows[0][:4] == ["Date", "User ID", "Employee", "Status"] and len(rows) == 6
+        assert rows[1][:4] == ["2026-01-05T00:00:00.000Z", str(user), "'=HYPERLINK(1) X", "present"]
+        assert rows[1][-2:] == ["480", "0"]
+
+    def test_xlsx_is_a_valid_workbook(self):
+        """Streamed zip members open, and cells are escaped inline strings or numbers"""
+        docs = [{"_id": ObjectId(), "user": ObjectId(), "year": 2026, "month": 1, "grossSalary": 45000, "netSalary": 36621.5,
+                 "paymentStatus": "<pending & \x01>"}]
+        archive = zipfile.ZipFile(io.BytesIO(encoded("payroll", "xlsx", docs, {})))
+        assert archive.testzip() is None and "xl/workbook.xml" in archive.namelist()
+        sheet = archive.read("xl/worksheets/sheet1.xml").decode()
+        minidom.parseString(sheet)
+        assert '<c r="A2" t="inlineStr"><is><t xml:space="preserve">2026-02</t></is></c>' in sheet
+        assert '<c r="I2"><v>45000</v></c>' in sheet and "&lt;pending &amp; &gt;" in sheet
+        assert exports.column_letter(0) == "A" and exports.column_letter(27) == "AB"
+
+    def test_queries_stay_in_tenant(self):
+        """Admins export the company; others only their own rows"""
+        company, me, other = ObjectId(), ObjectId(), ObjectId()
+        employee = {"id": str(me), "company": str(company), "role": "employee"}
+        admin = {**employee, "role": "admin"}
+        assert exports.export_query("attendance", admin, {}) == {"company": company}
+        query = exports.export_query("attendance", employee, {"fromDate": "2026-01-01"})
+        assert query == {"company": company, "user": me, "date": {"$gte": datetime(2026, 1, 1, tzinfo=timezone.utc)}}
+        assert exports.export_query("tasks", admin, {"userId": str(other)})["$or"][0] == {"assignees": other}
+        assert exports.export_query("payroll", employee, {"year": "2026"}) == {"company": company, "user": me, "year": 2026}
+        for dataset, params in (("attendance", {"userId": str(other)}), ("tasks", {"toDate": "soon"}), ("payroll", {"year": "x"})):
+            with pytest.raises(RequestError):
+                exports.export_query(dataset, employee, params)
+
+    def test_failure_mid_stream_is_raised(self, monkeypatch):
+        """A cursor error after the first chunk reaches the server instead of ending the file"""
+        monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 1)
+        day = datetime(2026, 1, 5, tzinfo=timezone.utc)
+
+        async def cursor(dataset, query):
+            yield {"_id": ObjectId(), "user": ObjectId(), "date": day, "status": "present"}
+            raise PyMongoError("cursor killed")
+
+        async def users(company):
+            return {}
+
+        async def collect(chunks):
+            async for chunk in exports.export_stream("attendance", "csv", {}, ObjectId()):
+                chunks.append(chunk)
+
+        monkeypatch.setattr(exports, "export_cursor", cursor)
+        monkeypatch.setattr(exports, "company_users", users)
+        failed = exports.export_stats["failed"]
+        chunks = []
+        with pytest.raises(PyMongoError):
+            asyncio.run(collect(chunks))
+        assert chunks and exports.export_stats["failed"] == failed + 1
+        assert admission.route_class("GET", "exports/attendance") == "heavy"
+
+    def test_benchmark_reports_throughput(self):
+        """Every case reports rows/s and heap; slower or heavier runs are flagged"""
+        results = asyncio.run(export_bench.run_benchmark(export_bench.parse_args(["--rows", "300", "--users", "5"])))
+        assert [r["case"] for r in results][:2] == ["tasks.csv", "tasks.xlsx"] and len(results) == 6
+        assert all(r["rows"] == 300 and r["rows_per_s"] > 0 for r in results)
+        slower = [{**results[0], "rows_per_s": results[0]["rows_per_s"] / 2, "peak_heap_mb": results[0]["peak_heap_mb"] * 3 + 2}]
+        assert len(export_bench.find_regressions(slower, results, 0.2)) == 2
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from urllib.parse import parse_qsl
+
+from log_queue import start_file_writer, stop_file_writer
+from request_identity import auth_subject, tenant_of
+from route_labels import route_template
+
+TRAFFIC_CAPTURE_FILE = os.environ.get("TRAFFIC_CAPTURE_FILE", "")
+TRAFFIC_CAPTURE_SAMPLE = float(os.environ.get("TRAFFIC_CAPTURE_SAMPLE", "1"))
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.environ.get("TRAFFIC_CAPTURE_MAX_BYTES", str(100 * 1024 * 1024)))
+TRAFFIC_CAPTURE_BACKUPS = int(os.environ.get("TRAFFIC_CAPTURE_BACKUPS", "3"))
+TRAFFIC_CAPTURE_QUEUE = int(os.environ.get("TRAFFIC_CAPTURE_QUEUE", "10000"))
+TRAFFIC_CAPTURE_PLAIN_KEYS = set(
+    os.environ.get("TRAFFIC_CAPTURE_PLAIN_KEYS", "status,priority,isSelfTask,transport,EIO,type,sort,order").split(",")
+)
+# Values safe to keep verbatim: they shape the load (pagination, flags,
+# date windows) without identifying anyone. Free text is only kept for
+# enum-like keys; everything else becomes a salted pseudonym.
+PLAIN_QUERY_VALUE = re.compile(r"\d{1,6}|true|false|\d{4}-\d{2}-\d{2}(T[\d:.]+Z?)?", re.IGNORECASE)
+ENUM_QUERY_VALUE = re.compile(r"[a-z][a-z_-]{0,19}", re.IGNORECASE)
+OBJECT_ID = re.compile(r"[0-9a-f]{24}", re.IGNORECASE)
+
+capture_stats = {"recorded": 0, "dropped": 0, "skipped": 0}
+capture_state = {"listener": None, "started": 0.0, "salt": b""}
+capture_logger = logging.getLogger("foratask.traffic")
+capture_logger.propagate = False
+
+def start_capture():
+    # Recording must never slow the request path down; a full queue means
+    # the writer is behind and the record is dropped.
+    if not TRAFFIC_CAPTURE_FILE or capture_state["listener"]:
+        return
+    listener = start_file_writer(
+        capture_logger, TRAFFIC_CAPTURE_FILE, TRAFFIC_CAPTURE_MAX_BYTES, TRAFFIC_CAPTURE_BACKUPS, TRAFFIC_CAPTURE_QUEUE,
+        capture_stats, "dropped",
+    )
+    # A fresh salt per capture keeps pseudonyms consistent within one file
+    # but unlinkable across files.
+    capture_state.update(listener=listener, started=time.time(), salt=os.urandom(16))
+
+def stop_capture():
+    listener = capture_state["listener"]
+    if not listener:
+        return
+    stop_file_writer(capture_logger, listener)
+    capture_state["listener"] = None
+
+def pseudonym(value: str):
+    digest = hashlib.blake2b(value.encode(), key=capture_state["salt"], digest_size=4).hexdigest()
+    return f"~{digest}"
+
+def anonymize_query(query: str):
+    anonymized = []
+    for key, value in parse_qsl(query, keep_blank_values=True):
+        if OBJECT_ID.fullmatch(value):
+            value = ":id"
+        elif key in TRAFFIC_CAPTURE_PLAIN_KEYS and ENUM_QUERY_VALUE.fullmatch(value):
+            pass
+        elif value and not PLAIN_QUERY_VALUE.fullmatch(value):
+            value = pseudonym(value)
+        anonymized.append([key, value])
+    return anonymized
+
+def capture_record(scope, status: int, request_bytes: int, response_bytes: int, started: float, duration: float):
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"] if k == b"authorization"}
+    return {
+        "t": round(started - capture_state["started"], 4),
+        "method": scope["method"],
+        "route": route_template(scope["path"][5:]),
+        "query": anonymize_query(scope.get("query_string", b"").decode("latin-1")),
+        "tenant": pseudonym(tenant_of(headers)),
+        "user": pseudonym(auth_subject(headers)),
+        "req_bytes": request_bytes,
+        "resp_bytes": response_bytes,
+        "status": status,
+        "ms": round(duration * 1000, 2),
+    }
+
+def capture_summary():
+    return {**capture_stats, "file": TRAFFIC_CAPTURE_FILE or None, "active": capture_state["listener"] is not None}
+
+class TrafficCaptureMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not capture_state["listener"] or scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        if TRAFFIC_CAPTURE_SAMPLE < 1 and random.random() >= TRAFFIC_CAPTURE_SAMPLE:
+            capture_stats["skipped"] += 1
+            await self.app(scope, receive, send)
+            return
+        started_wall = time.time()
+        started = time.perf_counter()
+        sizes = {"request": 0, "response": 0}
+        status = 500
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            record = capture_record(
+                scope, status, sizes["request"], sizes["response"], started_wall, time.perf_counter() - started
+            )
+            capture_logger.info(json.dumps(record, separators=(",", ":")))
+            capture_stats["recorded"] += 1
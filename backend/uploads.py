@@ -0,0 +1,131 @@
+import mimetypes
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio
+from fastapi.responses import Response
+
+from http_validators import etag_matches, not_modified_response
+
+UPLOADS_SERVE_LOCAL = os.environ.get("UPLOADS_SERVE_LOCAL", "1") == "1"
+UPLOADS_DIR = os.path.realpath(os.environ.get("UPLOADS_DIR", "/app/foratask-backend/uploads"))
+# Multer names files "<name>-<timestamp><ext>", so a URL never changes content.
+UPLOADS_CACHE_CONTROL = os.environ.get("UPLOADS_CACHE_CONTROL", "public, max-age=31536000, immutable")
+UPLOADS_CHUNK_BYTES = 64 * 1024
+
+class UploadFileResponse(Response):
+    def __init__(self, path: str, start: int, length: int, status_code: int, headers, send_body=True):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.length,
+                })
+            return
+        # Servers without zero-copy support (uvicorn) get fixed-size reads
+        # off the event loop, so memory per download stays at one chunk.
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await f.read(min(UPLOADS_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b""})
+
+def resolve_upload(relative: str):
+    if "\x00" in relative:
+        return None
+    candidate = os.path.realpath(os.path.join(UPLOADS_DIR, relative.lstrip("/")))
+    if os.path.commonpath([candidate, UPLOADS_DIR]) != UPLOADS_DIR or candidate == UPLOADS_DIR:
+        return None
+    try:
+        info = os.stat(candidate)
+    except OSError:
+        return None
+    return (candidate, info) if stat.S_ISREG(info.st_mode) else None
+
+def upload_etag(info: os.stat_result):
+    return f'"{info.st_size:x}-{info.st_mtime_ns:x}"'
+
+def parse_range(header: str, size: int):
+    # Returns (start, end) inclusive, None to serve the whole file, or
+    # "unsatisfiable". Multi-range requests get the whole file (RFC 9110
+    # lets a server ignore Range).
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return "unsatisfiable"
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+def not_modified_since(if_modified_since: str, info: os.stat_result):
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(info.st_mtime) <= since
+
+def serve_upload(relative: str, method: str, request_headers):
+    resolved = resolve_upload(relative)
+    if resolved is None:
+        return Response(content=b"Not Found", status_code=404)
+    path, info = resolved
+    etag = upload_etag(info)
+    last_modified = formatdate(info.st_mtime, usegmt=True)
+    headers = {
+        "accept-ranges": "bytes",
+        "cache-control": UPLOADS_CACHE_CONTROL,
+        "content-type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+        "etag": etag,
+        "last-modified": last_modified,
+    }
+    if_none_match = request_headers.get("if-none-match")
+    if etag_matches(if_none_match, etag) or (
+        not if_none_match and not_modified_since(request_headers.get("if-modified-since"), info)
+    ):
+        return not_modified_response(headers)
+
+    size = info.st_size
+    byte_range = None
+    if "range" in request_headers:
+        if_range = request_headers.get("if-range")
+        if not if_range or if_range == etag or if_range == last_modified:
+            byte_range = parse_range(request_headers["range"], size)
+    if byte_range == "unsatisfiable":
+        return Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+    if byte_range:
+        start, end = byte_range
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+        return UploadFileResponse(path, start, end - start + 1, 206, headers, send_body=method != "HEAD")
+    headers["content-length"] = str(size)
+    return UploadFileResponse(path, 0, size, 200, headers, send_body=method != "HEAD")
@@ -139,6 +139,12 @@ io.on("connection", (socket) => {
 global.io = io;
 global.connectedUsers = connectedUsers;
 
+// When the Python layer runs several workers, only one of them runs the crons
+function scheduleCron(expression, job) {
+  if (process.env.CRON_ENABLED === "false") return;
+  cron.schedule(expression, job);
+}
+
 function getRemainingTime(now, due) {
   let diffMs = due - now;
   if (diffMs < 0) diffMs = 0;
@@ -152,7 +158,7 @@ function getRemainingTime(now, due) {
   return `${minutes} minute${minutes > 1 ? "s" : ""}`;
 }
 
-cron.schedule("* * * * *", async () => {
+scheduleCron("* * * * *", async () => {
   try {
     const now = new Date();
     const overdueTasks = await Task.find({
@@ -241,7 +247,7 @@ cron.schedule("* * * * *", async () => {
     console.error("Cron job error:", err);
   }
 });
-cron.schedule("* * * * *", async () => {
+scheduleCron("* * * * *", async () => {
   try {
     console.log("🔔 Bulk Notification Cron Started...");
 
@@ -330,7 +336,7 @@ cron.schedule("* * * * *", async () => {
   }
 });
 
-cron.schedule("0 0 * * *", async () => {
+scheduleCron("0 0 * * *", async () => {
   try {
     await Notification.deleteMany({ expiresAt: { $lt: new Date() } });
     
@@ -422,7 +428,7 @@ cron.schedule("0 0 * * *", async () => {
 });
 
 // Subscription expiry notification cron - runs every hour
-cron.schedule("0 * * * *", async () => {
+scheduleCron("0 * * * *", async () => {
   try {
     console.log("📅 Checking subscription expiry notifications...");
     const now = new Date();
@@ -518,7 +524,7 @@ mongoose.connect(MONGO_URI).then(async () => {
   await seedMasterAdmin();
   
   server.listen(PORT, () => {
-    console.log('Server running on 3000');
+    console.log(`Server running on ${PORT}`);
   })
 }).catch((err) => {
   console.log(err);
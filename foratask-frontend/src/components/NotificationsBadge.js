@@ -21,20 +21,20 @@ const NotificationsBadge = memo(() => {
     console.log("Render");
 
 
+    const applyUnreadCount = (newCount) => {
+        // Trigger shake only if new notifications arrived
+        if (newCount > prevCount.current) {
+            triggerShake();
+        }
+
+        prevCount.current = newCount;
+        setUnreadCount(newCount);
+    };
+
     const fetchUnreadCount = async () => {
         try {
             const res = await api.get('/notifications/unreadCount');
-            const newCount = res.data.count;
-
-            // Trigger shake only if new notifications arrived
-            if (newCount > prevCount.current) {
-                triggerShake();
-                console.log("hello");
-
-            }
-
-            prevCount.current = newCount;
-            setUnreadCount(newCount);
+            applyUnreadCount(res.data.count);
         } catch (error) {
             console.error('Failed to fetch unread count:', error);
         }
@@ -77,21 +77,60 @@ const NotificationsBadge = memo(() => {
     };
 
     useEffect(() => {
+        let source = null;
+        let retryTimer = null;
+        let closed = false;
+        let lastEventId = null;
+
+        const startPolling = (interval) => {
+            clearInterval(intervalRef.current);
+            intervalRef.current = setInterval(fetchUnreadCount, interval);
+        };
 
+        // Where EventSource exists (web), the proxy pushes the count as it
+        // changes; the URL carries a single-use ticket, never the token.
+        const openStream = async () => {
+            try {
+                const res = await api.post('/notifications/stream-ticket');
+                if (closed) return;
+                const ticket = encodeURIComponent(res.data.ticket);
+                // A new EventSource starts without Last-Event-ID, so the
+                // resume point goes in the URL
+                const resume = lastEventId ? `&lastEventId=${encodeURIComponent(lastEventId)}` : '';
+                source = new EventSource(`${api.defaults.baseURL}/notifications/stream?ticket=${ticket}${resume}`);
+                source.addEventListener('unread', (event) => applyUnreadCount(JSON.parse(event.data).count));
+                source.addEventListener('notification', (event) => {
+                    lastEventId = event.lastEventId;
+                });
+                source.onerror = () => {
+                    // A used ticket can't reconnect, so each retry asks for a new one
+                    source.close();
+                    if (!closed) retryTimer = setTimeout(openStream, 5000);
+                };
+            } catch (error) {
+                startPolling(60000); // Poll every 60 seconds
+            }
+        };
 
-        // Set up polling interval
-        intervalRef.current = setInterval(fetchUnreadCount, 60000); // Poll every 60 seconds
+        fetchUnreadCount();
+        if (typeof EventSource !== 'undefined') {
+            openStream();
+            // Reads only reach the stream where Mongo has change streams
+            startPolling(300000);
+        } else {
+            startPolling(60000); // Poll every 60 seconds
+        }
 
         // Cleanup
         return () => {
+            closed = true;
+            if (source) source.close();
+            clearTimeout(retryTimer);
             if (intervalRef.current) {
                 clearInterval(intervalRef.current);
             }
         };
-    }, []); 
-    useEffect(() => {
-        fetchUnreadCount();
-    }, [])
+    }, []);
 
     return (
         <Animated.View
@@ -22,7 +22,7 @@ export default function Chat() {
   useEffect(() => {
     loadRooms();
     loadUsers();
-    socketRef.current = io(SOCKET_URL, { path: '/api/socket.io', transports: ['polling'] });
+    socketRef.current = io(SOCKET_URL, { path: '/api/socket.io', transports: ['polling', 'websocket'] });
     socketRef.current.on('connect', () => { socketRef.current.emit('registerUser', user?.id); });
     socketRef.current.on('newMessage', (data) => {
       if (data.roomId === activeRoom?._id) setMessages(prev => [...prev, data.message]);